@@ -0,0 +1,81 @@
+"""Benchmark for decoding paginated API responses (`jsonbackend`).
+
+Decodes `label/get` pages with every available backend, with and without
+trimming the albums, and reports the memory the decoded pages retain.
+Pass recorded responses (raw JSON files) to use real pages, otherwise
+synthetic 500-album pages are generated.
+
+    python benchmarks/bench_json_decode.py [page.json ...] -n 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_queue_memory import pages  # noqa: E402
+
+from qobuz_dj import jsonbackend  # noqa: E402
+
+
+def load_fixtures(paths, count):
+    if paths:
+        result = []
+        for path in paths:
+            with open(path, "rb") as f:
+                result.append(f.read())
+        return result
+    return [json.dumps(page).encode() for page in pages(count * 500)]
+
+
+def decode(raw_pages, trimmed):
+    decoded = []
+    for raw in raw_pages:
+        page = jsonbackend.loads(raw)
+        if trimmed:
+            jsonbackend.trim_albums(page)
+        decoded.append(page)
+    return decoded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pages", nargs="*", help="recorded label/get responses")
+    parser.add_argument("-n", "--count", type=int, default=20, help="synthetic pages")
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    raw_pages = load_fixtures(args.pages, args.count)
+    size = sum(len(raw) for raw in raw_pages)
+    print(f"{len(raw_pages)} pages, {size / 2**20:.1f} MiB of JSON")
+
+    for backend in jsonbackend.BACKENDS:
+        jsonbackend.use(backend)
+        for trimmed in (False, True):
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                decode(raw_pages, trimmed)
+                timings.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            decoded = decode(raw_pages, trimmed)
+            retained, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del decoded
+
+            best = min(timings)
+            print(
+                f"{backend:>6} {'trimmed' if trimmed else 'full':>9}: "
+                f"{best:.3f}s, {size / best / 2**20:6.1f} MiB/s, "
+                f"{retained / 2**20:6.1f} MiB retained"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Peak memory of a large label queue: full page dicts vs `QueueItem`s.
+
+Albums are shaped like the items of `label/get` pages (nested artist,
+label, image and genre objects) and measured with tracemalloc.
+
+    python benchmarks/bench_queue_memory.py -n 100000
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qobuz_dj.pipeline import QueueItem  # noqa: E402
+
+
+def pages(count, page_size=500):
+    for offset in range(0, count, page_size):
+        items = []
+        for i in range(offset, min(count, offset + page_size)):
+            artist = {"id": i % 997, "name": f"Artist {i % 997}", "albums_count": 12}
+            items.append(
+                {
+                    "id": f"{i:013d}",
+                    "title": f"Album {i}",
+                    "version": None,
+                    "maximum_bit_depth": 24,
+                    "maximum_sampling_rate": 96.0,
+                    "maximum_channel_count": 2,
+                    "release_date_original": "2020-01-01",
+                    "released_at": 1577836800,
+                    "duration": 3600,
+                    "tracks_count": 12,
+                    "media_count": 1,
+                    "upc": f"{i:012d}",
+                    "streamable": True,
+                    "hires": True,
+                    "artist": artist,
+                    "artists": [{"id": artist["id"], "name": artist["name"]}],
+                    "label": {"id": 1, "name": "Label", "albums_count": count},
+                    "genre": {"id": 80, "name": "Jazz", "path": [80], "slug": "jazz"},
+                    "image": {
+                        size: f"https://static.qobuz.com/images/covers/{i}_{size}.jpg"
+                        for size in ("small", "thumbnail", "large", "back")
+                    },
+                }
+            )
+        yield {"name": "Label", "albums_count": count, "albums": {"items": items}}
+
+
+def full_dicts(count):
+    return [x for page in pages(count) for x in page["albums"]["items"]]
+
+
+def queue_items(count):
+    return [
+        QueueItem.from_dict(x, "album", i)
+        for i, x in enumerate(
+            (x for page in pages(count) for x in page["albums"]["items"]), 1
+        )
+    ]
+
+
+def peak(fn, count):
+    tracemalloc.start()
+    result = fn(count)
+    _, peak_size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak_size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--albums", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, fn in (("full dicts", full_dicts), ("QueueItem", queue_items)):
+        size = peak(fn, args.albums)
+        print(
+            f"{name:>10}: peak {size / 2**20:8.1f} MiB, "
+            f"{size / args.albums:6.0f} bytes/album"
+        )
+
+
+if __name__ == "__main__":
+    main()
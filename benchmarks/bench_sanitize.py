@@ -0,0 +1,66 @@
+"""Benchmark for the `sz` planning phase.
+
+Builds a temporary crate of tagged MP3s and reports how many files per
+second `build_sanitize_plan` reads, serially and with the thread pool.
+
+    python benchmarks/bench_sanitize.py -n 5000
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mutagen.id3 import ID3, TDRC, TIT2, TPE1  # noqa: E402
+
+from qobuz_dj.utils import build_sanitize_plan  # noqa: E402
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417 bytes per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def make_crate(directory, count, per_folder=500):
+    template = os.path.join(directory, "template.mp3")
+    with open(template, "wb") as f:
+        f.write(MP3_FRAME * 64)
+    for i in range(count):
+        folder = os.path.join(directory, f"crate {i // per_folder:03d}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"track {i:06d}.mp3")
+        shutil.copyfile(template, path)
+        tags = ID3()
+        tags.add(TPE1(encoding=3, text=f"Artist {i % 97}"))
+        tags.add(TIT2(encoding=3, text=f"Title {i}"))
+        tags.add(TDRC(encoding=3, text=str(1970 + i % 50)))
+        tags.save(path)
+    os.remove(template)
+
+
+def run(directory, count, workers):
+    start = time.perf_counter()
+    plan = build_sanitize_plan(directory, workers)
+    elapsed = time.perf_counter() - start
+    assert len(plan) == count
+    label = "serial" if workers == 1 else f"{workers or 'auto'} workers"
+    print(f"{label:>12}: {elapsed:7.2f}s  {count / elapsed:9.0f} files/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--files", type=int, default=2000)
+    parser.add_argument("-j", "--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_crate(directory, args.files)
+        print(f"sanitize plan over {args.files} files")
+        run(directory, args.files, 1)
+        run(directory, args.files, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Benchmark for `smart_discography_filter` over a synthetic discography.
+
+Feeds 500-album pages (the API page size) from a generator, the same way
+`Client.get_artist_meta` yields them.
+
+    python benchmarks/bench_smart_discography.py -n 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qobuz_dj.utils import smart_discography_filter  # noqa: E402
+
+VERSIONS = [None, "", "Remastered", "2011 Remaster", "Deluxe Edition", "Live"]
+
+
+def pages(count, seed=0, page_size=500):
+    rnd = random.Random(seed)
+    for offset in range(0, count, page_size):
+        items = []
+        for i in range(offset, min(count, offset + page_size)):
+            items.append(
+                {
+                    "id": str(i),
+                    "title": f"Album {rnd.randrange(count // 4)}"
+                    + rnd.choice(["", " (Live)", " [Deluxe]", " (Remastered)"]),
+                    "version": rnd.choice(VERSIONS),
+                    "maximum_bit_depth": rnd.choice([16, 24]),
+                    "maximum_sampling_rate": rnd.choice([44.1, 48.0, 96.0, 192.0]),
+                    "release_date_original": f"{rnd.randrange(1960, 2026)}-01-01",
+                    "artist": {"name": rnd.choice(["Artist", "Artist", "Guest"])},
+                }
+            )
+        yield {"name": "Artist", "albums": {"items": items}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--albums", type=int, default=50000)
+    parser.add_argument("-r", "--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.repeat):
+        content = list(pages(args.albums))
+        start = time.perf_counter()
+        items = smart_discography_filter(
+            iter(content), save_space=True, skip_extras=True
+        )
+        timings.append(time.perf_counter() - start)
+
+    best = min(timings)
+    print(
+        f"smart_discography_filter over {args.albums} albums "
+        f"({len(content)} pages): {best:.3f}s, {args.albums / best:,.0f} albums/s, "
+        f"{len(items)} selected"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Microbenchmark for tagging a 100-track box set.
+
+Compares building the album-level tags for every track (before) with a
+single `AlbumTagTemplate` shared by the whole release (after), for both
+FLAC and MP3.
+
+    python benchmarks/bench_tagging.py -n 100
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qobuz_dj.metadata import AlbumTagTemplate, tag_flac, tag_mp3  # noqa: E402
+
+MP3_DATA = (b"\xff\xfb\x90\x64" + b"\x00" * 413) * 16
+_INFO = (44100 << 44) | (1 << 41) | (15 << 36)
+FLAC_DATA = (
+    b"fLaC\x80\x00\x00\x22\x10\x00\x10\x00"
+    + b"\x00" * 6
+    + _INFO.to_bytes(8, "big")
+    + b"\x00" * 16
+)
+
+ALBUM = {
+    "id": "box",
+    "title": "The Complete Æ Recordings",
+    "version": "Remastered",
+    "artist": {"name": "Æ Orchestra"},
+    "genres_list": [
+        "Classique",
+        "Classique→Musique symphonique",
+        "Classique→Musique symphonique→Symphonies",
+    ],
+    "tracks_count": 100,
+    "release_date_original": "1999-01-01",
+    "copyright": "(P) 1999 Label (C) 2020 Label",
+    "label": {"name": "Æ Label"},
+}
+
+
+def run(directory, tag, data, ext, tracks, shared):
+    template = AlbumTagTemplate(ALBUM) if shared else None
+    paths = []
+    for track in tracks:
+        path = os.path.join(directory, f".{track['id']:03}.tmp")
+        with open(path, "wb") as f:
+            f.write(data)
+        paths.append(path)
+
+    start = time.perf_counter()
+    for path, track in zip(paths, tracks, strict=True):
+        final = os.path.join(directory, f"{track['id']:03}{ext}")
+        tag(path, directory, final, track, ALBUM, False, False, template)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--tracks", type=int, default=100)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    tracks = [
+        {
+            "id": i,
+            "title": f"Symphony No. {i}",
+            "work": "Symphonies",
+            "track_number": i,
+            "media_number": 1 + i // 20,
+            "performer": {"name": "Æ Orchestra"},
+            "composer": {"name": "Composer"},
+        }
+        for i in range(1, args.tracks + 1)
+    ]
+
+    print(f"tagging a {args.tracks}-track box set (best of {args.repeat})")
+
+    # album-level work alone, without the file I/O that dominates tagging
+    timings = {False: [], True: []}
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for track in tracks:
+            AlbumTagTemplate.for_track(track, ALBUM, istrack=False)
+        timings[False].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        AlbumTagTemplate(ALBUM)
+        timings[True].append(time.perf_counter() - start)
+    print(
+        f"album tags: before {min(timings[False]) * 1000:7.2f}ms, "
+        f"after {min(timings[True]) * 1000:7.2f}ms"
+    )
+    for name, tag, data, ext in (
+        ("FLAC", tag_flac, FLAC_DATA, ".flac"),
+        ("MP3", tag_mp3, MP3_DATA, ".mp3"),
+    ):
+        results = {}
+        for shared in (False, True):
+            timings = []
+            for _ in range(args.repeat):
+                with tempfile.TemporaryDirectory() as directory:
+                    timings.append(run(directory, tag, data, ext, tracks, shared))
+            results[shared] = min(timings)
+        print(
+            f"{name:>5}: before {results[False] * 1000:7.1f}ms, "
+            f"after {results[True] * 1000:7.1f}ms "
+            f"({results[False] / results[True]:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,8 @@
+import multiprocessing
+
 from qobuz_dj.cli import main
 
 if __name__ == "__main__":
+    # needed by the process pool of `audit` in the frozen executables
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,89 @@
+"""Artwork stage for embedded covers.
+
+The saved `cover.jpg` is left untouched; only the copy embedded into every
+track is downscaled and recompressed. Processing runs once per album in a
+background worker, right after the cover is downloaded, so tagging only
+picks up the (usually finished) result.
+
+Pillow is optional: without it, covers are embedded as downloaded.
+"""
+
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBED_SIZE = 1000
+DEFAULT_EMBED_QUALITY = 90
+
+# results for the last few albums are enough: tracks of a release are
+# tagged right after each other
+_CACHE_SIZE = 4
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artwork")
+_cache: OrderedDict[tuple, Future] = OrderedDict()
+_lock = threading.Lock()
+
+
+def process_cover(
+    data: bytes, max_size=DEFAULT_EMBED_SIZE, quality=DEFAULT_EMBED_QUALITY
+) -> bytes:
+    """Downscales `data` so that neither side exceeds `max_size` pixels and
+    recompresses it as a JPEG of the given `quality`.
+
+    The original bytes are returned when they are already small enough,
+    when the result wouldn't be smaller, or when Pillow is unavailable.
+    """
+    if not max_size:
+        return data
+
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+
+    with Image.open(io.BytesIO(data)) as img:
+        if max(img.size) <= max_size and img.format == "JPEG":
+            return data
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality, optimize=True)
+
+    processed = out.getvalue()
+    return processed if len(processed) < len(data) else data
+
+
+def _load(path, max_size, quality) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return process_cover(data, max_size, quality)
+    except Exception as e:
+        logger.error(f"Error processing cover art, embedding original: {e}")
+        return data
+
+
+def prepare(path, max_size=DEFAULT_EMBED_SIZE, quality=DEFAULT_EMBED_QUALITY):
+    """Schedules the embedded version of the cover at `path`.
+
+    :returns: a Future resolving to the bytes to embed. Calls for the same
+        file and settings share a single result.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime, max_size, quality)
+    with _lock:
+        future = _cache.get(key)
+        if future is None:
+            future = _executor.submit(_load, path, max_size, quality)
+            _cache[key] = future
+            while len(_cache) > _CACHE_SIZE:
+                _cache.popitem(last=False)
+        else:
+            _cache.move_to_end(key)
+    return future
@@ -0,0 +1,231 @@
+"""Library audit: finds truncated and corrupt FLAC/MP3 files.
+
+Every file is streamed through the same verifiers used while downloading
+(see `verify`), spread over all cores with a process pool. Results are
+cached in a JSON file at the root of the audited directory, keyed by path,
+size and mtime, so reruns only check new or changed files. The cache is
+saved as the audit goes, so an interrupted audit resumes where it stopped.
+
+The output is a text file of Qobuz URLs that `qobuz-dj dl` can consume.
+Corrupt files without Qobuz IDs get the album of the other files in their
+folder or, failing that, the album found by the tag search of `retag`.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from qobuz_dj import retag, verify
+from qobuz_dj.color import GREEN, OFF, RED, YELLOW
+from qobuz_dj.exceptions import IntegrityError
+from qobuz_dj.retag import read_ids, read_legacy_tags
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = ".qobuz-dj-audit.json"
+EXTENSIONS = (".flac", ".mp3")
+
+_CHUNK_SIZE = 1024 * 1024
+# files checked between saves of the cache
+SAVE_EVERY = 500
+
+
+def audit_file(path) -> str | None:
+    """Verifies `path`, returning the reason it is corrupt or None if it's
+    fine."""
+    extension = os.path.splitext(path)[1].lower()
+    verifier = verify.verifier_for(extension)
+    if verifier is None:
+        return None
+    try:
+        with open(path, "rb") as f:
+            while chunk := f.read(_CHUNK_SIZE):
+                verifier.update(chunk)
+        verifier.finish()
+    except IntegrityError as e:
+        verifier.abort()
+        return str(e)
+    except OSError as e:
+        verifier.abort()
+        return f"unreadable: {e}"
+    return None
+
+
+def _check(path):
+    """Process pool job: returns (error, track_id, album_id)."""
+    error = audit_file(path)
+    if error is None:
+        return None, None, None
+    try:
+        track_id, album_id, _ = read_ids(path)
+    except Exception:
+        track_id = album_id = None
+    return error, track_id, album_id
+
+
+def _load_cache(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, cache):
+    tmp = f"{path}.part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def _folder_album(folder) -> str | None:
+    """Album ID found in the tags of the files of `folder`."""
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(EXTENSIONS) or name.startswith("."):
+            continue
+        try:
+            album_id = read_ids(os.path.join(folder, name))[1]
+        except Exception:
+            continue
+        if album_id:
+            return album_id
+    return None
+
+
+def _match_legacy(bad, directory, get_client):
+    """Finds the album of the corrupt files without Qobuz IDs. Updates
+    `bad` in place.
+
+    :param get_client: callable returning a logged in `qopy.Client` for
+        the tag search, None to only look at the folders
+    """
+    legacy = sorted(path for path, (_, t, a) in bad.items() if not (t or a))
+    if not legacy:
+        return
+    cache = None
+    folders = {}
+    for path in legacy:
+        folder = os.path.dirname(path)
+        if folder not in folders:
+            folders[folder] = _folder_album(folder)
+        album_id = folders[folder]
+
+        if album_id is None and get_client is not None:
+            try:
+                tags = read_legacy_tags(path)
+            except Exception:
+                tags = None
+            if tags:
+                if cache is None:
+                    cache = retag.MetadataCache(
+                        os.path.join(directory, retag.CACHE_FILE), get_client
+                    )
+                album_id = cache.search(*tags[:3])
+
+        if album_id:
+            bad[path] = (bad[path][0], None, album_id)
+    if cache is not None:
+        cache.save()
+
+
+def _redownload_list(bad):
+    """Builds the lines of the re-download list. Whole albums are listed
+    when possible: `dl` skips the tracks that still exist."""
+    lines = [
+        "# qobuz-dj audit: corrupt files. Remove them (or run audit with",
+        "# --remove) and download again with: qobuz-dj dl --no-db <this file>",
+    ]
+    urls = []
+    for path, (error, track_id, album_id) in sorted(bad.items()):
+        lines.append(f"# {path}: {error}")
+        if album_id:
+            url = f"https://play.qobuz.com/album/{album_id}"
+        elif track_id:
+            url = f"https://play.qobuz.com/track/{track_id}"
+        else:
+            lines.append("# (no Qobuz ID in the file, search for it manually)")
+            continue
+        if url not in urls:
+            urls.append(url)
+    return lines + urls
+
+
+def audit_library(directory, output, workers=None, remove=False, get_client=None):
+    """Audits every FLAC/MP3 under `directory` and writes the URLs to
+    download again to `output`.
+
+    :param int workers: number of processes (default: number of cores)
+    :param bool remove: delete the corrupt files
+    :param get_client: callable returning a logged in `qopy.Client`, to
+        search the albums of corrupt files without Qobuz IDs; only called
+        when one can't be found in its folder
+    :returns: dict of corrupt paths to (error, track_id, album_id)
+    """
+    cache_path = os.path.join(directory, CACHE_FILE)
+    cache = _load_cache(cache_path)
+
+    files = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(EXTENSIONS) and not name.startswith("."):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files[os.path.relpath(path, directory)] = [stat.st_size, stat.st_mtime]
+
+    pending = [
+        rel for rel, key in files.items() if rel not in cache or cache[rel][:2] != key
+    ]
+    logger.info(
+        f"{YELLOW}Auditing {len(pending)} files "
+        f"({len(files) - len(pending)} unchanged since the last audit)"
+    )
+
+    if pending:
+        paths = [os.path.join(directory, rel) for rel in pending]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(_check, paths, chunksize=8)
+                for i, (rel, result) in enumerate(
+                    zip(pending, results, strict=True), 1
+                ):
+                    cache[rel] = files[rel] + list(result)
+                    if i % SAVE_EVERY == 0:
+                        _save_cache(cache_path, cache)
+        finally:
+            # what was checked isn't checked again, even if interrupted
+            _save_cache(cache_path, cache)
+
+    # forget deleted files
+    cache = {rel: entry for rel, entry in cache.items() if rel in files}
+
+    bad = {}
+    for rel, (_, _, error, track_id, album_id) in cache.items():
+        if error is not None:
+            bad[os.path.join(directory, rel)] = (error, track_id, album_id)
+    # before removing anything: the tags are read again
+    _match_legacy(bad, directory, get_client)
+
+    if remove:
+        for path in bad:
+            try:
+                os.remove(path)
+                del cache[os.path.relpath(path, directory)]
+            except OSError as e:
+                logger.error(f"{RED}Error removing {path}: {e}")
+
+    _save_cache(cache_path, cache)
+
+    if not bad:
+        logger.info(f"{GREEN}All {len(files)} files are fine")
+        return bad
+
+    for path, (error, _, _) in sorted(bad.items()):
+        logger.info(f"{RED}{path}: {error}")
+    with open(output, "w", encoding="utf-8") as f:
+        f.write("\n".join(_redownload_list(bad)) + "\n")
+    logger.info(
+        f"{OFF}{len(bad)} corrupt files{' removed' if remove else ''}. "
+        f"Re-download list written to {output}"
+    )
+    return bad
@@ -5,6 +5,8 @@ from collections import OrderedDict
 
 from requests import Session
 
+from qobuz_dj.qopy import TIMEOUT
+
 # Modified code based on DashLt's spoofbuz
 
 logger = logging.getLogger(__name__)
@@ -32,7 +34,7 @@ class Bundle:
         self._session = Session()
 
         logger.debug("Getting logging page")
-        response = self._session.get(f"{_BASE_URL}/login")
+        response = self._session.get(f"{_BASE_URL}/login", timeout=TIMEOUT)
         response.raise_for_status()
 
         bundle_url_match = _BUNDLE_URL_REGEX.search(response.text)
@@ -42,7 +44,7 @@ class Bundle:
         bundle_url = bundle_url_match.group(1)
 
         logger.debug("Getting bundle")
-        response = self._session.get(_BASE_URL + bundle_url)
+        response = self._session.get(_BASE_URL + bundle_url, timeout=TIMEOUT)
         response.raise_for_status()
 
         self._bundle = response.text
@@ -1,15 +1,17 @@
 import configparser
-import glob
 import hashlib
 import logging
 import os
 import sys
 
+from qobuz_dj import concurrency, tempfiles
+from qobuz_dj.artwork import DEFAULT_EMBED_QUALITY, DEFAULT_EMBED_SIZE
 from qobuz_dj.bundle import Bundle
 from qobuz_dj.color import GREEN, RED, YELLOW
 from qobuz_dj.commands import qobuz_dj_args
 from qobuz_dj.core import QobuzDL
 from qobuz_dj.downloader import DEFAULT_FOLDER, DEFAULT_TRACK
+from qobuz_dj.exceptions import InvalidTemplate
 from qobuz_dj.utils import (
     sanitize_directory,
 )
@@ -63,8 +65,12 @@ def _reset_config(config_file):
     config["DEFAULT"]["no_fallback"] = "false"
     config["DEFAULT"]["og_cover"] = "false"
     config["DEFAULT"]["embed_art"] = "false"
+    config["DEFAULT"]["embed_art_size"] = str(DEFAULT_EMBED_SIZE)
+    config["DEFAULT"]["embed_art_quality"] = str(DEFAULT_EMBED_QUALITY)
     config["DEFAULT"]["no_cover"] = "false"
     config["DEFAULT"]["no_database"] = "false"
+    config["DEFAULT"]["hedge_budget"] = "0"
+    config["DEFAULT"]["staging_dir"] = ""
     logging.info(f"{YELLOW}Getting tokens. Please wait...")
     bundle = Bundle()
     config["DEFAULT"]["app_id"] = str(bundle.get_app_id())
@@ -81,25 +87,37 @@ def _reset_config(config_file):
     )
 
 
-def _remove_leftovers(directory):
-    directory = os.path.join(directory, "**", ".*.tmp")
-    for i in glob.glob(directory, recursive=True):
-        try:
-            os.remove(i)
-        except:  # noqa
-            pass
-
-
 def _handle_commands(qobuz, arguments):
     if arguments.rebuild_db:
         qobuz.rebuild_db()
         return
 
+    tempfiles.registry.attach(qobuz.directory)
     try:
         if arguments.command in ("dl", "dj"):
             if arguments.command == "dj":
                 arguments.dj = True
             qobuz.download_list_of_urls(arguments.SOURCE)
+        elif arguments.command == "sync":
+            from qobuz_dj.sync import sync_favorites, sync_playlists
+
+            if arguments.target == "playlists":
+                sync_playlists(qobuz, arguments.workers, arguments.full)
+            else:
+                sync_favorites(
+                    qobuz, arguments.types or ("albums", "tracks"), arguments.full
+                )
+        elif arguments.command == "plan":
+            from qobuz_dj.plan import make_plan
+
+            make_plan(qobuz, arguments.SOURCE, arguments.output, arguments.workers)
+        elif arguments.command == "apply":
+            from qobuz_dj.plan import apply_plan
+
+            try:
+                apply_plan(qobuz, arguments.PLAN, arguments.workers)
+            except (OSError, ValueError) as e:
+                logging.error(f"{RED}Invalid plan: {e}")
         elif arguments.command == "lucky":
             query = " ".join(arguments.QUERY)
             qobuz.lucky_type = arguments.type
@@ -108,6 +126,7 @@ def _handle_commands(qobuz, arguments):
         else:
             qobuz.interactive_limit = arguments.limit
             qobuz.interactive()
+        qobuz.retry_failed()
 
     except KeyboardInterrupt:
         logging.info(
@@ -116,7 +135,10 @@ def _handle_commands(qobuz, arguments):
         )
 
     finally:
-        _remove_leftovers(qobuz.directory)
+        # in-flight files of every worker, before their temp files are removed
+        qobuz.flush_movers()
+        tempfiles.registry.cleanup()
+        concurrency.log_limits()
 
 
 def _initial_checks():
@@ -146,8 +168,16 @@ def main():
         no_fallback = config.getboolean("DEFAULT", "no_fallback")
         og_cover = config.getboolean("DEFAULT", "og_cover")
         embed_art = config.getboolean("DEFAULT", "embed_art")
+        embed_art_size = config.getint(
+            "DEFAULT", "embed_art_size", fallback=DEFAULT_EMBED_SIZE
+        )
+        embed_art_quality = config.getint(
+            "DEFAULT", "embed_art_quality", fallback=DEFAULT_EMBED_QUALITY
+        )
         no_cover = config.getboolean("DEFAULT", "no_cover")
         no_database = config.getboolean("DEFAULT", "no_database")
+        hedge_budget = config.getfloat("DEFAULT", "hedge_budget", fallback=0)
+        staging_dir = config.get("DEFAULT", "staging_dir", fallback="")
         app_id = config["DEFAULT"]["app_id"]
         smart_discography = config.getboolean("DEFAULT", "smart_discography")
         folder_format = config["DEFAULT"]["folder_format"]
@@ -168,7 +198,43 @@ def main():
             )
 
     if arguments.command == "sz":
-        sanitize_directory(arguments.directory)
+        sanitize_directory(
+            arguments.directory,
+            dry_run=arguments.dry_run,
+            workers=arguments.workers,
+        )
+        sys.exit()
+
+    if arguments.command == "audit":
+        from qobuz_dj.audit import audit_library
+        from qobuz_dj.qopy import Client
+
+        audit_library(
+            arguments.directory,
+            arguments.output,
+            workers=arguments.workers,
+            remove=arguments.remove,
+            get_client=lambda: Client(email, password, app_id, secrets),  # type: ignore
+        )
+        sys.exit()
+
+    if arguments.command == "clean":
+        removed = tempfiles.sweep(arguments.directory)
+        logging.info(f"{GREEN}Removed {removed} temporary files")
+        sys.exit()
+
+    if arguments.command == "retag":
+        from qobuz_dj.qopy import Client
+        from qobuz_dj.retag import retag_library
+
+        retag_library(
+            arguments.directory,
+            lambda: Client(email, password, app_id, secrets),  # type: ignore
+            workers=arguments.workers,
+            refresh=arguments.refresh,
+            embed_art_size=embed_art_size,  # type: ignore
+            embed_art_quality=embed_art_quality,  # type: ignore
+        )
         sys.exit()
 
     if arguments.reset:
@@ -199,7 +265,7 @@ def main():
         logging.info(f"{YELLOW}Fetching API docs from {docs_url}...")
         try:
             client = Client(email, password, app_id, secrets)  # type: ignore
-            r = client.session.get(docs_url)
+            r = client.session.get(docs_url, timeout=60)
             r.raise_for_status()
             debug_path = os.path.join(os.getcwd(), "qobuz_api_docs.json")
             with open(debug_path, "w", encoding="utf-8") as f:
@@ -220,21 +286,34 @@ def main():
     else:
         db_path = QOBUZ_DB
 
-    qobuz = QobuzDL(
-        arguments.directory,
-        arguments.quality,
-        arguments.embed_art or embed_art,  # type: ignore
-        ignore_singles_eps=arguments.albums_only or albums_only,  # type: ignore
-        no_m3u_for_playlists=arguments.no_m3u or no_m3u,  # type: ignore
-        quality_fallback=not arguments.no_fallback or not no_fallback,  # type: ignore
-        cover_og_quality=arguments.og_cover or og_cover,  # type: ignore
-        no_cover=arguments.no_cover or no_cover,  # type: ignore
-        downloads_db=db_path,  # type: ignore
-        folder_format=arguments.folder_format or folder_format,  # type: ignore
-        track_format=arguments.track_format or track_format,  # type: ignore
-        smart_discography=arguments.smart_discography or smart_discography,  # type: ignore
-        dj_mode=arguments.dj or arguments.command == "dj",
-    )
+    try:
+        qobuz = QobuzDL(
+            arguments.directory,
+            arguments.quality,
+            arguments.embed_art or embed_art,  # type: ignore
+            ignore_singles_eps=arguments.albums_only or albums_only,  # type: ignore
+            no_m3u_for_playlists=arguments.no_m3u or no_m3u,  # type: ignore
+            quality_fallback=not arguments.no_fallback or not no_fallback,  # type: ignore
+            cover_og_quality=arguments.og_cover or og_cover,  # type: ignore
+            no_cover=arguments.no_cover or no_cover,  # type: ignore
+            downloads_db=db_path,  # type: ignore
+            folder_format=arguments.folder_format or folder_format,  # type: ignore
+            track_format=arguments.track_format or track_format,  # type: ignore
+            smart_discography=arguments.smart_discography or smart_discography,  # type: ignore
+            dj_mode=arguments.dj or arguments.command == "dj",
+            embed_art_size=arguments.embed_size
+            if arguments.embed_size is not None
+            else embed_art_size,  # type: ignore
+            embed_art_quality=arguments.embed_quality or embed_art_quality,  # type: ignore
+            hedge_budget=arguments.hedge
+            if arguments.hedge is not None
+            else hedge_budget,  # type: ignore
+            staging_dir=arguments.staging_dir or staging_dir or None,  # type: ignore
+            since_last=arguments.since_last,
+            mirror_playlists=arguments.mirror,
+        )
+    except InvalidTemplate as e:
+        sys.exit(f"{RED}Invalid folder/track format {e}")
     if arguments.dj or arguments.command == "dj":
         qobuz.quality = 5
         qobuz.quality_fallback = False
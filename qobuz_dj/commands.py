@@ -83,9 +83,186 @@ def sz_args(subparsers):
         metavar="PATH",
         help="directory to sanitize",
     )
+    sz.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="print the rename plan without touching any file",
+    )
+    sz.add_argument(
+        "-j",
+        "--workers",
+        metavar="int",
+        type=int,
+        default=None,
+        help="number of threads used to read tags (default: automatic)",
+    )
     return sz
 
 
+def retag_args(subparsers):
+    retag = subparsers.add_parser(
+        "retag",
+        description="Re-apply the current tagging logic to downloaded files, "
+        "using cached or re-fetched Qobuz metadata.",
+        help="retag mode",
+    )
+    retag.add_argument(
+        "directory",
+        metavar="PATH",
+        help="directory to retag",
+    )
+    retag.add_argument(
+        "--refresh",
+        action="store_true",
+        help="re-fetch metadata from Qobuz instead of using the cache",
+    )
+    retag.add_argument(
+        "-j",
+        "--workers",
+        metavar="int",
+        type=int,
+        default=None,
+        help="number of threads (default: automatic)",
+    )
+    return retag
+
+
+def audit_args(subparsers):
+    audit = subparsers.add_parser(
+        "audit",
+        description="Find truncated or corrupt FLAC/MP3 files and write a list of "
+        "URLs to download again.",
+        help="audit mode",
+    )
+    audit.add_argument(
+        "directory",
+        metavar="PATH",
+        help="directory to audit",
+    )
+    audit.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        default="redownload.txt",
+        help="re-download list, usable with `dl` (default: redownload.txt)",
+    )
+    audit.add_argument(
+        "--remove",
+        action="store_true",
+        help="delete the corrupt files, so `dl` downloads them again",
+    )
+    audit.add_argument(
+        "-j",
+        "--workers",
+        metavar="int",
+        type=int,
+        default=None,
+        help="number of processes (default: number of CPUs)",
+    )
+    return audit
+
+
+def clean_args(subparsers):
+    clean = subparsers.add_parser(
+        "clean",
+        description="Remove the temporary files left by interrupted downloads. "
+        "Walks the whole directory tree, which can be slow on big libraries.",
+        help="clean mode",
+    )
+    clean.add_argument(
+        "directory",
+        metavar="PATH",
+        help="directory to clean",
+    )
+    return clean
+
+
+def sync_args(subparsers):
+    sync = subparsers.add_parser(
+        "sync",
+        description="Download what was added to your Qobuz library since the "
+        "last sync.",
+        help="sync mode",
+    )
+    sync.add_argument(
+        "target",
+        choices=["favorites", "playlists"],
+        help="what to mirror: favorites, or your playlists that changed",
+    )
+    sync.add_argument(
+        "--type",
+        dest="types",
+        choices=["albums", "tracks", "artists"],
+        action="append",
+        help="favorites to sync, can be repeated (default: albums and tracks; "
+        "artists download whole discographies)",
+    )
+    sync.add_argument(
+        "--full",
+        action="store_true",
+        help="check every page (every playlist) instead of stopping at the "
+        "already synced items",
+    )
+    sync.add_argument(
+        "-j",
+        "--workers",
+        metavar="int",
+        type=int,
+        default=4,
+        help="playlists synced at once (default: 4)",
+    )
+    return sync
+
+
+def plan_args(subparsers):
+    plan = subparsers.add_parser(
+        "plan",
+        description="Resolve URLs into a download plan (releases, quality, "
+        "target folders and estimated sizes) without downloading anything.",
+        help="plan mode",
+    )
+    plan.add_argument(
+        "SOURCE",
+        metavar="SOURCE",
+        nargs="+",
+        help=("one or more URLs (space separated) or a text file"),
+    )
+    plan.add_argument(
+        "-o",
+        "--output",
+        metavar="FILE",
+        default="plan.json",
+        help="plan file, usable with `apply` (default: plan.json)",
+    )
+    plan.add_argument(
+        "-j",
+        "--workers",
+        metavar="int",
+        type=int,
+        default=8,
+        help="items probed at once (default: 8)",
+    )
+    return plan
+
+
+def apply_args(subparsers):
+    apply = subparsers.add_parser(
+        "apply",
+        description="Download the items of a plan made with `plan`.",
+        help="apply mode",
+    )
+    apply.add_argument("PLAN", metavar="FILE", help="plan file")
+    apply.add_argument(
+        "-j",
+        "--workers",
+        metavar="int",
+        type=int,
+        default=2,
+        help="releases downloaded at once (default: 2)",
+    )
+    return apply
+
+
 def add_common_arg(custom_parser, default_folder, default_quality):
     custom_parser.add_argument(
         "-d",
@@ -130,23 +307,66 @@ def add_common_arg(custom_parser, default_folder, default_quality):
     custom_parser.add_argument(
         "--no-cover", action="store_true", help="don't download cover art"
     )
+    custom_parser.add_argument(
+        "--embed-size",
+        metavar="PX",
+        type=int,
+        help="max width/height of embedded cover art, 0 to embed as downloaded "
+        "(needs Pillow; cover.jpg is never resized)",
+    )
+    custom_parser.add_argument(
+        "--embed-quality",
+        metavar="int",
+        type=int,
+        help="JPEG quality (1-95) of resized embedded cover art",
+    )
     custom_parser.add_argument(
         "--no-db", action="store_true", help="don't call the database"
     )
+    custom_parser.add_argument(
+        "--hedge",
+        metavar="PCT",
+        type=float,
+        nargs="?",
+        const=5.0,
+        help="re-send metadata requests slower than their usual p95 latency, "
+        "adding at most PCT%% extra requests (default: 5)",
+    )
+    custom_parser.add_argument(
+        "--since-last",
+        action="store_true",
+        help="artist/label URLs: only download the releases not seen by the "
+        "previous --since-last run, stopping at the first known page",
+    )
+    custom_parser.add_argument(
+        "--mirror",
+        action="store_true",
+        help="playlist URLs: rename the files already downloaded to their new "
+        "positions, delete the tracks that left the playlist and only "
+        "download the missing ones",
+    )
+    custom_parser.add_argument(
+        "--staging-dir",
+        metavar="PATH",
+        help="download and tag files in PATH (e.g. a local SSD or tmpfs) and "
+        "move them to the download directory once finished",
+    )
     custom_parser.add_argument(
         "-ff",
         "--folder-format",
         metavar="PATTERN",
         help="""pattern for formatting folder names, e.g
         "{artist} - {album} ({year})". available keys: artist,
-        albumartist, album, year, sampling_rate, bit_depth, tracktitle, version.
-        cannot contain characters used by the system, which includes /:<>""",
+        albumartist, album, year, format, sampling_rate, bit_depth, version,
+        tracktitle (single tracks only). cannot contain characters used by
+        the system, which includes /:<>""",
     )
     custom_parser.add_argument(
         "-tf",
         "--track-format",
         metavar="PATTERN",
-        help="pattern for formatting track names. see `folder-format`.",
+        help="pattern for formatting track names. see `folder-format`, with "
+        "tracknumber instead of format.",
     )
     # TODO: add customization options
     custom_parser.add_argument(
@@ -228,9 +448,15 @@ def qobuz_dj_args(default_quality=6, default_limit=20, default_folder="MP3"):
     dj = dj_args(subparsers)
     lucky = lucky_args(subparsers)
     sz_args(subparsers)
+    retag_args(subparsers)
+    audit_args(subparsers)
+    clean_args(subparsers)
+    sync = sync_args(subparsers)
+    plan = plan_args(subparsers)
+    apply = apply_args(subparsers)
     [
         add_common_arg(i, default_folder, default_quality)
-        for i in (interactive, download, dj, lucky)
+        for i in (interactive, download, dj, lucky, sync, plan, apply)
     ]
 
     return parser
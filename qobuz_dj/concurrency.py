@@ -0,0 +1,126 @@
+"""Adaptive (AIMD) concurrency limits for API calls and audio transfers.
+
+Each limiter lets `limit` operations run at once. Every successful
+operation adds `1 / limit` (about +1 per round of operations), while a 429,
+a 5xx, a network error or a latency spike halves it. Latency is compared to
+a slow moving baseline, normalized by size for transfers, so it measures
+the per-byte cost rather than the file size.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from qobuz_dj.color import OFF
+
+logger = logging.getLogger(__name__)
+
+
+class _Slot:
+    # bytes moved by the operation, to normalize its latency
+    size: int | None = None
+
+    def __init__(self, started):
+        self.started = started
+        self.overloaded = False
+
+    def overload(self):
+        """Marks the operation as rejected/throttled by the server."""
+        self.overloaded = True
+
+    def check_status(self, status_code):
+        if status_code == 429 or status_code >= 500:
+            self.overloaded = True
+
+
+class AIMDLimiter:
+    """
+    :param str name: name used when reporting the limit
+    :param int initial: starting limit
+    :param int maximum: max operations at once
+    :param float spike: latency ratio to the baseline considered a spike
+    :param int min_size: operations moving fewer bytes than this (covers,
+        booklets) are too dominated by their fixed latency to be compared
+        with the baseline
+    """
+
+    def __init__(self, name, initial=1, minimum=1, maximum=8, spike=3.0, min_size=0):
+        self.name = name
+        self.min_size = min_size
+        self.minimum = minimum
+        self.maximum = maximum
+        self.spike = spike
+        self.limit = float(initial)
+        self.peak = float(initial)
+        self.decreases = 0
+        self._in_flight = 0
+        self._baseline = None
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @contextmanager
+    def slot(self):
+        """Waits for a free slot. Network errors raised inside count as
+        overload."""
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+        slot = _Slot(time.monotonic())
+        try:
+            yield slot
+        except OSError:
+            slot.overloaded = True
+            raise
+        finally:
+            self._release(slot)
+
+    def _release(self, slot):
+        now = time.monotonic()
+        cost = now - slot.started
+        if slot.size:
+            cost /= slot.size
+        timed = slot.size is None or slot.size >= self.min_size
+
+        with self._cond:
+            self._in_flight -= 1
+            spiked = (
+                timed
+                and self._baseline is not None
+                and cost > self.spike * self._baseline
+            )
+            if slot.overloaded or spiked:
+                # operations started before the last decrease already saw it
+                if slot.started >= self._last_decrease:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                self.peak = max(self.peak, self.limit)
+            if timed and not slot.overloaded:
+                self._baseline = (
+                    cost
+                    if self._baseline is None
+                    else 0.9 * self._baseline + 0.1 * cost
+                )
+            self._cond.notify_all()
+
+    def report(self) -> str:
+        return (
+            f"{self.name}: limit {self.limit:.1f}/{self.maximum} "
+            f"(peak {self.peak:.1f}, {self.decreases} decreases)"
+        )
+
+
+api = AIMDLimiter("API requests", initial=2, maximum=16)
+transfers = AIMDLimiter("Transfers", initial=1, maximum=6, min_size=1024 * 1024)
+
+
+def log_limits():
+    logger.info(f"{OFF}{api.report()}; {transfers.report()}")
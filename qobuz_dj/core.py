@@ -1,16 +1,35 @@
+import copy
+import functools
+import itertools
 import logging
 import os
 import re
 import sys
+import time
 
 import requests
 from bs4 import BeautifulSoup as bso
 from pathvalidate import sanitize_filename
 
-from qobuz_dj import downloader, qopy
+from qobuz_dj import (
+    artwork,
+    downloader,
+    hedging,
+    mirror,
+    pipeline,
+    qopy,
+    staging,
+    sync,
+    templates,
+)
 from qobuz_dj.bundle import Bundle
 from qobuz_dj.color import CYAN, DF, GREEN, OFF, RED, RESET, YELLOW
-from qobuz_dj.db import create_db, handle_download_id
+from qobuz_dj.db import (
+    create_db,
+    get_pending_tracks,
+    handle_download_id,
+    set_pending_tracks,
+)
 from qobuz_dj.exceptions import NonStreamable
 from qobuz_dj.utils import (
     PartialFormatter,
@@ -30,6 +49,11 @@ QUALITIES = {
     7: "7 - 24 bit, <96kHz",
     27: "27 - 24 bit, >96kHz",
 }
+MP3_QUALITY = 5
+# rounds of retries for the tracks that failed during a run, waiting
+# RETRY_BACKOFF seconds before the first one and doubling it every round
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 10
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +77,12 @@ class QobuzDL:
         track_format="{tracknumber}. {tracktitle}",
         smart_discography=False,
         dj_mode=False,
+        embed_art_size=artwork.DEFAULT_EMBED_SIZE,
+        embed_art_quality=artwork.DEFAULT_EMBED_QUALITY,
+        hedge_budget=0,
+        staging_dir=None,
+        since_last=False,
+        mirror_playlists=False,
     ):
         self.directory = create_and_return_dir(directory)
         self.quality = quality
@@ -66,12 +96,48 @@ class QobuzDL:
         self.cover_og_quality = cover_og_quality
         self.no_cover = no_cover
         self.downloads_db = create_db(downloads_db) if downloads_db else None
+        # raises InvalidTemplate now rather than in the middle of a download
+        format_templates = (
+            templates.folder(folder_format),
+            templates.track(track_format),
+        )
+        # quality 5 is MP3: `downloader` can't fill these keys, warn once here
+        # instead of when the first release is downloaded
+        if int(quality) == MP3_QUALITY:
+            for template, default in zip(
+                format_templates, downloader.DEFAULT_FORMATS["MP3"], strict=True
+            ):
+                if template.uses_quality:
+                    logger.warning(
+                        f"{YELLOW}{template.pattern!r} uses the bit depth or "
+                        f"sampling rate, unknown for MP3. Using {default!r}"
+                    )
         self.folder_format = folder_format
         self.track_format = track_format
-        self.track_format = track_format
         self.smart_discography = smart_discography
         self.dj_mode = dj_mode
+        self.embed_art_size = embed_art_size
+        self.embed_art_quality = embed_art_quality
+        # max extra metadata requests sent by hedging, in %. 0 disables it
+        self.hedge_budget = hedge_budget
+        self.staging_dir = staging_dir
+        # moves the staged files to the library (see `worker`)
+        self.mover = staging.mover
+        # movers of this downloader and of its workers, shared with them
+        self.movers = [self.mover]
+        # artist/label URLs only download the releases unseen by earlier runs
+        self.since_last = since_last
+        # sync.SyncState of the running sync, which the watermarks of
+        # --since-last save into rather than a snapshot of their own
+        self.sync_state: sync.SyncState | None = None
+        # playlists: rename/remove the existing files to follow the playlist
+        # order and only download the missing tracks
+        self.mirror_playlists = mirror_playlists
+        # set by `plan.make_plan`: items are recorded instead of downloaded
+        self.planner = None
         self.top_tracks = None  # Will be set by cli.py
+        # (release ID, failed tracks, is a release) waiting for `retry_failed`
+        self.retry_queue: list[tuple[str, list[downloader.FailedTrack], bool]] = []
 
     def rebuild_db(self):
         """Scans the download directory and populates the database."""
@@ -125,6 +191,8 @@ class QobuzDL:
 
     def initialize_client(self, email, pwd, app_id, secrets):
         self.client = qopy.Client(email, pwd, app_id, secrets)
+        if self.hedge_budget:
+            self.client.hedger = hedging.Hedger(self.hedge_budget / 100)
         logger.info(f"{YELLOW}Set max quality: {QUALITIES[int(self.quality)]}\n")
 
     def get_tokens(self):
@@ -134,46 +202,198 @@ class QobuzDL:
             secret for secret in bundle.get_secrets().values() if secret
         ]  # avoid empty fields
 
-    def download_from_id(self, item_id, album=True, alt_path=None, track_count=None):
-        if handle_download_id(self.downloads_db, item_id, add_id=False):
+    def download_from_id(
+        self,
+        item_id,
+        album=True,
+        alt_path=None,
+        track_count=None,
+        meta=None,
+        force=False,
+        formats=None,
+    ):
+        """Downloads a release or track. Returns False if it couldn't be
+        fetched at all and is worth trying again later.
+
+        :param bool force: download it even if the database lists it (its
+            file is known to be missing)
+        :param formats: (folder, track) formats to use instead of the
+            current ones
+        """
+        if not force and handle_download_id(self.downloads_db, item_id, add_id=False):
             logger.info(
                 f"{OFF}This release ID ({item_id}) was already downloaded "
                 "according to the local database.\nUse the '--no-db' flag "
                 "to bypass this."
             )
-            return
-        try:
-            dloader = downloader.Download(
-                self.client,
-                item_id,
-                alt_path or self.directory,
-                int(self.quality),
-                self.embed_art,
-                self.ignore_singles_eps,
-                self.quality_fallback,
-                self.cover_og_quality,
-                self.no_cover,
-                self.folder_format,
-                self.track_format,
-                track_count=track_count,
+            return True
+        if self.planner is not None:
+            return self.planner.add(item_id, album, alt_path, track_count, meta)
+        pending = get_pending_tracks(self.downloads_db, item_id) if album else set()
+        if pending:
+            logger.info(
+                f"{YELLOW}Resuming release {item_id}: {len(pending)} missing tracks"
             )
+        dloader = self.new_download(
+            item_id, alt_path, track_count, meta, pending or None, formats
+        )
+        try:
             dloader.download_id_by_type(not album)
-            handle_download_id(self.downloads_db, item_id, add_id=True)
-        except (requests.exceptions.RequestException, NonStreamable) as e:
+        except downloader.TRACK_ERRORS as e:
+            if album:
+                logger.error(f"{RED}Error getting release: {e}. Skipping...")
+                return False
+            logger.error(
+                f"{RED}Error downloading track {item_id}: {e}. Queued for retry"
+            )
+            retry = functools.partial(dloader.download_id_by_type, True)
+            dloader.failed.append(downloader.FailedTrack(item_id, item_id, retry))
+        except NonStreamable as e:
             logger.error(f"{RED}Error getting release: {e}. Skipping...")
+            return True
+
+        self._finish_release(item_id, dloader.failed, bool(pending), album)
+        return True
+
+    def worker(self):
+        """Returns a copy to download from another thread: same settings and
+        client, but its own formats, retry queue and mover, so concurrent
+        sources (see `sync.sync_playlists`) don't change each other's state.
+        """
+        clone = copy.copy(self)
+        clone.retry_queue = []
+        clone.mover = staging.Mover()
+        self.movers.append(clone.mover)
+        return clone
+
+    def flush_movers(self) -> bool:
+        """Waits for the staged files of every worker to be moved. Returns
+        False if any of them couldn't be."""
+        return all([mover.flush() for mover in self.movers])
+
+    def new_download(
+        self,
+        item_id,
+        alt_path=None,
+        track_count=None,
+        meta=None,
+        only_tracks=None,
+        formats=None,
+    ) -> downloader.Download:
+        """Returns a `Download` of the item with the current settings."""
+        folder_format, track_format = formats or (
+            self.folder_format,
+            self.track_format,
+        )
+        return downloader.Download(
+            self.client,
+            item_id,
+            alt_path or self.directory,
+            int(self.quality),
+            self.embed_art,
+            self.ignore_singles_eps,
+            self.quality_fallback,
+            self.cover_og_quality,
+            self.no_cover,
+            folder_format,
+            track_format,
+            track_count=track_count,
+            embed_art_size=self.embed_art_size,
+            embed_art_quality=self.embed_art_quality,
+            staging_dir=self.staging_dir,
+            mover=self.mover,
+            only_tracks=only_tracks,
+            meta=meta,
+        )
+
+    def _finish_release(
+        self, item_id, failed, had_pending=True, album=True, retried=False
+    ):
+        """Marks the release as downloaded if all of its tracks succeeded,
+        otherwise queues the failed ones for retry. Those of a release are
+        also stored, to be resumed the next time it is downloaded; a single
+        track isn't in the database until it succeeds anyway.
+
+        :param bool retried: the tracks were retried, by the downloads (and
+            movers) of the workers that failed them
+        """
+        # the release only counts as downloaded once its files left staging
+        moved = self.flush_movers() if retried else self.mover.flush()
+        if failed:
+            if album:
+                set_pending_tracks(
+                    self.downloads_db, item_id, [t.track_id for t in failed]
+                )
+            self.retry_queue.append((item_id, failed, album))
+            return
+        if not moved:
+            logger.error(
+                f"{RED}Some files of {item_id} couldn't be moved from "
+                f"{self.staging_dir}"
+            )
+            return
+        if had_pending and album:
+            set_pending_tracks(self.downloads_db, item_id, [])
+        handle_download_id(self.downloads_db, item_id, add_id=True)
+
+    def retry_failed(self):
+        """Retries the tracks that failed during this run, with backoff. The
+        ones of releases still failing are kept in the database for the next
+        run."""
+        for attempt in range(RETRY_ATTEMPTS):
+            if not self.retry_queue:
+                return
+            delay = RETRY_BACKOFF * 2**attempt
+            total = sum(len(failed) for _, failed, _ in self.retry_queue)
+            logger.info(f"{YELLOW}Retrying {total} failed tracks in {delay}s...")
+            time.sleep(delay)
+
+            queue, self.retry_queue = self.retry_queue, []
+            for item_id, failed, album in queue:
+                still_failing = []
+                for track in failed:
+                    try:
+                        track.retry()
+                    except downloader.TRACK_ERRORS as e:
+                        logger.error(f"{RED}Error downloading {track.title}: {e}")
+                        still_failing.append(track)
+                self._finish_release(item_id, still_failing, album=album, retried=True)
+
+        total = sum(len(failed) for _, failed, _ in self.retry_queue)
+        if total:
+            logger.error(
+                f"{RED}{total} tracks couldn't be downloaded."
+                + (
+                    " Those of releases will be resumed on the next run."
+                    if self.downloads_db
+                    else ""
+                )
+            )
+
+    def _prefetch_album(self, item):
+        """Pipeline stage: fetches album/get for the next releases while the
+        current one downloads. Releases already in the database are skipped."""
+        if handle_download_id(self.downloads_db, item.id, add_id=False):
+            return None
+        return self.client.get_album_meta(item.id)
 
     def handle_url(self, url):
+        """Downloads everything `url` points to. Returns False if some of
+        its items couldn't be fetched at all (see `download_from_id`), or
+        the URL is invalid."""
         possibles = {
             "playlist": {
                 "func": self.client.get_plist_meta,
                 "iterable_key": "tracks",
             },
             "artist": {
-                "func": self.client.get_artist_meta,
+                # album pages only keep what the queue needs, album/get is
+                # requested for every release anyway
+                "func": functools.partial(self.client.get_artist_meta, trimmed=True),
                 "iterable_key": "albums",
             },
             "label": {
-                "func": self.client.get_label_meta,
+                "func": functools.partial(self.client.get_label_meta, trimmed=True),
                 "iterable_key": "albums",
             },
             "album": {"album": True, "func": None, "iterable_key": None},
@@ -186,13 +406,29 @@ class QobuzDL:
             logger.info(
                 f'{RED}Invalid url: "{url}". Use urls from https://play.qobuz.com!'
             )
-            return
+            return False
 
-        content = []
+        content = iter(())
+        first_page = {}
         new_path = None
+        watermark = None
         if type_dict["func"]:
-            content = [item for item in type_dict["func"](item_id)]
-            content_name = content[0]["name"]
+            # pages are fetched lazily: the top tracks mode only needs the
+            # first one and the smart discography filter streams them
+            content = type_dict["func"](item_id)
+            if (
+                self.since_last
+                and url_type in ("artist", "label")
+                and not self.top_tracks
+            ):
+                watermark = sync.Watermark(
+                    self.sync_state or sync.SyncState(self.directory),
+                    f"{url_type}/{item_id}",
+                )
+                content = watermark.pages(content)
+            first_page = next(content)
+            content = itertools.chain([first_page], content)
+            content_name = first_page["name"]
             logger.info(
                 f"{YELLOW}Downloading all the music from {content_name} ({url_type})!"
             )
@@ -207,9 +443,13 @@ class QobuzDL:
                 self.folder_format = "."
 
         if url_type == "artist" and self.top_tracks:
-            items = self.client.get_artist_top_tracks(item_id, self.top_tracks)
+            tracks = self.client.get_artist_top_tracks(item_id, self.top_tracks)
+            items = [
+                pipeline.QueueItem.from_dict(track, "track", i)
+                for i, track in enumerate(tracks, 1)
+            ]
             # Use a dedicated folder for Top Tracks
-            artist_name = items[0]["album"]["artist"]["name"] if items else "Artist"
+            artist_name = items[0].artist if items else "Artist"
             new_path = create_and_return_dir(
                 os.path.join(
                     self.directory, f"{artist_name} - Top {self.top_tracks} Tracks"
@@ -227,26 +467,82 @@ class QobuzDL:
                 skip_extras=True,
             )
         else:
-            items = [
-                x for page in content for x in page[type_dict["iterable_key"]]["items"]
-            ]
+            # streamed: downloads start while the next pages are fetched
+            key = type_dict["iterable_key"]
+            kind = "album" if key == "albums" else "track"
+            items = (
+                pipeline.QueueItem.from_dict(x, kind, i)
+                for i, x in enumerate(
+                    (x for page in content for x in page[key]["items"]), 1
+                )
+            )
+
+        if watermark is not None:
+            # after the smart discography filter, which compares new releases
+            # with the versions downloaded before
+            items = watermark.unseen(items)
 
-        logger.info(f"{YELLOW}{len(items)} downloads in queue")
-        for i, item in enumerate(items, 1):
-            self.download_from_id(
-                item["id"],
-                True
-                if type_dict["iterable_key"] == "albums" and not self.top_tracks
-                else False,
-                new_path,
-                track_count=i if (url_type == "playlist" or self.top_tracks) else None,
+        mirrored = None
+        if url_type == "playlist" and self.mirror_playlists:
+            mirrored = list(items)
+            items = mirror.reconcile(new_path, mirrored, self._playlist_filename)
+
+        album = type_dict["iterable_key"] == "albums" and not self.top_tracks
+        if isinstance(items, list):
+            logger.info(f"{YELLOW}{len(items)} downloads in queue")
+        elif watermark is not None:
+            logger.info(
+                f"{YELLOW}Downloading the releases not seen since the last run "
+                f"({len(watermark.known)} known)"
             )
-        if url_type == "playlist" and not self.no_m3u_for_playlists:
+        elif type_dict["func"]:
+            total = first_page.get(f"{type_dict['iterable_key']}_count", "?")
+            logger.info(f"{YELLOW}{total} downloads in queue")
+        stream = pipeline.Pipeline(items, self._prefetch_album if album else None)
+        all_handled = True
+        try:
+            for item, meta in stream:
+                queued = len(self.retry_queue)
+                handled = self.download_from_id(
+                    item.id,
+                    album,
+                    new_path,
+                    track_count=item.ordinal
+                    if (url_type == "playlist" or self.top_tracks)
+                    else None,
+                    # playlist and top tracks items carry full track dicts already
+                    meta=meta if album else item.meta,
+                    force=mirrored is not None,
+                )
+                all_handled = all_handled and handled
+                # releases with failed tracks are looked at again next time
+                complete = len(self.retry_queue) == queued
+                if handled and complete and watermark is not None:
+                    watermark.add(item.id, item.release_date)
+        finally:
+            if watermark is not None:
+                watermark.save()
+        if mirrored is not None:
+            paths = mirror.finish(new_path, mirrored)
+            if not self.no_m3u_for_playlists:
+                make_m3u(new_path, paths)
+        elif url_type == "playlist" and not self.no_m3u_for_playlists:
             make_m3u(new_path)
         elif not type_dict["func"]:
             # Only for types that don't have a func (album, track)
             # artist/label/playlist have func and are handled in the loop above
-            self.download_from_id(item_id, type_dict["album"])
+            return self.download_from_id(item_id, type_dict["album"])
+        return all_handled
+
+    def _playlist_filename(self, item, file_format):
+        """File name of a playlist track at its position (see `mirror`)."""
+        return downloader.track_filename(
+            downloader.track_meta(self.client, item.id, item.meta),
+            templates.folder(self.folder_format),
+            templates.track(self.track_format),
+            file_format,
+            item.ordinal,
+        )
 
     def download_list_of_urls(self, urls):
         if not urls or not isinstance(urls, list):
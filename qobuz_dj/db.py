@@ -13,6 +13,12 @@ def create_db(db_path):
             logger.info(f"{YELLOW}Download-IDs database created")
         except sqlite3.OperationalError:
             pass
+        # tracks of partially downloaded releases
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_tracks "
+            "(album_id TEXT NOT NULL, track_id TEXT NOT NULL, "
+            "UNIQUE(album_id, track_id));"
+        )
         return db_path
 
 
@@ -37,3 +43,33 @@ def handle_download_id(db_path, item_id, add_id=False):
                 "SELECT id FROM downloads where id=?",
                 (item_id,),
             ).fetchone()
+
+
+def get_pending_tracks(db_path, album_id) -> set[str]:
+    """Returns the IDs of the tracks of `album_id` that failed to download."""
+    if not db_path:
+        return set()
+
+    with sqlite3.connect(db_path) as conn:
+        rows = conn.execute(
+            "SELECT track_id FROM pending_tracks WHERE album_id=?",
+            (album_id,),
+        ).fetchall()
+    return {row[0] for row in rows}
+
+
+def set_pending_tracks(db_path, album_id, track_ids):
+    """Replaces the pending tracks of `album_id` (none clears them)."""
+    if not db_path:
+        return
+
+    with sqlite3.connect(db_path) as conn:
+        try:
+            conn.execute("DELETE FROM pending_tracks WHERE album_id=?", (album_id,))
+            conn.executemany(
+                "INSERT INTO pending_tracks (album_id, track_id) VALUES (?, ?)",
+                [(album_id, str(track_id)) for track_id in track_ids],
+            )
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"{RED}Unexpected DB error: {e}")
@@ -0,0 +1,160 @@
+"""Process-wide sink for metadata diagnostics.
+
+Events are deduplicated as they arrive and written to `errors.log` in
+batches: once BATCH_SIZE distinct events are pending, and when the process
+exits (or on an explicit `flush()`), instead of opening the file once per
+missing field. Batches are written by a background thread, so taggers never
+wait for the file. The per-field summary covers the whole run.
+"""
+
+import atexit
+import datetime
+import logging
+import queue
+import threading
+from collections import Counter
+
+from qobuz_dj.color import OFF
+
+ERRORS_LOG = "errors.log"
+# distinct (item, field) events kept in memory before they are written
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """Lines for the writer thread. `events` are kept for the next batch if
+    the write fails, `summary` is rebuilt by the next flush."""
+
+    def __init__(self, events, summary=()):
+        self.events = events
+        self.summary = summary
+        self.written = False
+        self.done = threading.Event()
+
+
+class DiagnosticsSink:
+    def __init__(self, path=ERRORS_LOG, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        # every (item, field) seen this run, and those not written yet
+        self._seen: set[tuple[str, str]] = set()
+        self._events: dict[tuple[str, str], tuple] = {}
+        self._counts: Counter = Counter()
+        self._metrics: Counter = Counter()
+        self._lock = threading.Lock()
+        self._registered = False
+        self._queue: queue.Queue[_Batch] = queue.Queue()
+        self._writer = None
+        # events of failed writes, retried with the next batch
+        self._unwritten: list[str] = []
+
+    def missing_field(self, context_id, field, default):
+        """Records that `field` was missing for `context_id` and `default`
+        was used. Identical (item, field) events are only written once.
+        """
+        with self._lock:
+            key = (context_id, field)
+            if key not in self._seen:
+                self._seen.add(key)
+                self._events[key] = (datetime.datetime.now(), default)
+                self._counts[field] += 1
+                if len(self._events) >= self.batch_size:
+                    self._submit(_Batch(self._event_lines()))
+        self._register()
+
+    def metric(self, name, value=1):
+        """Adds `value` to the counter `name`, reported when flushing."""
+        with self._lock:
+            self._metrics[name] += value
+        self._register()
+
+    def _register(self):
+        if not self._registered:
+            self._registered = True
+            atexit.register(self.flush)
+
+    def metrics(self) -> Counter:
+        with self._lock:
+            return self._metrics.copy()
+
+    def summary(self) -> Counter:
+        """Returns how many distinct items were missing each field."""
+        with self._lock:
+            return self._counts.copy()
+
+    def _event_lines(self) -> list[str]:
+        lines = [
+            f"[{ts.isoformat()}] [{context_id}] Missing field: '{field}', "
+            f"used default: '{default}'\n"
+            for (context_id, field), (ts, default) in self._events.items()
+        ]
+        self._events.clear()
+        return lines
+
+    def _submit(self, batch):
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._run, name="diagnostics", daemon=True
+            )
+            self._writer.start()
+        self._queue.put(batch)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            events = self._unwritten + batch.events
+            batch.written = self._write(events + list(batch.summary))
+            self._unwritten = [] if batch.written else events
+            batch.done.set()
+            self._queue.task_done()
+
+    def _write(self, lines) -> bool:
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(lines)
+        except OSError:
+            return False
+        return True
+
+    def flush(self):
+        """Writes the pending events, followed by a per-field summary and
+        the metrics. The counters restart once they are written."""
+        with self._lock:
+            counts = self._counts.copy()
+            metrics = self._metrics.copy()
+            if not self._events and not counts and not metrics:
+                return
+
+            now = datetime.datetime.now().isoformat()
+            summary = [
+                f"[{now}] Summary: '{field}' missing for {count} item(s)\n"
+                for field, count in counts.most_common()
+            ]
+            summary += [
+                f"[{now}] Metric: {name} = {n}\n" for name, n in metrics.items()
+            ]
+            batch = _Batch(self._event_lines(), summary)
+            self._submit(batch)
+
+        batch.done.wait()
+        if not batch.written:
+            return
+        with self._lock:
+            self._counts -= counts
+            self._metrics -= metrics
+
+        if counts:
+            logger.info(
+                f"{OFF}Missing metadata fields: "
+                + ", ".join(f"{field} ({n})" for field, n in counts.most_common())
+                + f". See {self.path}"
+            )
+        if metrics:
+            logger.info(
+                f"{OFF}" + ", ".join(f"{name}: {n}" for name, n in metrics.items())
+            )
+
+
+sink = DiagnosticsSink()
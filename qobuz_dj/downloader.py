@@ -1,14 +1,28 @@
+import functools
 import logging
 import os
-from typing import Tuple
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple
 
 import requests
 from pathvalidate import sanitize_filename, sanitize_filepath
 from tqdm import tqdm
 
 import qobuz_dj.metadata as metadata
+from qobuz_dj import (
+    artwork,
+    concurrency,
+    diagnostics,
+    staging,
+    templates,
+    tempfiles,
+    verify,
+)
 from qobuz_dj.color import CYAN, GREEN, OFF, RED, YELLOW
-from qobuz_dj.exceptions import NonStreamable
+from qobuz_dj.exceptions import IntegrityError, NonStreamable
+from qobuz_dj.qopy import TIMEOUT
 from qobuz_dj.utils import clean_unicode
 
 QL_DOWNGRADE = "FormatRestrictedByFormatAvailability"
@@ -26,10 +40,49 @@ DEFAULT_FORMATS = {
 
 DEFAULT_FOLDER = "{artist} - {album} ({year}) [{bit_depth}B-{sampling_rate}kHz]"
 DEFAULT_TRACK = "{tracknumber}. {tracktitle}"
+# downloads of a track failing the integrity check before giving up
+VERIFY_ATTEMPTS = 3
+# a transfer is stalled when it gets less than STALL_MIN_RATE bytes/s over
+# the last STALL_WINDOW seconds; it is then reissued, resuming where possible
+STALL_WINDOW = 30
+STALL_MIN_RATE = 16 * 1024
+STALL_RETRIES = 5
+# errors that only affect the track being downloaded
+TRACK_ERRORS = (requests.exceptions.RequestException, ConnectionError, IntegrityError)
+# used to estimate file sizes (`estimate_size`): stereo, and the typical
+# compression of FLAC over PCM
+MP3_BITRATE = 320_000
+FLAC_RATIO = 0.6
+# fields `download_track` and the taggers need: track dicts embedded in
+# playlist/top tracks responses having all of them are used as they are,
+# without a track/get call
+TRACK_FIELDS = (
+    ("id",),
+    ("title",),
+    ("track_number",),
+    ("media_number",),
+    ("maximum_bit_depth",),
+    ("maximum_sampling_rate",),
+    ("copyright",),
+    ("performer", "name"),
+    ("composer", "name"),
+    ("album", "title"),
+    ("album", "artist", "name"),
+    ("album", "release_date_original"),
+    ("album", "image", "large"),
+    ("album", "genres_list"),
+    ("album", "tracks_count"),
+)
 
 logger = logging.getLogger(__name__)
 
 
+class FailedTrack(NamedTuple):
+    track_id: str
+    title: str
+    retry: Callable[[], None]
+
+
 class Download:
     def __init__(
         self,
@@ -45,6 +98,12 @@ class Download:
         folder_format=None,
         track_format=None,
         track_count=None,
+        embed_art_size: int = artwork.DEFAULT_EMBED_SIZE,
+        embed_art_quality: int = artwork.DEFAULT_EMBED_QUALITY,
+        only_tracks=None,
+        meta=None,
+        staging_dir=None,
+        mover=None,
     ):
         self.client = client
         self.item_id = item_id
@@ -55,9 +114,23 @@ class Download:
         self.downgrade_quality = downgrade_quality
         self.cover_og_quality = cover_og_quality
         self.no_cover = no_cover
-        self.folder_format = folder_format or DEFAULT_FOLDER
-        self.track_format = track_format or DEFAULT_TRACK
+        # compiled and validated once, see `templates`
+        self.folder_template = templates.folder(folder_format or DEFAULT_FOLDER)
+        self.track_template = templates.track(track_format or DEFAULT_TRACK)
         self.track_count = track_count
+        self.embed_art_size = embed_art_size
+        self.embed_art_quality = embed_art_quality
+        # IDs of the tracks to download from a release, None for all of them
+        self.only_tracks = only_tracks
+        # metadata of the item already fetched (album/get prefetched by the
+        # pipeline, track dicts from playlists), to avoid requesting it again
+        self.meta = meta
+        # fast local directory where tracks are downloaded and tagged
+        self.staging_dir = staging_dir
+        # `staging.Mover` of the staged files, the shared one by default
+        self.mover = mover or staging.mover
+        # tracks of the release that failed, to be retried later
+        self.failed: list[FailedTrack] = []
 
     def download_id_by_type(self, track=True):
         if not track:
@@ -67,16 +140,8 @@ class Download:
 
     def download_release(self):
         count = 0
-        meta = self.client.get_album_meta(self.item_id)
-
-        if not meta.get("streamable"):
-            raise NonStreamable("This release is not streamable")
-
-        if self.albums_only and (
-            meta.get("release_type") != "album"
-            or meta.get("artist").get("name") == "Various Artists"
-        ):
-            logger.info(f"{OFF}Ignoring Single/EP/VA: {meta.get('title', 'n/a')}")
+        meta = self.meta or self.client.get_album_meta(self.item_id)
+        if self._release_skipped(meta):
             return
 
         album_title = _get_title(meta)
@@ -97,10 +162,10 @@ class Download:
         album_attr = self._get_album_attr(
             meta, album_title, file_format, bit_depth, sampling_rate
         )
-        folder_format, track_format = _clean_format_str(
-            self.folder_format, self.track_format, file_format
+        folder_template, _ = _templates_for(
+            self.folder_template, self.track_template, file_format
         )
-        sanitized_title = sanitize_filepath(folder_format.format(**album_attr))
+        sanitized_title = sanitize_filepath(folder_template.render(album_attr))
         dirn = os.path.join(self.path, sanitized_title)
         os.makedirs(dirn, exist_ok=True)
 
@@ -109,6 +174,10 @@ class Download:
         else:
             _get_extra(meta["image"]["large"], dirn, og_quality=self.cover_og_quality)
 
+        # album-level tags are the same for every track of the release
+        template = metadata.AlbumTagTemplate(meta)
+        template.cover = self._prepare_cover(dirn)
+
         if "goodies" in meta:
             try:
                 _get_extra(meta["goodies"][0]["url"], dirn, "booklet.pdf")
@@ -116,25 +185,38 @@ class Download:
                 pass
         media_numbers = [track["media_number"] for track in meta["tracks"]["items"]]
         is_multiple = True if len([*{*media_numbers}]) > 1 else False
+        jobs = []
         for i in meta["tracks"]["items"]:
-            parse = self.client.get_track_url(i["id"], fmt_id=self.quality)
-            if "sample" not in parse and parse["sampling_rate"]:
-                is_mp3 = True if int(self.quality) == 5 else False
-                self._download_and_tag(
+            if self.only_tracks is None or str(i["id"]) in self.only_tracks:
+                job = functools.partial(
+                    self._download_release_track,
                     dirn,
                     count,
-                    parse,
                     i,
                     meta,
-                    False,
-                    is_mp3,
-                    i["media_number"] if is_multiple else None,
-                    track_count=count + 1,
+                    is_multiple,
+                    template,
                 )
-            else:
-                logger.info(f"{OFF}Demo. Skipping")
+                jobs.append((i, job))
             count = count + 1
 
+        # as many tracks are transferred at once as the adaptive limit allows
+        with ThreadPoolExecutor(max_workers=concurrency.transfers.maximum) as pool:
+            futures = [(i, job, pool.submit(job)) for i, job in jobs]
+            try:
+                for i, job, future in futures:
+                    try:
+                        future.result()
+                    except TRACK_ERRORS as e:
+                        title = i.get("title", i["id"])
+                        logger.error(
+                            f"{RED}Error downloading {title}: {e}. Queued for retry"
+                        )
+                        self.failed.append(FailedTrack(str(i["id"]), str(title), job))
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
         if self.no_cover and self.embed_art:
             # We downloaded the cover only for embedding purposes.
             # Now that tagging is done, we remove the file.
@@ -142,24 +224,110 @@ class Download:
                 os.remove(os.path.join(dirn, "cover.jpg"))
             except OSError:
                 pass
-        logger.info(f"{GREEN}Completed")
+        if self.failed:
+            logger.info(f"{YELLOW}Completed, {len(self.failed)} tracks failed")
+        else:
+            logger.info(f"{GREEN}Completed")
+
+    def _release_skipped(self, meta) -> bool:
+        if not meta.get("streamable"):
+            raise NonStreamable("This release is not streamable")
+
+        if self.albums_only and (
+            meta.get("release_type") != "album"
+            or meta.get("artist").get("name") == "Various Artists"
+        ):
+            logger.info(f"{OFF}Ignoring Single/EP/VA: {meta.get('title', 'n/a')}")
+            return True
+        return False
+
+    def probe(self, track=False):
+        """Resolves what `download_id_by_type` would download, without
+        downloading anything: quality, target folder and estimated size.
+
+        :returns: dict, None if the item would be skipped
+        """
+        if track:
+            meta = self._track_meta()
+            parse = self.client.get_track_url(self.item_id, self.quality)
+            if "sample" in parse or not parse.get("sampling_rate"):
+                logger.info(f"{OFF}Demo. Skipping")
+                return None
+            format_info = self._get_format(meta, is_track_id=True, track_url_dict=parse)
+            title = _get_title(meta)
+            tracks = [meta]
+        else:
+            meta = self.meta or self.client.get_album_meta(self.item_id)
+            if self._release_skipped(meta):
+                return None
+            format_info = self._get_format(meta)
+            title = _get_title(meta)
+            tracks = meta["tracks"]["items"]
+
+        file_format, quality_met, bit_depth, sampling_rate = format_info
+        if not self.downgrade_quality and not quality_met:
+            logger.info(f"{OFF}Skipping {title} as it doesn't meet quality requirement")
+            return None
+        if track:
+            attr = self._get_track_attr(
+                meta, title, file_format, bit_depth, sampling_rate
+            )
+        else:
+            attr = self._get_album_attr(
+                meta, title, file_format, bit_depth, sampling_rate
+            )
+        folder_template, _ = _templates_for(
+            self.folder_template, self.track_template, file_format
+        )
+        return {
+            "title": title,
+            "artist": _safe_get(meta, "artist", "name")
+            or _safe_get(meta, "performer", "name"),
+            "format": file_format,
+            "bit_depth": bit_depth,
+            "sampling_rate": sampling_rate,
+            "folder": os.path.join(
+                self.path, sanitize_filepath(folder_template.render(attr))
+            ),
+            "tracks": len(tracks),
+            "size": sum(
+                estimate_size(
+                    t.get("duration") or 0, file_format, bit_depth, sampling_rate
+                )
+                for t in tracks
+            ),
+        }
+
+    def _download_release_track(self, dirn, count, track, meta, is_multiple, template):
+        parse = self.client.get_track_url(track["id"], fmt_id=self.quality)
+        if "sample" not in parse and parse["sampling_rate"]:
+            is_mp3 = True if int(self.quality) == 5 else False
+            self._download_and_tag(
+                dirn,
+                parse,
+                track,
+                meta,
+                False,
+                is_mp3,
+                track["media_number"] if is_multiple else None,
+                track_count=count + 1,
+                template=template,
+            )
+        else:
+            logger.info(f"{OFF}Demo. Skipping")
 
     def download_track(self):
         dirn = ""
         parse = self.client.get_track_url(self.item_id, self.quality)
 
         if "sample" not in parse and parse["sampling_rate"]:
-            meta = self.client.get_track_meta(self.item_id)
+            meta = self._track_meta()
             track_title = _get_title(meta)
             artist = _safe_get(meta, "performer", "name")
             logger.info(f"\n{YELLOW}Downloading: {artist} - {track_title}")
             format_info = self._get_format(meta, is_track_id=True, track_url_dict=parse)
             file_format, quality_met, bit_depth, sampling_rate = format_info
 
-            folder_format, track_format = _clean_format_str(
-                self.folder_format, self.track_format, str(bit_depth)
-            )
-
             if not self.downgrade_quality and not quality_met:
                 logger.info(
                     f"{OFF}Skipping {track_title} as it doesn't "
@@ -167,9 +335,12 @@ class Download:
                 )
                 return
             track_attr = self._get_track_attr(
-                meta, track_title, bit_depth, sampling_rate
+                meta, track_title, file_format, bit_depth, sampling_rate
             )
-            sanitized_title = sanitize_filepath(folder_format.format(**track_attr))
+            folder_template, _ = _templates_for(
+                self.folder_template, self.track_template, file_format
+            )
+            sanitized_title = sanitize_filepath(folder_template.render(track_attr))
 
             dirn = os.path.join(self.path, sanitized_title)
             os.makedirs(dirn, exist_ok=True)
@@ -181,10 +352,11 @@ class Download:
                     dirn,
                     og_quality=self.cover_og_quality,
                 )
+            template = metadata.AlbumTagTemplate.for_track(meta, meta)
+            template.cover = self._prepare_cover(dirn)
             is_mp3 = True if int(self.quality) == 5 else False
             self._download_and_tag(
                 dirn,
-                1,
                 parse,
                 meta,
                 meta,
@@ -192,6 +364,7 @@ class Download:
                 is_mp3,
                 False,
                 track_count=self.track_count,
+                template=template,
             )
         else:
             logger.info(f"{OFF}Demo. Skipping")
@@ -205,10 +378,12 @@ class Download:
                 pass
         logger.info(f"{GREEN}Completed")
 
+    def _track_meta(self):
+        return track_meta(self.client, self.item_id, self.meta)
+
     def _download_and_tag(
         self,
         root_dir,
-        tmp_count,
         track_url_dict,
         track_metadata,
         album_or_track_metadata,
@@ -216,6 +391,7 @@ class Download:
         is_mp3,
         multiple=None,
         track_count=None,
+        template=None,
     ):
         extension = ".mp3" if is_mp3 else ".flac"
 
@@ -229,39 +405,76 @@ class Download:
             root_dir = os.path.join(root_dir, f"Disc {multiple}")
             os.makedirs(root_dir, exist_ok=True)
 
-        filename = os.path.join(root_dir, f".{tmp_count:02}.tmp")
-
-        # Determine the filename
         track_title = track_metadata.get("title")
-        artist = _safe_get(track_metadata, "performer", "name")
-        filename_attr = self._get_filename_attr(
-            artist, track_metadata, track_title, track_count
+        final_file = track_path(
+            root_dir,
+            track_filename(
+                track_metadata,
+                self.folder_template,
+                self.track_template,
+                "MP3" if is_mp3 else "FLAC",
+                track_count,
+            ),
+            extension,
         )
 
-        # track_format is a format string
-        # e.g. '{tracknumber}. {artist} - {tracktitle}'
-        formatted_path = sanitize_filename(self.track_format.format(**filename_attr))
-        final_file = os.path.join(root_dir, formatted_path)[:250] + extension
-
         if os.path.isfile(final_file):
             logger.info(f"{OFF}{track_title} was already downloaded")
             return
 
-        tqdm_download(url, filename, filename)
+        if self.staging_dir:
+            # downloaded and tagged on the staging area, then moved
+            filename = staging.staged_file(self.staging_dir)
+            tagged_file = filename[: -len(".tmp")] + extension
+        else:
+            # named after the track: downloads may share a folder (playlists,
+            # top tracks, DJ mode)
+            filename = os.path.join(root_dir, f".{track_metadata['id']}.tmp")
+            tagged_file = final_file
+
+        tempfiles.registry.register(filename)
+        for attempt in range(1, VERIFY_ATTEMPTS + 1):
+            try:
+                tqdm_download(url, filename, filename, verify.verifier_for(extension))
+                break
+            except IntegrityError as e:
+                if attempt == VERIFY_ATTEMPTS:
+                    os.remove(filename)
+                    tempfiles.registry.release(filename)
+                    raise
+                logger.warning(
+                    f"{YELLOW}{track_title} is corrupted ({e}). Downloading it again"
+                )
+
         tag_function = metadata.tag_mp3 if is_mp3 else metadata.tag_flac
+        if tagged_file != final_file:
+            # released by the mover once it is in the library
+            tempfiles.registry.register(tagged_file)
         try:
             tag_function(
                 filename,
                 root_dir,
-                final_file,
+                tagged_file,
                 track_metadata,
                 album_or_track_metadata,
                 is_track,
                 self.embed_art,
+                template=template,
             )
+            tempfiles.registry.release(filename)
+            if tagged_file != final_file:
+                self.mover.move(tagged_file, final_file)
         except Exception as e:
             logger.error(f"{RED}Error tagging the file: {e}", exc_info=True)
 
+    def _prepare_cover(self, dirn):
+        """Starts processing the cover to embed in the background, so it is
+        ready by the time the first track is tagged."""
+        cover = os.path.join(dirn, "cover.jpg")
+        if not self.embed_art or not os.path.isfile(cover):
+            return None
+        return artwork.prepare(cover, self.embed_art_size, self.embed_art_quality)
+
     @staticmethod
     def _get_filename_attr(artist, track_metadata, track_title, track_count=None):
         track_number = f"{track_metadata['track_number']:02}"
@@ -278,6 +491,7 @@ class Download:
             "tracktitle": clean_unicode(track_title),
             "version": clean_unicode(track_metadata.get("version")),
             "tracknumber": track_number,
+            "album": clean_unicode(_safe_get(track_metadata, "album", "title")),
             "year": str(
                 _safe_get(
                     track_metadata, "album", "release_date_original", default="0000"
@@ -286,21 +500,28 @@ class Download:
         }
 
     @staticmethod
-    def _get_track_attr(meta, track_title, bit_depth, sampling_rate):
+    def _get_track_attr(meta, track_title, file_format, bit_depth, sampling_rate):
+        artist = templates.clean_fragment(meta["album"]["artist"]["name"])
         return {
-            "album": clean_unicode(sanitize_filename(meta["album"]["title"])),
-            "artist": clean_unicode(sanitize_filename(meta["album"]["artist"]["name"])),
-            "tracktitle": clean_unicode(sanitize_filename(track_title)),
+            "album": templates.clean_fragment(meta["album"]["title"]),
+            "artist": artist,
+            "albumartist": artist,
+            "tracktitle": templates.clean_fragment(track_title),
+            "version": templates.clean_fragment(meta["album"].get("version") or ""),
             "year": meta["album"]["release_date_original"].split("-")[0],
+            "format": file_format,
             "bit_depth": bit_depth,
             "sampling_rate": sampling_rate,
         }
 
     @staticmethod
     def _get_album_attr(meta, album_title, file_format, bit_depth, sampling_rate):
+        artist = templates.clean_fragment(meta["artist"]["name"])
         return {
-            "artist": clean_unicode(sanitize_filename(meta["artist"]["name"])),
-            "album": clean_unicode(sanitize_filename(album_title)),
+            "artist": artist,
+            "albumartist": artist,
+            "album": templates.clean_fragment(album_title),
+            "version": templates.clean_fragment(meta.get("version") or ""),
             "year": meta["release_date_original"].split("-")[0],
             "format": file_format,
             "bit_depth": bit_depth,
@@ -339,10 +560,72 @@ class Download:
             return ("Unknown", quality_met, None, None)
 
 
-def tqdm_download(url, fname, desc):
-    r = requests.get(url, allow_redirects=True, stream=True)
+class TransferStalled(Exception):
+    pass
+
+
+class StallDetector:
+    """Throughput of a transfer over a sliding window, in 1 second buckets."""
+
+    def __init__(self, window=STALL_WINDOW, min_rate=STALL_MIN_RATE):
+        self.window = window
+        self.min_rate = min_rate
+        self._start = time.monotonic()
+        self._buckets: deque[list] = deque()
+        self._bytes = 0
+
+    def update(self, size, now=None):
+        """Accounts `size` new bytes.
+
+        :raises TransferStalled: if the transfer is too slow
+        """
+        now = time.monotonic() if now is None else now
+        second = int(now)
+        if self._buckets and self._buckets[-1][0] == second:
+            self._buckets[-1][1] += size
+        else:
+            self._buckets.append([second, size])
+        self._bytes += size
+
+        while self._buckets[0][0] <= now - self.window:
+            self._bytes -= self._buckets.popleft()[1]
+
+        if now - self._start >= self.window and (
+            self._bytes < self.min_rate * self.window
+        ):
+            raise TransferStalled(
+                f"{self._bytes / self.window / 1024:.1f} KiB/s "
+                f"over the last {self.window}s"
+            )
+
+
+def tqdm_download(url, fname, desc, verifier=None):
+    """Downloads `url` to `fname`.
+
+    Stalled transfers (see `StallDetector`) and dropped connections are
+    reissued up to STALL_RETRIES times, with a Range request when the server
+    supports it and from scratch otherwise.
+
+    :param verifier: optional `verify` checker fed with every chunk
+    :raises IntegrityError: if the verifier rejects the file
+    """
+    try:
+        with concurrency.transfers.slot() as slot:
+            slot.size = _transfer(url, fname, desc, verifier, slot)
+    except BaseException:
+        if verifier is not None:
+            verifier.abort()
+        raise
+
+    if verifier is not None:
+        verifier.finish()
+
+
+def _transfer(url, fname, desc, verifier, slot):
+    r = requests.get(url, allow_redirects=True, stream=True, timeout=TIMEOUT)
     total = int(r.headers.get("content-length", 0))
     download_size = 0
+    stalls = 0
     with (
         open(fname, "wb") as file,
         tqdm(
@@ -354,14 +637,77 @@ def tqdm_download(url, fname, desc):
             bar_format=CYAN + "{n_fmt}/{total_fmt} /// {desc}",
         ) as bar,
     ):
-        for data in r.iter_content(chunk_size=1024):
-            size = file.write(data)
-            bar.update(size)
-            download_size += size
+        while True:
+            try:
+                detector = StallDetector()
+                for data in r.iter_content(chunk_size=1024):
+                    size = file.write(data)
+                    if verifier is not None:
+                        verifier.update(data)
+                    bar.update(size)
+                    download_size += size
+                    detector.update(size)
+                break
+            except (
+                TransferStalled,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                r.close()
+                stalls += 1
+                slot.overload()
+                diagnostics.sink.metric("transfer stalls")
+                if stalls > STALL_RETRIES:
+                    raise ConnectionError(
+                        f"Transfer stalled {stalls} times for {fname}: {e}"
+                    ) from e
+                logger.warning(f"{YELLOW}Transfer stalled ({e}), reissuing it")
+                r = _reissue(url, download_size)
+                if download_size and r.status_code != 206:
+                    # no Range support, start over
+                    diagnostics.sink.metric("transfer restarts")
+                    file.seek(0)
+                    file.truncate()
+                    bar.reset()
+                    download_size = 0
+                    if verifier is not None:
+                        verifier.reset()
 
     if total != download_size:
         # https://stackoverflow.com/questions/69919912/requests-iter-content-thinks-file-is-complete-but-its-not
         raise ConnectionError("File download was interrupted for " + fname)
+    return download_size
+
+
+def _reissue(url, offset):
+    """Requests `url` again from `offset`. The response is either the rest
+    of the file (206) or, when the server ignores the Range, all of it (200).
+
+    :raises ConnectionError: on error statuses and partial responses that
+        don't start at `offset`
+    """
+    headers = {"Range": f"bytes={offset}-"} if offset else None
+    try:
+        r = requests.get(
+            url,
+            allow_redirects=True,
+            stream=True,
+            headers=headers,
+            timeout=TIMEOUT,
+        )
+        r.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise ConnectionError(f"Couldn't reissue the transfer: {e}") from e
+
+    if offset and r.status_code != 200:
+        content_range = r.headers.get("content-range", "")
+        if r.status_code != 206 or not content_range.startswith(f"bytes {offset}-"):
+            r.close()
+            raise ConnectionError(
+                f"Couldn't resume the transfer at byte {offset}: "
+                f"{r.status_code} {content_range}"
+            )
+    return r
 
 
 def _get_description(item: dict, track_title, multiple=None):
@@ -396,31 +742,68 @@ def _get_extra(item, dirn, extra="cover.jpg", og_quality=False):
     )
 
 
-def _clean_format_str(folder: str, track: str, file_format: str) -> Tuple[str, str]:
-    """Cleans up the format strings, avoids errors
-    with MP3 files.
+@functools.lru_cache(maxsize=64)
+def _templates_for(folder, track, file_format):
+    """Returns the (folder, track) templates to use for `file_format`. Bit
+    depth and sampling rate are unknown for MP3 and unknown formats, so
+    templates using them are replaced by the defaults (logged once).
     """
+    defaults = DEFAULT_FORMATS.get(file_format)
+    if defaults is None:
+        return folder, track
     final = []
-    for i, fs in enumerate((folder, track)):
-        if fs.endswith(".mp3"):
-            fs = fs[:-4]
-        elif fs.endswith(".flac"):
-            fs = fs[:-5]
-        fs = fs.strip()
-
-        # default to pre-chosen string if format is invalid
-        if file_format in ("MP3", "Unknown") and (
-            "bit_depth" in fs or "sampling_rate" in fs
-        ):
-            default = DEFAULT_FORMATS[file_format][i]
+    for template, compile_, default in zip(
+        (folder, track), (templates.folder, templates.track), defaults, strict=True
+    ):
+        if template.uses_quality:
             logger.error(
                 f"{RED}invalid format string for format {file_format}"
                 f". defaulting to {default}"
             )
-            fs = default
-        final.append(fs)
+            template = compile_(default)
+        final.append(template)
+    return final[0], final[1]
+
+
+def estimate_size(duration, file_format, bit_depth=None, sampling_rate=None) -> int:
+    """Approximate size in bytes of `duration` seconds of audio."""
+    if file_format == "MP3":
+        return int(duration * MP3_BITRATE / 8)
+    # unknown qualities are counted as CD quality
+    bits_per_second = (bit_depth or 16) * (sampling_rate or 44.1) * 1000 * 2
+    return int(duration * bits_per_second / 8 * FLAC_RATIO)
+
+
+def track_meta(client, track_id, meta=None):
+    """Returns the track dict already fetched, or asks the API for it if
+    some required field is missing."""
+    if meta is not None and all(
+        _safe_get(meta, *keys) is not None for keys in TRACK_FIELDS
+    ):
+        return meta
+    if meta is not None:
+        logger.debug(f"Incomplete metadata for track {track_id}, fetching it")
+    return client.get_track_meta(track_id)
+
+
+def track_filename(
+    meta, folder_template, track_template, file_format, track_count=None
+):
+    """Name of the file of a track, without directory and extension.
+
+    :param int track_count: number used instead of the album track number
+        (playlist position)
+    """
+    # e.g. '{tracknumber}. {artist} - {tracktitle}'
+    _, track_template = _templates_for(folder_template, track_template, file_format)
+    filename_attr = Download._get_filename_attr(
+        _safe_get(meta, "performer", "name"), meta, meta.get("title"), track_count
+    )
+    return sanitize_filename(track_template.render(filename_attr))
+
 
-    return (final[0], final[1])
+def track_path(root_dir, filename, extension):
+    return os.path.join(root_dir, filename)[:250] + extension
 
 
 def _safe_get(d: dict, *keys, default=None):
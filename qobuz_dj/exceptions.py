@@ -20,3 +20,11 @@ class InvalidQuality(Exception):
 
 class NonStreamable(Exception):
     pass
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class InvalidTemplate(Exception):
+    pass
@@ -0,0 +1,112 @@
+"""Request hedging for idempotent API calls.
+
+When a call hasn't returned after the p95 latency observed for its
+endpoint, a second identical request is sent and the first one to succeed
+wins. The number of hedges is capped to a fraction of the hedgeable calls,
+so the extra load on the API stays bounded.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from qobuz_dj import concurrency, diagnostics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 0.05
+# latencies kept per endpoint, and needed before hedging it
+_WINDOW = 200
+_MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """Recent latencies of each endpoint."""
+
+    def __init__(self, window=_WINDOW, min_samples=_MIN_SAMPLES):
+        self.min_samples = min_samples
+        self._window = window
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, latency):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self._window)
+            samples.append(latency)
+
+    def percentile(self, endpoint, pct=95) -> float | None:
+        """Returns the `pct` percentile latency of `endpoint`, or None while
+        there are too few samples."""
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Hedger:
+    """Runs calls with a hedge after the endpoint's p95 latency.
+
+    :param float budget: max hedges, as a fraction of the hedgeable calls
+    :param int workers: calls run at once; the API limiter never lets more
+        requests through anyway
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, tracker=None, workers=None):
+        self.budget = budget
+        self.tracker = tracker or LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._primaries = ThreadPoolExecutor(
+            max_workers=workers or concurrency.api.maximum,
+            thread_name_prefix="hedging-primary",
+        )
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hedging")
+
+    def _take_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def call(self, endpoint, fn):
+        """Returns `fn()`, hedging it if it's slower than usual.
+
+        Once the endpoint is hedged, `fn` runs on a pool as large as the API
+        limiter, which caps the calls no more than the limiter already does,
+        and the hedge on a smaller one. The first attempt to succeed is returned; if one fails, the
+        other one is waited for.
+        """
+        with self._lock:
+            self.calls += 1
+        delay = self.tracker.percentile(endpoint)
+        start = time.monotonic()
+        if delay is None:
+            result = fn()
+            self.tracker.record(endpoint, time.monotonic() - start)
+            return result
+
+        primary = self._primaries.submit(fn)
+        attempts = {primary}
+        done, _ = wait(attempts, timeout=delay)
+        if not done and self._take_hedge():
+            diagnostics.sink.metric("hedged requests")
+            attempts.add(self._executor.submit(fn))
+
+        while attempts:
+            done, attempts = wait(attempts, return_when=FIRST_COMPLETED)
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is not primary:
+                        diagnostics.sink.metric("hedges won")
+                    self.tracker.record(endpoint, time.monotonic() - start)
+                    return attempt.result()
+        # both failed: the primary's error, as if it hadn't been hedged
+        return primary.result()
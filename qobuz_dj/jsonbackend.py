@@ -0,0 +1,74 @@
+"""JSON decoding of API responses.
+
+orjson is used when it's installed (`uv sync --extra fast`), otherwise the
+standard library. Pages are always decoded in full: neither decoder can
+skip fields. Album pages (label/artist discographies) can then be trimmed
+to the fields the queue and the filters read, so the smart discography
+filter, which keeps every album of a discography, doesn't hold on to the
+nested artist/label/image/genre objects.
+"""
+
+import json
+import logging
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# album fields read by `pipeline.QueueItem` and `smart_discography_filter`
+ALBUM_FIELDS = (
+    "id",
+    "title",
+    "version",
+    "maximum_bit_depth",
+    "maximum_sampling_rate",
+    "release_date_original",
+)
+
+
+def _orjson():
+    try:
+        import orjson  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        return None
+    return orjson.loads
+
+
+BACKENDS: dict[str, Callable[[bytes | str], Any]] = {"json": json.loads}
+if (_fast := _orjson()) is not None:
+    BACKENDS["orjson"] = _fast
+
+backend = "orjson" if "orjson" in BACKENDS else "json"
+
+
+def use(name):
+    """Selects the decoder ("orjson" or "json")."""
+    global backend
+    if name not in BACKENDS:
+        raise ValueError(f"JSON backend not available: {name}")
+    backend = name
+
+
+def loads(data: bytes | str):
+    if backend == "json":
+        return json.loads(data)
+    try:
+        return BACKENDS[backend](data)
+    except ValueError:
+        # stricter than the standard library (e.g. NaN), let it decide
+        return json.loads(data)
+
+
+def trim_albums(page: dict, key="albums") -> dict:
+    """Keeps only ALBUM_FIELDS (and the artist name) of the albums of a
+    decoded paginated response, in place."""
+    container = page.get(key)
+    if not container or "items" not in container:
+        return page
+    container["items"] = [
+        {
+            **{field: album.get(field) for field in ALBUM_FIELDS},
+            "artist": {"name": (album.get("artist") or {}).get("name")},
+        }
+        for album in container["items"]
+    ]
+    return page
@@ -1,11 +1,13 @@
 import logging
 import os
 import re
+from concurrent.futures import Future
 
 import mutagen.id3 as id3  # type: ignore
-from mutagen.flac import FLAC, Picture
+from mutagen.flac import FLAC, Picture, VCFLACDict
 from mutagen.id3 import ID3NoHeaderError  # type: ignore
 
+from . import diagnostics
 from .utils import clean_unicode
 
 logger = logging.getLogger(__name__)
@@ -16,6 +18,51 @@ COPYRIGHT, PHON_COPYRIGHT = "\u00a9", "\u2117"
 # if a metadata block exceeds this, mutagen will raise error
 # and the file won't be tagged
 FLAC_MAX_BLOCKSIZE = 16777215
+# free space reserved in the tags of new downloads, so that retagging them
+# later only rewrites the header instead of the whole file
+TAG_PADDING = 64 * 1024
+
+# Qobuz IDs written to every file, used by `retag`
+TRACK_ID_TAG = "QOBUZ_TRACK_ID"
+ALBUM_ID_TAG = "QOBUZ_ALBUM_ID"
+
+# what `tag_flac`/`tag_mp3` write: retagging only replaces these, leaving
+# the tags of other tools (BPM, key, ReplayGain, cue points...) alone
+FLAC_TAGS = (
+    "TITLE",
+    "TRACKNUMBER",
+    "DISCNUMBER",
+    "COMPOSER",
+    "ARTIST",
+    "LABEL",
+    "GENRE",
+    "ALBUMARTIST",
+    "TRACKTOTAL",
+    "ALBUM",
+    "DATE",
+    "COPYRIGHT",
+    TRACK_ID_TAG,
+    ALBUM_ID_TAG,
+)
+ID3_FRAMES = (
+    "TIT2",
+    "TPE1",
+    "TRCK",
+    "TPOS",
+    "TPUB",
+    "TCON",
+    "TPE2",
+    "TALB",
+    "TDAT",
+    "TCOP",
+    "TYER",
+    # TYER/TDAT are read back as TDRC
+    "TDRC",
+    f"TXXX:{TRACK_ID_TAG}",
+    f"TXXX:{ALBUM_ID_TAG}",
+)
+# picture type of the embedded cover
+FRONT_COVER = 3
 
 ID3_LEGEND = {
     "album": id3.TALB,  # type: ignore
@@ -47,16 +94,7 @@ def _get_title(track_dict):
 
 
 def log_missing_field(context_id, field, default):
-    try:
-        with open("errors.log", "a", encoding="utf-8") as f:
-            import datetime
-
-            ts = datetime.datetime.now().isoformat()
-            f.write(
-                f"[{ts}] [{context_id}] Missing field: '{field}', used default: '{default}'\n"
-            )
-    except Exception:
-        pass
+    diagnostics.sink.missing_field(context_id, field, default)
 
 
 def get_safe(data, keys, default=None, context_id=""):
@@ -95,7 +133,16 @@ def _format_genres(genres: list) -> str:
     return ", ".join(no_repeats)
 
 
-def _embed_flac_img(root_dir, audio: FLAC):
+def _reserve_padding(info):
+    return TAG_PADDING
+
+
+def _keep_padding(info):
+    # only grow the tag (and rewrite the file) when the new tags don't fit
+    return info.padding if info.padding >= 0 else TAG_PADDING
+
+
+def _embed_flac_img(root_dir, audio: FLAC, cover=None):
     emb_image = os.path.join(root_dir, "cover.jpg")
     multi_emb_image = os.path.join(
         os.path.abspath(os.path.join(root_dir, os.pardir)), "cover.jpg"
@@ -106,9 +153,15 @@ def _embed_flac_img(root_dir, audio: FLAC):
         cover_image = multi_emb_image
 
     try:
+        if cover is not None:
+            data = cover.result()
+        else:
+            with open(cover_image, "rb") as img:
+                data = img.read()
+
         # rest of the metadata still gets embedded
         # when the image size is too big
-        if os.path.getsize(cover_image) > FLAC_MAX_BLOCKSIZE:
+        if len(data) > FLAC_MAX_BLOCKSIZE:
             raise Exception(
                 "downloaded cover size too large to embed. "
                 "turn off `og_cover` to avoid error"
@@ -118,14 +171,17 @@ def _embed_flac_img(root_dir, audio: FLAC):
         image.type = 3
         image.mime = "image/jpeg"
         image.desc = "cover"
-        with open(cover_image, "rb") as img:
-            image.data = img.read()
+        image.data = data
         audio.add_picture(image)
     except Exception as e:
         logger.error(f"Error embedding image: {e}", exc_info=True)
 
 
-def _embed_id3_img(root_dir, audio: id3.ID3):
+def _embed_id3_img(root_dir, audio: id3.ID3, cover=None):
+    if cover is not None:
+        audio.add(id3.APIC(3, "image/jpeg", 3, "", cover.result()))  # type: ignore
+        return
+
     emb_image = os.path.join(root_dir, "cover.jpg")
     multi_emb_image = os.path.join(
         os.path.abspath(os.path.join(root_dir, os.pardir)), "cover.jpg"
@@ -135,26 +191,141 @@ def _embed_id3_img(root_dir, audio: id3.ID3):
     else:
         cover_image = multi_emb_image
 
-    with open(cover_image, "rb") as cover:
-        audio.add(id3.APIC(3, "image/jpeg", 3, "", cover.read()))  # type: ignore
+    with open(cover_image, "rb") as cover_file:
+        audio.add(id3.APIC(3, "image/jpeg", 3, "", cover_file.read()))  # type: ignore
+
+
+class AlbumTagTemplate:
+    """Album-level tags of a release, computed once and shared by all of its
+    tracks: prebuilt Vorbis comment pairs for FLAC and ID3 frames for MP3.
+
+    :param dict album: Album dictionary from Qobuz_client
+    :param dict copyright_source: dict holding the `copyright` field, if it is
+        not the album itself (single tracks use the track's copyright)
+    :param dict label_source: dict holding the `label` field, if it is not
+        the album itself
+    :param str context_id: ID reported for missing fields
+
+    `cover` can be set to a Future resolving to the artwork to embed (see
+    `artwork.prepare`); tracks then embed it instead of reading `cover.jpg`.
+    """
+
+    cover: Future | None = None
+
+    def __init__(
+        self, album: dict, copyright_source=None, label_source=None, context_id=""
+    ):
+        cid = context_id or str(album.get("id", "unknown_id"))
+        if copyright_source is None:
+            copyright_source = album
+        if label_source is None:
+            label_source = album
+
+        self.album_artist = clean_unicode(
+            get_safe(album, ["artist", "name"], "Unknown Artist", cid)
+        )
+        genre = _format_genres(list(get_safe(album, ["genres_list"], [], cid)))
+        tracktotal = str(get_safe(album, ["tracks_count"], "0", cid))
+        title = clean_unicode(get_safe(album, ["title"], "Unknown Album", cid))
+        date = get_safe(album, ["release_date_original"], "0000-00-00", cid)
+        copyright_ = _format_copyright(
+            str(get_safe(copyright_source, ["copyright"], "n/a", cid))
+        )
+        # FLAC and MP3 have always used different defaults for the label
+        flac_label = clean_unicode(
+            get_safe(label_source, ["label", "name"], "n/a", cid)
+        )
+        mp3_label = clean_unicode(
+            get_safe(label_source, ["label", "name"], "Unknown Label", cid)
+        )
+
+        self.album_id = str(album.get("id") or "")
+        self.tracktotal = tracktotal
+        self.flac = [
+            ("LABEL", flac_label),
+            ("GENRE", genre),
+            ("ALBUMARTIST", self.album_artist),
+            ("TRACKTOTAL", tracktotal),
+            ("ALBUM", title),
+            ("DATE", date),
+            ("COPYRIGHT", copyright_),
+        ]
+        tags = {
+            "label": mp3_label,
+            "genre": genre,
+            "albumartist": self.album_artist,
+            "album": title,
+            "date": date,
+            "copyright": copyright_,
+            "year": date[:4],
+        }
+        self.id3 = [
+            ID3_LEGEND[k](encoding=3, text=v) for k, v in tags.items() if v is not None
+        ]
+        if self.album_id:
+            self.flac.append((ALBUM_ID_TAG, self.album_id))
+            self.id3.append(
+                id3.TXXX(encoding=3, desc=ALBUM_ID_TAG, text=self.album_id)  # type: ignore
+            )
+
+    @classmethod
+    def for_track(cls, d: dict, album: dict, istrack=True):
+        """Returns the template `tag_flac`/`tag_mp3` would build for `d`."""
+        if istrack:
+            return cls(
+                d.get("album") or {},
+                copyright_source=d,
+                label_source=album,
+                context_id=str(d.get("id", "unknown_id")),
+            )
+        return cls(album, context_id=str(d.get("id", "unknown_id")))
 
 
-# Use KeyError catching instead of dict.get to avoid empty tags
 def tag_flac(
-    filename, root_dir, final_name, d: dict, album, istrack=True, em_image=False
+    filename,
+    root_dir,
+    final_name,
+    d: dict,
+    album,
+    istrack=True,
+    em_image=False,
+    template=None,
+    retag=False,
 ):
     """
     Tag a FLAC file
 
     :param str filename: FLAC file path
-    :param str root_dir: Root dir used to get the cover art
-    :param str final_name: Final name of the FLAC file (complete path)
+    :param str root_dir: Folder of the track in the library, used to get the
+        cover art and the disc
+    :param str final_name: Final name of the FLAC file (complete path), which
+        may be on the staging directory
     :param dict d: Track dictionary from Qobuz_client
     :param dict album: Album dictionary from Qobuz_client
     :param bool istrack
     :param bool em_image: Embed cover art into file
+    :param AlbumTagTemplate template: prebuilt album-level tags, shared by
+        every track of the release
+    :param bool retag: `filename` is an already tagged file: replace the
+        tags written by this function (FLAC_TAGS) and keep the others,
+        along with the current padding whenever possible
     """
+    if template is None:
+        template = AlbumTagTemplate.for_track(d, album, istrack)
+
     audio = FLAC(filename)
+    if retag:
+        if isinstance(audio.tags, VCFLACDict):
+            for key in FLAC_TAGS:
+                if key in audio.tags:
+                    del audio.tags[key]
+        if em_image:
+            # only the cover is replaced, other pictures are kept
+            audio.metadata_blocks = [
+                block
+                for block in audio.metadata_blocks
+                if not (isinstance(block, Picture) and block.type == FRONT_COVER)
+            ]
 
     try:
         audio["TITLE"] = _get_title(d)
@@ -163,72 +334,42 @@ def tag_flac(
 
     audio["TRACKNUMBER"] = str(d.get("track_number", "0"))  # TRACK NUMBER
 
-    if "Disc " in final_name:
+    # staged files have random names, the library folder tells the disc
+    if "Disc " in root_dir or "Disc " in final_name:
         audio["DISCNUMBER"] = str(d.get("media_number", "1"))
 
     cid = str(d.get("id", "unknown_id"))
-
-    try:
-        audio["COMPOSER"] = get_safe(d, ["composer", "name"], None, cid)  # COMPOSER
-    except KeyError:  # get_safe handles KeyError/None but returns None. FLAC tag assignment with None might fail or be skipped?
-        # FLAC tags are list-like. audio["KEY"] = value. If value is None, it might coerce to string "None" or fail?
-        # Mutagen FLAC keys usually expect string or list of strings.
-        # We should check if None.
-        pass
+    if d.get("id"):
+        audio[TRACK_ID_TAG] = str(d["id"])
 
     comp = get_safe(d, ["composer", "name"], None, cid)
     if comp:
         audio["COMPOSER"] = comp
 
     artist_ = get_safe(d, ["performer", "name"], None)  # TRACK ARTIST
-    if istrack:
-        audio["ARTIST"] = clean_unicode(
-            artist_ or get_safe(d, ["album", "artist", "name"], "Unknown Artist", cid)
-        )  # TRACK ARTIST
-    else:
-        audio["ARTIST"] = clean_unicode(
-            artist_ or get_safe(album, ["artist", "name"], "Unknown Artist", cid)
-        )
-
-    audio["LABEL"] = clean_unicode(get_safe(album, ["label", "name"], "n/a", cid))
+    audio["ARTIST"] = clean_unicode(artist_) if artist_ else template.album_artist
 
-    if istrack:
-        audio["GENRE"] = _format_genres(
-            list(get_safe(d, ["album", "genres_list"], [], cid))
-        )
-        audio["ALBUMARTIST"] = clean_unicode(
-            get_safe(d, ["album", "artist", "name"], "Unknown Artist", cid)
-        )
-        audio["TRACKTOTAL"] = str(get_safe(d, ["album", "tracks_count"], "0", cid))
-        audio["ALBUM"] = clean_unicode(
-            get_safe(d, ["album", "title"], "Unknown Album", cid)
-        )
-        audio["DATE"] = get_safe(
-            d, ["album", "release_date_original"], "0000-00-00", cid
-        )
-        audio["COPYRIGHT"] = _format_copyright(
-            str(get_safe(d, ["copyright"], "n/a", cid))
-        )
-    else:
-        audio["GENRE"] = _format_genres(list(get_safe(album, ["genres_list"], [], cid)))
-        audio["ALBUMARTIST"] = clean_unicode(
-            get_safe(album, ["artist", "name"], "Unknown Artist", cid)
-        )
-        audio["TRACKTOTAL"] = str(get_safe(album, ["tracks_count"], "0", cid))
-        audio["ALBUM"] = clean_unicode(get_safe(album, ["title"], "Unknown Album", cid))
-        audio["DATE"] = get_safe(album, ["release_date_original"], "0000-00-00", cid)
-        audio["COPYRIGHT"] = _format_copyright(
-            str(get_safe(album, ["copyright"], "n/a", cid))
-        )
+    for key, value in template.flac:
+        audio[key] = value
 
     if em_image:
-        _embed_flac_img(root_dir, audio)
+        _embed_flac_img(root_dir, audio, template.cover)
 
-    audio.save()
+    audio.save(padding=_keep_padding if retag else _reserve_padding)
     os.rename(filename, final_name)
 
 
-def tag_mp3(filename, root_dir, final_name, d, album, istrack=True, em_image=False):
+def tag_mp3(
+    filename,
+    root_dir,
+    final_name,
+    d,
+    album,
+    istrack=True,
+    em_image=False,
+    template=None,
+    retag=False,
+):
     """
     Tag an mp3 file
 
@@ -238,84 +379,57 @@ def tag_mp3(filename, root_dir, final_name, d, album, istrack=True, em_image=Fal
     :param dict d: Track dictionary from Qobuz_client
     :param bool istrack
     :param bool em_image: Embed cover art into file
+    :param AlbumTagTemplate template: prebuilt album-level tags, shared by
+        every track of the release
+    :param bool retag: `filename` is an already tagged file: replace the
+        frames written by this function (ID3_FRAMES) and keep the others,
+        along with the current padding whenever possible
     """
+    if template is None:
+        template = AlbumTagTemplate.for_track(d, album, istrack)
 
     try:
         audio = id3.ID3(filename)
     except ID3NoHeaderError:
         audio = id3.ID3()
 
-    # temporarily holds metadata
-    tags = dict()
-    # For _get_title we still pass dict, but we should refactor _get_title too?
-    # Let's keep _get_title usage but maybe wrap it?
-    # Actually _get_title uses d["title"] which might fail.
-    # But "title" is core. Let's assume title exists or let it crash?
-    # User said "prevent KeyError".
+    if retag:
+        for key in list(audio.keys()):
+            if key in ID3_FRAMES or (
+                em_image and key.startswith("APIC") and audio[key].type == FRONT_COVER
+            ):
+                del audio[key]
+
     try:
-        tags["title"] = _get_title(d)
+        title = _get_title(d)
     except KeyError:
-        tags["title"] = "Unknown Title"
-
-    cid = str(d.get("id", "unknown_id"))
-
-    tags["label"] = clean_unicode(
-        get_safe(album, ["label", "name"], "Unknown Label", cid)
-    )
+        title = "Unknown Title"
 
     artist_ = get_safe(d, ["performer", "name"], None)  # TRACK ARTIST
-    if istrack:
-        album_artist = get_safe(d, ["album", "artist", "name"], "Unknown Artist", cid)
-        tags["artist"] = clean_unicode(artist_ or album_artist)
-    else:
-        album_artist = get_safe(album, ["artist", "name"], "Unknown Artist", cid)
-        tags["artist"] = clean_unicode(artist_ or album_artist)
-
-    if istrack:
-        tags["genre"] = _format_genres(
-            list(get_safe(d, ["album", "genres_list"], [], cid))
-        )
-        tags["albumartist"] = clean_unicode(
-            get_safe(d, ["album", "artist", "name"], "Unknown Artist", cid)
-        )
-        tags["album"] = clean_unicode(
-            get_safe(d, ["album", "title"], "Unknown Album", cid)
-        )
-        tags["date"] = get_safe(
-            d, ["album", "release_date_original"], "0000-00-00", cid
-        )
-        tags["copyright"] = _format_copyright(
-            str(get_safe(d, ["copyright"], "n/a", cid))
-        )
-        tracktotal = str(get_safe(d, ["album", "tracks_count"], "0", cid))
-    else:
-        tags["genre"] = _format_genres(list(get_safe(album, ["genres_list"], [], cid)))
-        tags["albumartist"] = clean_unicode(
-            get_safe(album, ["artist", "name"], "Unknown Artist", cid)
-        )
-        tags["album"] = clean_unicode(get_safe(album, ["title"], "Unknown Album", cid))
-        tags["date"] = get_safe(album, ["release_date_original"], "0000-00-00", cid)
-        tags["copyright"] = _format_copyright(
-            str(get_safe(album, ["copyright"], "n/a", cid))
-        )
-        tracktotal = str(get_safe(album, ["tracks_count"], "0", cid))
-
-    tags["year"] = tags["date"][:4]
+    artist = clean_unicode(artist_) if artist_ else template.album_artist
 
+    if title is not None:
+        audio["TIT2"] = id3.TIT2(encoding=3, text=title)  # type: ignore
+    audio["TPE1"] = id3.TPE1(encoding=3, text=artist)  # type: ignore
     audio["TRCK"] = id3.TRCK(  # type: ignore
-        encoding=3, text=f"{d.get('track_number', '0')}/{tracktotal}"
+        encoding=3, text=f"{d.get('track_number', '0')}/{template.tracktotal}"
     )
     audio["TPOS"] = id3.TPOS(encoding=3, text=str(d.get("media_number", "1")))  # type: ignore
+    if d.get("id"):
+        audio[f"TXXX:{TRACK_ID_TAG}"] = id3.TXXX(  # type: ignore
+            encoding=3, desc=TRACK_ID_TAG, text=str(d["id"])
+        )
 
-    # write metadata in `tags` to file
-    for k, v in tags.items():
-        if v is None:
-            continue
-        id3tag = ID3_LEGEND[k]
-        audio[id3tag.__name__] = id3tag(encoding=3, text=v)
+    # frames are never modified when saving, so they can be shared
+    for frame in template.id3:
+        audio[frame.HashKey] = frame
 
     if em_image:
-        _embed_id3_img(root_dir, audio)
+        _embed_id3_img(root_dir, audio, template.cover)
 
-    audio.save(filename, v2_version=3)
+    audio.save(
+        filename,
+        v2_version=3,
+        padding=_keep_padding if retag else _reserve_padding,
+    )
     os.rename(filename, final_name)
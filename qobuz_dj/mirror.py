@@ -0,0 +1,169 @@
+"""Order-preserving playlist mirror.
+
+Playlist tracks are named after their position, so inserting a single track
+at the top changes the expected name of every file after it. Before a
+playlist is downloaded again, its files are matched to track IDs (through
+a ledger kept in the playlist folder, or the `QOBUZ_TRACK_ID` tag for files
+it doesn't know) and renamed to their new positions, and the files of the
+tracks that left the playlist are removed. Only files listed in the ledger
+are ever removed: the folder is named after the playlist, so it may also
+hold an artist or label download of the same name, or the user's files.
+Only the missing tracks are downloaded, then the ledger and the M3U are
+written in playlist order.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from qobuz_dj import downloader, retag
+from qobuz_dj.color import OFF, RED, YELLOW
+from qobuz_dj.utils import RENAME_JOURNAL, apply_rename_plan, recover_renames
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FILE = ".qobuz-dj-playlist.json"
+
+
+def _load_ledger(directory) -> dict:
+    try:
+        with open(os.path.join(directory, LEDGER_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_ledger(directory, paths):
+    """Saves the track ID -> file mapping, in playlist order.
+
+    :param paths: (track ID, path) pairs
+    """
+    ledger = os.path.join(directory, LEDGER_FILE)
+    tmp = f"{ledger}.part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(
+            {track_id: os.path.relpath(path, directory) for track_id, path in paths},
+            f,
+            indent=1,
+        )
+    os.replace(tmp, ledger)
+
+
+def _track_id(path):
+    try:
+        return retag.read_ids(path)[0]
+    except Exception as e:
+        logger.error(f"{RED}Error reading {path}: {e}")
+        return None
+
+
+def index(directory, workers=None) -> dict[str, str]:
+    """Returns the track ID -> path of the audio files under `directory`.
+
+    Files listed in the ledger aren't opened; the others are identified by
+    their tags, in a thread pool.
+    """
+    found = {}
+    for track_id, rel_path in _load_ledger(directory).items():
+        path = os.path.join(directory, rel_path)
+        if os.path.isfile(path):
+            found[track_id] = path
+
+    listed = set(found.values())
+    others = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(directory)
+        for file in files
+        if file.lower().endswith(retag.EXTENSIONS)
+        and os.path.join(root, file) not in listed
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        ids = list(executor.map(_track_id, others))
+    for path, track_id in zip(others, ids, strict=True):
+        if track_id:
+            found.setdefault(track_id, path)
+    return found
+
+
+def build_plan(items, existing, name_for, recorded=()):
+    """Compares the playlist with the local files. Nothing is touched on
+    disk.
+
+    :param items: playlist tracks (`pipeline.QueueItem`), in order
+    :param existing: `index()` of the playlist folder
+    :param name_for: callable(item, file_format) returning the file name of
+        a track, without directory and extension
+    :param recorded: track IDs of the ledger, the only files that may be
+        removed
+    :returns: (renames, missing, removals): (old, new) path pairs for
+        `apply_rename_plan`, the items without a file, and the recorded
+        files of tracks no longer in the playlist
+    """
+    renames, missing = [], []
+    wanted = set()
+    for item in items:
+        track_id = str(item.id)
+        if track_id in wanted:
+            # listed twice: one file, at the first position
+            continue
+        wanted.add(track_id)
+        old = existing.get(track_id)
+        if old is None:
+            missing.append(item)
+            continue
+        _, extension = os.path.splitext(old)
+        name = name_for(item, "MP3" if extension.lower() == ".mp3" else "FLAC")
+        new = downloader.track_path(os.path.dirname(old), name, extension)
+        if new != old:
+            renames.append((old, new))
+    removals = sorted(
+        p for i, p in existing.items() if i not in wanted and i in recorded
+    )
+    return renames, missing, removals
+
+
+def reconcile(directory, items, name_for, workers=None):
+    """Renames and removes the files of `directory` to match the playlist.
+    Files missing from the ledger may be renamed, but are never removed.
+
+    Removals go first, so a new name never collides with a file about to
+    be deleted; renames are applied in two phases by `apply_rename_plan`,
+    journaled so that an interrupted run is put back by the next one.
+
+    :returns: the items to download
+    """
+    journal = os.path.join(directory, RENAME_JOURNAL)
+    recover_renames(journal)
+    recorded = set(_load_ledger(directory))
+    renames, missing, removals = build_plan(
+        items, index(directory, workers), name_for, recorded
+    )
+    for path in removals:
+        try:
+            os.remove(path)
+            logger.info(f"{OFF}Removed {os.path.basename(path)}: not in the playlist")
+        except OSError as e:
+            logger.error(f"{RED}Failed to remove {path}: {e}")
+    renamed, errors, _ = apply_rename_plan(renames, journal)
+    logger.info(
+        f"{YELLOW}Playlist mirror: {renamed} renamed, {len(removals)} removed, "
+        f"{len(missing)} to download" + (f", {errors} errors" if errors else "")
+    )
+    return missing
+
+
+def finish(directory, items, workers=None) -> list[str]:
+    """Records the files of the playlist after its download.
+
+    :returns: their paths, in playlist order (for the M3U)
+    """
+    existing = index(directory, workers)
+    paths = {}
+    for item in items:
+        track_id = str(item.id)
+        if track_id in existing:
+            paths.setdefault(track_id, existing[track_id])
+    paths = list(paths.items())
+    save_ledger(directory, paths)
+    return [path for _, path in paths]
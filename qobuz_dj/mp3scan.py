@@ -0,0 +1,366 @@
+"""Minimal, header-only MP3 reader used by the library scanning features.
+
+Only the ID3v2 header and the requested text frames are decoded (with an
+ID3v1 fallback), and the duration comes from the Xing/Info/VBRI header of
+the first MPEG frame. Nothing else in the file is read, which makes it much
+cheaper than mutagen's `MP3`/`EasyMP3` on large libraries while returning
+the same values for the fields we care about.
+"""
+
+import mmap
+import zlib
+
+SANITIZE_FRAMES = ("TPE1", "TIT2", "TDRC", "TDER", "TYER")
+
+# ID3v2.2 uses three letter frame IDs
+_V22_FRAMES = {
+    "TP1": "TPE1",
+    "TT2": "TIT2",
+    "TAL": "TALB",
+    "TYE": "TYER",
+    "TRK": "TRCK",
+}
+
+# find a sync in the first 1024K, same as mutagen
+_MAX_SYNC_READ = 1024 * 1024
+_ENOUGH_FRAMES = 4
+
+_BITRATES: dict[tuple[float, int], list[int]] = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_BITRATES[(2, 3)] = _BITRATES[(2, 2)]
+for _layer in (1, 2, 3):
+    _BITRATES[(2.5, _layer)] = _BITRATES[(2, _layer)]
+
+_SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+
+def _syncsafe(data: bytes) -> int:
+    value = 0
+    for byte in data:
+        value = (value << 7) | (byte & 0x7F)
+    return value
+
+
+def _decode_text(data: bytes) -> str | None:
+    """Returns the first value of an ID3 text frame."""
+    if not data:
+        return None
+    encoding, raw = data[0], data[1:]
+    try:
+        if encoding == 0:
+            text = raw.decode("latin-1")
+        elif encoding == 1:
+            text = raw.decode("utf-16")
+        elif encoding == 2:
+            text = raw.decode("utf-16-be")
+        elif encoding == 3:
+            text = raw.decode("utf-8")
+        else:
+            return None
+    except UnicodeDecodeError:
+        return None
+    return text.rstrip("\x00").split("\x00")[0]
+
+
+def _read_id3v2(buf, frames) -> tuple[dict, int]:
+    """Parses the ID3v2 tag at the start of `buf`, decoding only `frames`.
+
+    :returns: (tags, end offset of the tag)
+    """
+    tags: dict[str, str] = {}
+    header = buf[:10]
+    if len(header) < 10 or header[:3] != b"ID3":
+        return tags, 0
+
+    major, flags = header[3], header[5]
+    size = _syncsafe(header[6:10])
+    end = 10 + size + (10 if major == 4 and flags & 0x10 else 0)
+    if major not in (2, 3, 4):
+        return tags, end
+
+    body = buf[10 : 10 + size]
+    if flags & 0x80 and major < 4:
+        body = body.replace(b"\xff\x00", b"\xff")
+
+    offset = 0
+    if flags & 0x40 and major == 3:
+        offset = 4 + int.from_bytes(body[:4], "big")
+    elif flags & 0x40 and major == 4:
+        offset = _syncsafe(body[:4])
+
+    id_len, header_len = (3, 6) if major == 2 else (4, 10)
+    while offset + header_len <= len(body):
+        frame_id = body[offset : offset + id_len]
+        if not frame_id.isalnum() or not frame_id.isupper():
+            break  # padding
+        if major == 2:
+            frame_size = int.from_bytes(body[offset + 3 : offset + 6], "big")
+            frame_flags = 0
+        else:
+            raw_size = body[offset + 4 : offset + 8]
+            if major == 4 and not any(b & 0x80 for b in raw_size):
+                frame_size = _syncsafe(raw_size)
+            else:
+                # ID3v2.3, or a v2.4 tag written with plain sizes (iTunes)
+                frame_size = int.from_bytes(raw_size, "big")
+            frame_flags = int.from_bytes(body[offset + 8 : offset + 10], "big")
+
+        start = offset + header_len
+        offset = start + frame_size
+
+        name = frame_id.decode("ascii")
+        if major == 2 and name in _V22_FRAMES:
+            name = _V22_FRAMES[name]
+        if name not in frames or name in tags:
+            continue
+
+        data = body[start:offset]
+        if major == 4:
+            if frame_flags & 0x0004:
+                continue  # encrypted
+            if frame_flags & 0x0040:
+                data = data[1:]
+            if frame_flags & 0x0001:
+                data = data[4:]
+            if frame_flags & 0x0002 or flags & 0x80:
+                data = data.replace(b"\xff\x00", b"\xff")
+            compressed = frame_flags & 0x0008
+        elif major == 3:
+            if frame_flags & 0x0040:
+                continue  # encrypted
+            compressed = frame_flags & 0x0080
+            if compressed:
+                data = data[4:]
+            if frame_flags & 0x0020:
+                data = data[1:]
+        else:
+            compressed = False
+
+        if compressed:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                continue
+
+        text = _decode_text(data)
+        if text is not None:
+            tags[name] = text
+
+    return tags, end
+
+
+def _read_id3v1(buf, frames) -> dict:
+    tags: dict[str, str] = {}
+    if len(buf) < 128 or buf[-128:-125] != b"TAG":
+        return tags
+
+    tail = buf[-128:]
+
+    def field(data: bytes) -> str:
+        return data.split(b"\x00")[0].decode("latin-1").strip(" ")
+
+    values = {
+        "TIT2": field(tail[3:33]),
+        "TPE1": field(tail[33:63]),
+        "TALB": field(tail[63:93]),
+        "TDRC": field(tail[93:97]),
+    }
+    for name, value in values.items():
+        if value and name in frames:
+            tags[name] = value
+    return tags
+
+
+def parse_frame_header(buf, offset: int) -> tuple | None:
+    """Parses the MPEG audio frame header at `offset`.
+
+    :returns: (frame_length, samples_per_frame, sample_rate, bitrate,
+        version, layer, mode) or None if there is no valid header there.
+    """
+    header = buf[offset : offset + 4]
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+
+    version_bits = (header[1] >> 3) & 0x3
+    layer_bits = (header[1] >> 1) & 0x3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 0x3
+    padding = (header[2] >> 1) & 0x1
+    mode = header[3] >> 6
+
+    # be strict to reduce the chance of a false positive
+    if (
+        version_bits == 1
+        or layer_bits == 0
+        or rate_index == 3
+        or bitrate_index in (0, 0xF)
+    ):
+        return None
+
+    version = (2.5, None, 2, 1)[version_bits]
+    layer = 4 - layer_bits
+    bitrate = _BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+
+    if layer == 1:
+        samples, slot = 384, 4
+    elif version >= 2 and layer == 3:
+        samples, slot = 576, 1
+    else:
+        samples, slot = 1152, 1
+
+    frame_length = ((samples // 8 * bitrate) // sample_rate + padding) * slot
+    return frame_length, samples, sample_rate, bitrate, version, layer, mode
+
+
+def _lame_delay(buf, offset: int) -> int:
+    """Returns the encoder delay + padding stored in a LAME header."""
+    version = buf[offset : offset + 20]
+    if len(version) < 20 or not version.startswith((b"LAME", b"L3.99")):
+        return 0
+
+    data = version.lstrip(b"EMAL")
+    major, data = data[0:1], data[1:].lstrip(b".")
+    minor = b""
+    for c in data:
+        if not chr(c).isdigit():
+            break
+        minor += bytes([c])
+    data = data[len(minor) :]
+    try:
+        version_t = (int(major), int(minor))
+    except ValueError:
+        return 0
+    if version_t < (3, 90) or (version_t == (3, 90) and data[-11:-10] == b"("):
+        return 0
+    if len(data) < 11:
+        return 0
+
+    ext = buf[offset + 9 : offset + 36]
+    if len(ext) != 27 or ext[0] >> 4 != 0:
+        return 0
+    delay = (ext[12] << 4) | (ext[13] >> 4)
+    padding = ((ext[13] & 0x0F) << 8) | ext[14]
+    return delay + padding
+
+
+def _vbr_length(buf, offset: int, frame: tuple) -> float | None:
+    """Returns the duration from a Xing/Info or VBRI header, -1 when the
+    header exists but doesn't store a frame count and None if there is no
+    such header.
+    """
+    _, samples, sample_rate, _, version, layer, mode = frame
+    if layer != 3:
+        return None
+
+    if version == 1:
+        xing_offset = 21 if mode == 3 else 36
+    else:
+        xing_offset = 13 if mode == 3 else 21
+
+    pos = offset + xing_offset
+    if buf[pos : pos + 4] in (b"Xing", b"Info"):
+        flags = int.from_bytes(buf[pos + 4 : pos + 8], "big")
+        pos += 8
+        frames = -1
+        if flags & 0x1:
+            frames = int.from_bytes(buf[pos : pos + 4], "big")
+            pos += 4
+        if flags & 0x2:
+            pos += 4
+        if flags & 0x4:
+            pos += 100
+        if flags & 0x8:
+            pos += 4
+        if frames == -1:
+            return -1
+        total = max(0, samples * frames - _lame_delay(buf, pos))
+        return float(total) / sample_rate
+
+    pos = offset + 36
+    vbri = buf[pos : pos + 26]
+    if len(vbri) == 26 and vbri[:4] == b"VBRI" and vbri[4:6] == b"\x00\x01":
+        frames = int.from_bytes(vbri[14:18], "big")
+        return float(samples * frames) / sample_rate
+    return None
+
+
+def _skip_id3(buf, offset: int) -> int:
+    # some taggers stack several ID3v2 tags, skip all of them
+    while buf[offset : offset + 3] == b"ID3":
+        size = _syncsafe(buf[offset + 6 : offset + 10])
+        if not size:
+            break
+        offset += 10 + size
+    return offset
+
+
+def _mpeg_length(buf, offset: int) -> float | None:
+    """Finds the first MPEG frame after `offset` and returns the stream
+    duration, or None if no frame is found.
+    """
+    offset = _skip_id3(buf, offset)
+    limit = min(len(buf), offset + _MAX_SYNC_READ)
+    first = None
+
+    pos = buf.find(b"\xff", offset, limit)
+    while pos != -1:
+        frame = parse_frame_header(buf, pos)
+        if frame is not None:
+            length = _vbr_length(buf, pos, frame)
+            if length is not None:
+                if length == -1:
+                    first = (pos, frame)
+                    break
+                return length
+
+            count, nxt = 1, pos + frame[0]
+            while count < _ENOUGH_FRAMES and parse_frame_header(buf, nxt):
+                nxt += parse_frame_header(buf, nxt)[0]  # type: ignore
+                count += 1
+            if count >= 2 and first is None:
+                first = (pos, frame)
+            if count >= _ENOUGH_FRAMES:
+                first = (pos, frame)
+                break
+        pos = buf.find(b"\xff", pos + 1, limit)
+
+    if first is None:
+        return None
+
+    # no VBR header: estimate from the file size, like mutagen does for CBR
+    pos, frame = first
+    return 8 * (len(buf) - pos) / float(frame[3])
+
+
+def scan_mp3(path, frames=SANITIZE_FRAMES, length=False):
+    """Reads the ID3 text `frames` of an MP3 and, optionally, its duration.
+
+    Values are returned as strings keyed by their ID3v2.4 frame ID, with
+    ID3v1 values used for frames missing from the ID3v2 tag. `length` is
+    None when not requested or when no MPEG frame could be found.
+
+    :returns: (tags, length)
+    """
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file
+            return {}, None
+
+    with buf:
+        tags, end = _read_id3v2(buf, frames)
+        for name, value in _read_id3v1(buf, frames).items():
+            tags.setdefault(name, value)
+        duration = _mpeg_length(buf, end) if length else None
+
+    return tags, duration
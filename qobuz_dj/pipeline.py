@@ -0,0 +1,177 @@
+"""Streaming producer/consumer pipeline for URLs with many items (labels,
+artists and playlists).
+
+    pages/items --[item queue]--> prefetch (album/get) --[ready queue]--> download
+
+Items are pulled from the page generator by a producer thread and the next
+releases' metadata is fetched by a prefetch thread while the current one is
+being downloaded. Both queues are bounded, so only a few pages worth of
+items are kept in memory no matter how big the label is.
+"""
+
+import logging
+import queue
+import threading
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+ITEM_QUEUE_SIZE = 64
+PREFETCH_QUEUE_SIZE = 2
+
+_DONE = object()
+
+
+class QueueItem:
+    """Compact record of a queued album or track.
+
+    Page items carry nested artist, label, image and genre objects; only the
+    fields used to filter, order and name downloads are kept. Tracks also
+    keep their full dict (`meta`), so `Download` doesn't need a track/get
+    call for them.
+    """
+
+    __slots__ = (
+        "id",
+        "kind",
+        "ordinal",
+        "title",
+        "version",
+        "artist",
+        "release_date",
+        "bit_depth",
+        "sampling_rate",
+        "meta",
+    )
+
+    def __init__(
+        self,
+        id,
+        kind,
+        ordinal=None,
+        title="",
+        version=None,
+        artist=None,
+        release_date="0000-00-00",
+        bit_depth=None,
+        sampling_rate=None,
+        meta=None,
+    ):
+        self.id = id
+        self.kind = kind
+        self.ordinal = ordinal
+        self.title = title
+        self.version = version
+        self.artist = artist
+        self.release_date = release_date
+        self.bit_depth = bit_depth
+        self.sampling_rate = sampling_rate
+        self.meta = meta
+
+    @classmethod
+    def from_dict(cls, d: dict, kind="album", ordinal=None):
+        """Builds the record of an album or track dict from the API."""
+        album = d if kind == "album" else d.get("album") or {}
+        artist = (album.get("artist") or {}).get("name")
+        return cls(
+            d["id"],
+            kind,
+            ordinal,
+            d.get("title", ""),
+            d.get("version"),
+            artist,
+            album.get("release_date_original") or "0000-00-00",
+            d.get("maximum_bit_depth"),
+            d.get("maximum_sampling_rate"),
+            d if kind == "track" else None,
+        )
+
+    def __repr__(self):
+        return f"QueueItem({self.kind} {self.id}: {self.title!r})"
+
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+
+class Pipeline:
+    """Iterates over (item, prefetched) pairs.
+
+    :param items: items to download, possibly a lazy generator of API pages
+    :param prefetch: called with every item in the background, its result
+        is yielded with the item (None if it raises)
+    """
+
+    def __init__(
+        self,
+        items: Iterable,
+        prefetch: Callable | None = None,
+        item_queue=ITEM_QUEUE_SIZE,
+        prefetch_queue=PREFETCH_QUEUE_SIZE,
+    ):
+        self.items = items
+        self.prefetch = prefetch
+        self._items: queue.Queue = queue.Queue(maxsize=item_queue)
+        self._ready: queue.Queue = queue.Queue(maxsize=prefetch_queue)
+        self._stop = threading.Event()
+
+    def _put(self, q, value) -> bool:
+        while not self._stop.is_set():
+            try:
+                q.put(value, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for item in self.items:
+                if not self._put(self._items, item):
+                    return
+        except Exception as e:
+            self._put(self._items, _Failed(e))
+        self._put(self._items, _DONE)
+
+    def _get(self, q):
+        """Next value of `q`, or _DONE once the pipeline is stopped."""
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _prefetch(self):
+        while True:
+            item = self._get(self._items)
+            if item is _DONE or isinstance(item, _Failed):
+                self._put(self._ready, item)
+                return
+            prefetched = None
+            if self.prefetch is not None:
+                try:
+                    prefetched = self.prefetch(item)
+                except Exception as e:
+                    logger.debug(f"Prefetch failed, fetching it later: {e}")
+            if not self._put(self._ready, (item, prefetched)):
+                return
+
+    def __iter__(self):
+        threads = [
+            threading.Thread(target=self._produce, daemon=True),
+            threading.Thread(target=self._prefetch, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                value = self._ready.get()
+                if value is _DONE:
+                    return
+                if isinstance(value, _Failed):
+                    raise value.error
+                yield value
+        finally:
+            self._stop.set()
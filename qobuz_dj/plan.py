@@ -0,0 +1,208 @@
+"""Plan-then-apply downloads.
+
+`plan` resolves the sources (pages, filters, album metadata, quality
+probes and target folders) without downloading anything, and writes a JSON
+plan with the estimated size of every item. `apply` only runs the
+transfers of a plan, several releases at once, so big jobs can be reviewed,
+split across machines, and planned away from where they are downloaded.
+
+The plan only keeps what `apply` needs (IDs, formats, folders) and what
+helps reviewing it (titles, quality, sizes). Metadata is requested again by
+`apply`, and so are the file URLs: they are signed and expire a few minutes
+after they are issued.
+"""
+
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from qobuz_dj import downloader
+from qobuz_dj.color import GREEN, OFF, RED, YELLOW
+from qobuz_dj.exceptions import NonStreamable
+from qobuz_dj.utils import make_m3u
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+PLAN_WORKERS = 8
+APPLY_WORKERS = 2
+
+
+def format_size(size) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+class Planner:
+    """Records what `QobuzDL.download_from_id` would download (see
+    `QobuzDL.planner`) and probes the items in a thread pool.
+
+    :param QobuzDL qobuz: logged in downloader
+    :param int workers: items probed at once
+    """
+
+    def __init__(self, qobuz, workers=PLAN_WORKERS):
+        self.qobuz = qobuz
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = []
+
+    def add(self, item_id, album, alt_path, track_count, meta):
+        # formats change with the source in DJ and top tracks modes
+        formats = (self.qobuz.folder_format, self.qobuz.track_format)
+        dloader = self.qobuz.new_download(
+            item_id, alt_path, track_count, meta, formats=formats
+        )
+        entry = {
+            "id": str(item_id),
+            "kind": "album" if album else "track",
+            "path": os.path.relpath(alt_path, self.qobuz.directory)
+            if alt_path
+            else None,
+            "track_count": track_count,
+            "folder_format": formats[0],
+            "track_format": formats[1],
+        }
+        self.pending.append((entry, self.pool.submit(dloader.probe, not album)))
+        return True
+
+    def entries(self):
+        """Yields the plan entries, in source order. Items listed by several
+        sources are only planned once."""
+        seen = set()
+        for entry, future in self.pending:
+            key = (entry["kind"], entry["id"])
+            try:
+                probe = future.result()
+            except downloader.TRACK_ERRORS + (NonStreamable,) as e:
+                logger.error(f"{RED}Error planning {entry['id']}: {e}. Skipping...")
+                continue
+            if probe is None or key in seen:
+                continue
+            seen.add(key)
+            probe["folder"] = os.path.relpath(probe["folder"], self.qobuz.directory)
+            yield {**entry, **probe}
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+def make_plan(qobuz, sources, output, workers=PLAN_WORKERS):
+    """Resolves `sources` (URLs or text files, like `dl`) into a plan.
+
+    :returns: the plan
+    """
+    planner = Planner(qobuz, workers)
+    qobuz.planner = planner
+    # nothing is downloaded, so nothing may be recorded as handled
+    qobuz.since_last = qobuz.mirror_playlists = False
+    try:
+        qobuz.download_list_of_urls(sources)
+        entries = list(planner.entries())
+    finally:
+        qobuz.planner = None
+        planner.close()
+
+    plan = {
+        "version": PLAN_VERSION,
+        "quality": int(qobuz.quality),
+        "size": sum(entry["size"] for entry in entries),
+        "items": entries,
+    }
+    save_plan(plan, output)
+    logger.info(
+        f"{GREEN}{len(entries)} items planned in {output}, about "
+        f"{format_size(plan['size'])}"
+    )
+    return plan
+
+
+def save_plan(plan, path):
+    tmp = f"{path}.part"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(plan, f, indent=1)
+    os.replace(tmp, path)
+
+
+def load_plan(path) -> dict:
+    """:raises ValueError: if `path` isn't a plan this version can apply"""
+    with open(path, "r", encoding="utf-8") as f:
+        plan = json.load(f)
+    if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} is not a version {PLAN_VERSION} plan")
+    return plan
+
+
+def apply_plan(qobuz, path, workers=APPLY_WORKERS):
+    """Downloads the items of a plan into `qobuz.directory`, `workers`
+    folders at once. Items sharing a folder (playlists, top tracks, DJ mode)
+    are downloaded one after another, since they share its cover. Items
+    downloaded since the plan was made are skipped through the database.
+
+    :returns: number of items handled
+    """
+    plan = load_plan(path)
+    items = plan["items"]
+    if not items:
+        logger.info(f"{OFF}Nothing to download")
+        return 0
+    # the quality the plan was probed with
+    qobuz.quality = plan["quality"]
+    logger.info(
+        f"{YELLOW}Applying {path}: {len(items)} items, about "
+        f"{format_size(plan['size'])}"
+    )
+
+    def transfer(worker, entry):
+        alt_path = entry["path"] and os.path.join(qobuz.directory, entry["path"])
+        if alt_path:
+            os.makedirs(alt_path, exist_ok=True)
+        return worker.download_from_id(
+            entry["id"],
+            entry["kind"] == "album",
+            alt_path,
+            entry["track_count"],
+            formats=(entry["folder_format"], entry["track_format"]),
+        )
+
+    folders: dict[str, list] = {}
+    for entry in items:
+        folders.setdefault(entry["folder"], []).append(entry)
+
+    workers_used = []
+
+    def transfer_folder(entries):
+        # concurrent folders don't share their staged files or failed tracks
+        worker = qobuz.worker()
+        workers_used.append(worker)
+        try:
+            return sum(transfer(worker, entry) for entry in entries)
+        finally:
+            worker.mover.flush()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                handled = sum(pool.map(transfer_folder, folders.values()))
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+    finally:
+        for worker in workers_used:
+            # retried by `qobuz.retry_failed` with the rest of the run
+            qobuz.retry_queue.extend(worker.retry_queue)
+
+    if not qobuz.no_m3u_for_playlists:
+        # playlist (and top tracks) folders: tracks carry their position
+        for folder in sorted(
+            {
+                e["path"]
+                for e in items
+                if e["kind"] == "track" and e["track_count"] and e["path"]
+            }
+        ):
+            make_m3u(os.path.join(qobuz.directory, folder))
+    return handled
@@ -2,12 +2,14 @@
 # of qopy, originally written by Sorrow446. All credits to the
 # original author.
 
+import functools
 import hashlib
 import logging
 import time
 
 import requests
 
+from qobuz_dj import concurrency, hedging, jsonbackend
 from qobuz_dj.color import GREEN, YELLOW
 from qobuz_dj.exceptions import (
     AuthenticationError,
@@ -18,11 +20,25 @@ from qobuz_dj.exceptions import (
 )
 
 RESET = "Reset your credentials with 'qobuz-dl -r'"
+# (connect, read) timeouts in seconds
+TIMEOUT = (10, 30)
+# idempotent metadata endpoints that can be hedged
+HEDGED_ENDPOINTS = {
+    "album/get",
+    "track/get",
+    "album/search",
+    "artist/search",
+    "playlist/search",
+    "track/search",
+}
 
 logger = logging.getLogger(__name__)
 
 
 class Client:
+    # optional hedging.Hedger for HEDGED_ENDPOINTS
+    hedger: hedging.Hedger | None = None
+
     def __init__(self, email, pwd, app_id, secrets):
         logger.info(f"{YELLOW}Logging...")
         self.secrets = secrets
@@ -37,6 +53,7 @@ class Client:
         )
         self.base = "https://www.qobuz.com/api.json/0.2/"
         self.sec = None
+        self.limiter = concurrency.api
         self.auth(email, pwd)
         self.cfg_setup()
 
@@ -76,12 +93,17 @@ class Client:
         elif epoint == "favorite/getUserFavorites":
             unix = time.time()
             # r_sig = "userLibrarygetAlbumsList" + str(unix) + kwargs["sec"]
-            r_sig = "favoritegetUserFavorites" + str(unix) + kwargs["sec"]
+            sec = kwargs.get("sec", self.sec)
+            if sec is None:
+                raise InvalidAppSecretError("No valid app secret set.\n" + RESET)
+            r_sig = "favoritegetUserFavorites" + str(unix) + sec
             r_sig_hashed = hashlib.md5(r_sig.encode("utf-8")).hexdigest()
             params = {
                 "app_id": self.id,
                 "user_auth_token": self.uat,
-                "type": "albums",
+                "type": kwargs.get("type", "albums"),
+                "offset": kwargs.get("offset", 0),
+                "limit": kwargs.get("limit", 50),
                 "request_ts": unix,
                 "request_sig": r_sig_hashed,
             }
@@ -104,7 +126,11 @@ class Client:
             }
         else:
             params = kwargs
-        r = self.session.get(self.base + epoint, params=params)
+        get = functools.partial(self._get, self.base + epoint, params)
+        if self.hedger is not None and epoint in HEDGED_ENDPOINTS:
+            r = self.hedger.call(epoint, get)
+        else:
+            r = get()
         if epoint == "user/login":
             if r.status_code == 401:
                 raise AuthenticationError("Invalid credentials.\n" + RESET)
@@ -119,7 +145,13 @@ class Client:
             raise InvalidAppSecretError(f"Invalid app secret: {r.json()}.\n" + RESET)
 
         r.raise_for_status()
-        return r.json()
+        return jsonbackend.loads(r.content)
+
+    def _get(self, url, params):
+        with self.limiter.slot() as slot:
+            r = self.session.get(url, params=params, timeout=TIMEOUT)
+            slot.check_status(r.status_code)
+        return r
 
     def auth(self, email, pwd):
         usr_info = self.api_call("user/login", email=email, pwd=pwd)
@@ -130,7 +162,9 @@ class Client:
         self.label = usr_info["user"]["credential"]["parameters"]["short_label"]
         logger.info(f"{GREEN}Membership: {self.label}")
 
-    def multi_meta(self, epoint, key, id, type):
+    def multi_meta(self, epoint, key, id, type, trimmed=False):
+        """Yields the pages of `epoint`. With `trimmed`, their albums only
+        keep the fields in `jsonbackend.ALBUM_FIELDS`."""
         total = 1
         offset = 0
         while total > 0:
@@ -138,6 +172,8 @@ class Client:
                 j = self.api_call(epoint, id=id, offset=offset, type=type)[type]
             else:
                 j = self.api_call(epoint, id=id, offset=offset, type=type)
+            if trimmed:
+                jsonbackend.trim_albums(j)
             if offset == 0:
                 yield j
                 total = j[key] - 500
@@ -155,8 +191,8 @@ class Client:
     def get_track_url(self, id, fmt_id):
         return self.api_call("track/getFileUrl", id=id, fmt_id=fmt_id)
 
-    def get_artist_meta(self, id):
-        return self.multi_meta("artist/get", "albums_count", id, None)
+    def get_artist_meta(self, id, trimmed=False):
+        return self.multi_meta("artist/get", "albums_count", id, None, trimmed)
 
     def get_artist_top_tracks(self, id, limit=5):
         return self.api_call("artist/get", id=id, extra="tracks", limit=limit)[
@@ -166,8 +202,8 @@ class Client:
     def get_plist_meta(self, id):
         return self.multi_meta("playlist/get", "tracks_count", id, None)
 
-    def get_label_meta(self, id):
-        return self.multi_meta("label/get", "albums_count", id, None)
+    def get_label_meta(self, id, trimmed=False):
+        return self.multi_meta("label/get", "albums_count", id, None, trimmed)
 
     def search_albums(self, query, limit):
         return self.api_call("album/search", query=query, limit=limit)
@@ -196,8 +232,8 @@ class Client:
             "favorite/getUserFavorites", type="artists", offset=offset, limit=limit
         )
 
-    def get_user_playlists(self, limit):
-        return self.api_call("playlist/getUserPlaylists", limit=limit)
+    def get_user_playlists(self, limit, offset=0):
+        return self.api_call("playlist/getUserPlaylists", limit=limit, offset=offset)
 
     def test_secret(self, sec):
         try:
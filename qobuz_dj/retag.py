@@ -0,0 +1,388 @@
+"""Re-applies the current tagging logic to an already downloaded library.
+
+Files are matched to Qobuz through the IDs written when they were tagged
+(`QOBUZ_TRACK_ID`/`QOBUZ_ALBUM_ID`). Files tagged before those existed are
+looked up with an album search on their album artist, album and track count
+tags, then by disc and track number; they get the IDs once retagged. The
+album and track metadata is cached in a JSON file at the root of the
+retagged directory, so running `retag` again after changing the tagging
+code doesn't need the API at all.
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, ID3NoHeaderError  # type: ignore
+
+from qobuz_dj import artwork, metadata
+from qobuz_dj.color import GREEN, OFF, RED, YELLOW
+from qobuz_dj.utils import clean_unicode
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = ".qobuz-dj-meta.json"
+# album search results checked for files without Qobuz IDs
+SEARCH_LIMIT = 10
+EXTENSIONS = (".flac", ".mp3")
+
+
+def read_ids(path) -> tuple[str | None, str | None, bool]:
+    """Returns the Qobuz track and album IDs stored in `path` and whether it
+    has embedded artwork.
+    """
+    if path.lower().endswith(".flac"):
+        audio = FLAC(path)
+        tags = audio.tags or {}
+
+        def get(key):
+            values = tags.get(key)  # type: ignore
+            return values[0] if values else None
+
+        return (
+            get(metadata.TRACK_ID_TAG),
+            get(metadata.ALBUM_ID_TAG),
+            bool(audio.pictures),
+        )
+
+    try:
+        audio = ID3(path)
+    except ID3NoHeaderError:
+        return None, None, False
+
+    def get_txxx(key):
+        frame = audio.get(f"TXXX:{key}")
+        return str(frame.text[0]) if frame else None
+
+    return (
+        get_txxx(metadata.TRACK_ID_TAG),
+        get_txxx(metadata.ALBUM_ID_TAG),
+        bool(audio.getall("APIC")),
+    )
+
+
+def _number(value) -> int | None:
+    """Parses "3" or "3/12" as 3."""
+    try:
+        return int(str(value).split("/")[0])
+    except ValueError:
+        return None
+
+
+def read_legacy_tags(path):
+    """Returns the (album artist, album, track total, disc, track number)
+    of a file tagged without Qobuz IDs, None if some of them are missing.
+    """
+    if path.lower().endswith(".flac"):
+        tags = FLAC(path).tags or {}
+
+        def get(key):
+            values = tags.get(key)  # type: ignore
+            return values[0] if values else None
+
+        artist, album = get("ALBUMARTIST"), get("ALBUM")
+        total, disc, number = get("TRACKTOTAL"), get("DISCNUMBER"), get("TRACKNUMBER")
+    else:
+        try:
+            audio = ID3(path)
+        except ID3NoHeaderError:
+            return None
+
+        def text(key):
+            frame = audio.get(key)
+            return str(frame.text[0]) if frame else None
+
+        artist, album = text("TPE2"), text("TALB")
+        disc, number = text("TPOS"), text("TRCK")
+        total = number.split("/")[1] if number and "/" in number else None
+
+    number = _number(number) if number else None
+    if not (artist and album and number):
+        return None
+    total = _number(total) if total else None
+    return artist, album, total, _number(disc or 1) or 1, number
+
+
+def _safe_read_legacy_tags(path):
+    try:
+        return read_legacy_tags(path)
+    except Exception as e:
+        logger.error(f"{RED}Error reading {path}: {e}")
+        return None
+
+
+def _same(a, b) -> bool:
+    return clean_unicode(a or "").casefold().strip() == (b or "").casefold().strip()
+
+
+def _best_match(results, artist, album, total):
+    """ID of the first search result with the same artist, title and
+    (when known) track count."""
+    for item in results:
+        if (
+            _same(item.get("title"), album)
+            and _same((item.get("artist") or {}).get("name"), artist)
+            and (total is None or item.get("tracks_count") == total)
+        ):
+            return str(item["id"])
+    return None
+
+
+def _safe_read_ids(path):
+    try:
+        return read_ids(path)
+    except Exception as e:
+        logger.error(f"{RED}Error reading {path}: {e}")
+        return None, None, False
+
+
+class MetadataCache:
+    """Album/track API responses, persisted as JSON.
+
+    :param str path: cache file
+    :param get_client: callable returning a logged in `qopy.Client`; only
+        called when something is missing from the cache
+    :param bool refresh: ignore the cached responses
+    """
+
+    def __init__(self, path, get_client, refresh=False):
+        self.path = path
+        self._get_client = get_client
+        self._client = None
+        self._lock = threading.Lock()
+        self.data: dict[str, dict] = {"albums": {}, "tracks": {}, "searches": {}}
+        self.fetched = 0
+
+        if not refresh and os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.data.update(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"{YELLOW}Ignoring unreadable cache {path}: {e}")
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = self._get_client()
+            return self._client
+
+    def _get(self, kind, item_id, fetch):
+        if item_id in self.data[kind]:
+            return self.data[kind][item_id]
+        try:
+            meta = fetch(item_id)
+        except Exception as e:
+            logger.error(f"{RED}Error getting metadata for {item_id}: {e}")
+            return None
+        with self._lock:
+            self.data[kind][item_id] = meta
+            self.fetched += 1
+        return meta
+
+    def album(self, album_id):
+        return self._get("albums", album_id, lambda i: self.client.get_album_meta(i))
+
+    def track(self, track_id):
+        return self._get("tracks", track_id, lambda i: self.client.get_track_meta(i))
+
+    def search(self, artist, album, total):
+        """Album ID matching the tags of a file without Qobuz IDs, or None."""
+
+        def fetch(_):
+            results = self.client.search_albums(f"{artist} {album}", SEARCH_LIMIT)
+            items = (results.get("albums") or {}).get("items") or []
+            return _best_match(items, artist, album, total)
+
+        return self._get("searches", f"{artist}\t{album}\t{total}", fetch)
+
+    def save(self):
+        if not self.fetched:
+            return
+        tmp = f"{self.path}.part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+
+def _album_track(album, track_id):
+    if not album:
+        return None
+    for track in album.get("tracks", {}).get("items", []):
+        if str(track.get("id")) == track_id:
+            return track
+    return None
+
+
+def _find_cover(root_dir):
+    for d in (root_dir, os.path.dirname(root_dir)):
+        cover = os.path.join(d, "cover.jpg")
+        if os.path.isfile(cover):
+            return cover
+    return None
+
+
+def _list_files(directory):
+    return sorted(
+        os.path.join(root, f)
+        for root, _, files in os.walk(directory)
+        for f in files
+        if f.lower().endswith(EXTENSIONS) and not f.startswith(".")
+    )
+
+
+def retag_library(
+    directory,
+    get_client,
+    workers=None,
+    refresh=False,
+    embed_art_size=artwork.DEFAULT_EMBED_SIZE,
+    embed_art_quality=artwork.DEFAULT_EMBED_QUALITY,
+):
+    """Retags every FLAC/MP3 under `directory` in place.
+
+    Embedded artwork is only replaced for files that already have it, from
+    the `cover.jpg` next to them; otherwise the current picture is kept.
+
+    :param get_client: callable returning a logged in `qopy.Client`
+    :param int workers: number of threads (default: automatic)
+    :param bool refresh: re-fetch metadata instead of using the cache
+    :returns: (retagged, skipped, errors)
+    """
+    files = _list_files(directory)
+    if not files:
+        logger.info(f"{YELLOW}No FLAC or MP3 files found in {directory}")
+        return 0, 0, 0
+
+    cache = MetadataCache(os.path.join(directory, CACHE_FILE), get_client, refresh)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ids = dict(zip(files, pool.map(_safe_read_ids, files), strict=True))
+
+        legacy = [path for path, (track_id, _, _) in ids.items() if not track_id]
+        if legacy:
+            _match_legacy(legacy, ids, cache, pool)
+
+        skipped = [path for path, (track_id, _, _) in ids.items() if not track_id]
+        album_ids = {album_id for _, album_id, _ in ids.values() if album_id}
+        albums: dict[str | None, dict | None] = dict(
+            zip(album_ids, pool.map(cache.album, album_ids), strict=True)
+        )
+
+        # tracks downloaded on their own, or gone from their album
+        track_ids = {
+            track_id
+            for track_id, album_id, _ in ids.values()
+            if track_id and not _album_track(albums.get(album_id), track_id)
+        }
+        tracks = dict(zip(track_ids, pool.map(cache.track, track_ids), strict=True))
+
+        templates = {}
+        jobs = []
+        for path, (track_id, album_id, has_art) in ids.items():
+            if not track_id:
+                continue
+
+            root_dir = os.path.dirname(path)
+            cover = _find_cover(root_dir) if has_art else None
+            album = albums.get(album_id)
+            track = _album_track(album, track_id)
+            if track is not None:
+                key = (album_id, cover)
+                if key not in templates:
+                    templates[key] = metadata.AlbumTagTemplate(album)  # type: ignore
+                    if cover:
+                        templates[key].cover = artwork.prepare(
+                            cover, embed_art_size, embed_art_quality
+                        )
+                template, istrack = templates[key], False
+            elif single := tracks.get(track_id):
+                track = album = single
+                template = metadata.AlbumTagTemplate.for_track(track, album)
+                if cover:
+                    template.cover = artwork.prepare(
+                        cover, embed_art_size, embed_art_quality
+                    )
+                istrack = True
+            else:
+                skipped.append(path)
+                continue
+
+            jobs.append(
+                pool.submit(
+                    _retag_file, path, track, album, istrack, bool(cover), template
+                )
+            )
+
+        results = [job.result() for job in jobs]
+
+    cache.save()
+
+    retagged = sum(results)
+    errors = len(results) - retagged
+    for path in skipped:
+        logger.info(f"{OFF}No Qobuz metadata for {path}. Skipping")
+    logger.info(
+        f"{GREEN}Retagged {retagged} files"
+        f"{f', skipped {len(skipped)}' if skipped else ''}"
+        f"{f', {errors} errors' if errors else ''}"
+    )
+    return retagged, len(skipped), errors
+
+
+def _match_legacy(paths, ids, cache, pool):
+    """Finds the IDs of files tagged before Qobuz IDs were stored, through
+    an album search on their album artist/album/track count tags, and
+    their disc and track numbers. Updates `ids` in place.
+    """
+    tags = dict(zip(paths, pool.map(_safe_read_legacy_tags, paths), strict=True))
+    queries = {t[:3] for t in tags.values() if t}
+    if not queries:
+        return
+    logger.info(
+        f"{YELLOW}{len(paths)} files have no Qobuz IDs, searching "
+        f"{len(queries)} albums by their tags"
+    )
+    found = dict(
+        zip(queries, pool.map(lambda q: cache.search(*q), queries), strict=True)
+    )
+    album_ids = {album_id for album_id in found.values() if album_id}
+    albums = dict(zip(album_ids, pool.map(cache.album, album_ids), strict=True))
+
+    for path, file_tags in tags.items():
+        if not file_tags:
+            continue
+        album_id = found[file_tags[:3]]
+        album = albums.get(album_id) or {}
+        _, _, _, disc, number = file_tags
+        for track in (album.get("tracks") or {}).get("items") or []:
+            if (track.get("media_number") or 1) == disc and track.get(
+                "track_number"
+            ) == number:
+                ids[path] = (str(track["id"]), album_id, ids[path][2])
+                break
+
+
+def _retag_file(path, track, album, istrack, em_image, template):
+    tag_function = (
+        metadata.tag_flac if path.lower().endswith(".flac") else metadata.tag_mp3
+    )
+    try:
+        tag_function(
+            path,
+            os.path.dirname(path),
+            path,
+            track,
+            album,
+            istrack,
+            em_image,
+            template=template,
+            retag=True,
+        )
+        return True
+    except Exception as e:
+        logger.error(f"{RED}Error retagging {path}: {e}")
+        return False
@@ -0,0 +1,149 @@
+"""Staging directory for in-progress downloads.
+
+With a staging directory (e.g. tmpfs or a local SSD), tracks are downloaded
+and tagged there, and only the finished files are moved to the library.
+When both are on the same filesystem that's a rename. Otherwise a
+background thread copies the files one at a time next to their
+destination, and every FSYNC_BATCH files (or at `flush`) syncs the batch
+and renames the copies into place, so the slow medium only sees
+sequential writes and few syncs.
+
+Staged files are registered in `tempfiles.registry` by the downloader, and
+released here once they are in the library.
+"""
+
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+
+from qobuz_dj import tempfiles
+from qobuz_dj.color import RED
+
+logger = logging.getLogger(__name__)
+
+FSYNC_BATCH = 16
+
+_FLUSH = object()
+
+
+def staged_file(staging_dir) -> str:
+    """Returns a new, unique temporary file in `staging_dir`."""
+    os.makedirs(staging_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=staging_dir)
+    os.close(fd)
+    return path
+
+
+def _same_filesystem(src, dst) -> bool:
+    try:
+        return os.stat(src).st_dev == os.stat(os.path.dirname(dst) or ".").st_dev
+    except OSError:
+        return False
+
+
+def _fsync(path, directory=False):
+    try:
+        fd = os.open(path, os.O_RDONLY if directory else os.O_RDWR)
+    except OSError:
+        return  # directories can't be opened on Windows
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Mover:
+    """Moves finished files from the staging directory to the library.
+
+    :param int batch: files copied between syncs
+    """
+
+    def __init__(self, batch=FSYNC_BATCH):
+        self.batch = batch
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # (staged file, copy next to the destination, destination)
+        self._copied: list[tuple[str, str, str]] = []
+        self._failed = 0
+        # moves that failed in all the flushes so far
+        self.failures = 0
+
+    def move(self, src, dst):
+        """Moves `src` to `dst`, in the background if it needs a copy."""
+        if _same_filesystem(src, dst):
+            os.replace(src, dst)
+            tempfiles.registry.release(src)
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._queue.put((src, dst))
+
+    def flush(self) -> bool:
+        """Waits for the queued moves. Returns False if any of them failed
+        (the files are kept in the staging directory)."""
+        if self._thread is None:
+            return True
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        failed, self._failed = self._failed, 0
+        self.failures += failed
+        return not failed
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _FLUSH:
+                    self._sync()
+                else:
+                    self._copy(*job)
+                    if len(self._copied) >= self.batch:
+                        self._sync()
+            except Exception as e:
+                logger.error(f"{RED}Error moving a staged file: {e}")
+                self._failed += 1
+            finally:
+                self._queue.task_done()
+
+    def _copy(self, src, dst):
+        part = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.tmp")
+        tempfiles.registry.register(part)
+        try:
+            shutil.copyfile(src, part)
+        except OSError as e:
+            logger.error(f"{RED}Error copying {src} to {dst}: {e}")
+            self._failed += 1
+            return
+        self._copied.append((src, part, dst))
+
+    def _sync(self):
+        copied, self._copied = self._copied, []
+        directories = set()
+        for src, part, dst in copied:
+            try:
+                _fsync(part)
+                os.replace(part, dst)
+            except OSError as e:
+                logger.error(f"{RED}Error moving {src} to {dst}: {e}")
+                self._failed += 1
+                continue
+            tempfiles.registry.release(part)
+            directories.add(os.path.dirname(dst))
+            try:
+                os.remove(src)
+            except OSError:
+                continue
+            tempfiles.registry.release(src)
+        for directory in directories:
+            _fsync(directory, directory=True)
+
+
+mover = Mover()
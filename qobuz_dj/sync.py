@@ -0,0 +1,286 @@
+"""Incremental mirroring of the user's Qobuz library.
+
+`sync favorites` pages through the favorite albums/tracks (newest first)
+and stops at the first page without unseen IDs, so a daily run costs one
+or two API calls. `sync playlists` lists the user's playlists and only
+downloads the ones whose modification date or track count changed, several
+at once. With `--since-last`, artist and label discographies are paged
+only down to the releases handled by the previous run. What was handled is
+kept in a JSON snapshot at the root of the download directory.
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from qobuz_dj.color import OFF, RED, YELLOW
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = ".qobuz-dj-sync.json"
+FAVORITE_TYPES = ("albums", "tracks", "artists")
+PAGE_SIZE = 100
+PLAYLISTS_PAGE_SIZE = 500
+PLAYLIST_WORKERS = 4
+
+WEB_URL = "https://play.qobuz.com/"
+
+
+class SyncState:
+    """JSON snapshot of what previous syncs handled, saved atomically."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, STATE_FILE)
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self._lock = threading.Lock()
+
+    def section(self, name) -> dict:
+        return self.data.setdefault(name, {})
+
+    def set(self, section, key, value):
+        """Stores `value` and saves the snapshot, from any thread."""
+        with self._lock:
+            self.section(section)[key] = value
+            self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        tmp = f"{self.path}.part"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class Watermark:
+    """Albums of an artist/label handled by earlier runs, for `--since-last`.
+
+    Discography pages list the newest releases first, so paging stops at
+    the first page that holds an already handled album and nothing newer
+    than the newest one handled. The pages are passed on whole, so the
+    smart discography filter still compares new releases with the versions
+    handled before; the handled ones are dropped after filtering (see
+    `unseen`). Albums that were filtered out don't keep it going.
+
+    :param str source: e.g. "label/1234"
+    """
+
+    SAVE_EVERY = 50
+
+    def __init__(self, state: SyncState, source):
+        self.state = state
+        self.source = source
+        entry = state.section("sources").get(source) or {}
+        self.known = set(entry.get("ids", []))
+        self.newest = entry.get("newest", "")
+        self._unsaved = 0
+
+    def pages(self, pages, key="albums"):
+        """Yields `pages` down to the first one caught up with the earlier
+        runs, included: it holds versions handled before."""
+        for page in pages:
+            items = page[key]["items"]
+            newest = max(
+                (item.get("release_date_original") or "" for item in items),
+                default="",
+            )
+            caught_up = (
+                any(str(item["id"]) in self.known for item in items)
+                and newest <= self.newest
+            )
+            yield page
+            if caught_up:
+                return
+
+    def unseen(self, items):
+        """Yields the `QueueItem`s not handled by earlier runs."""
+        return (item for item in items if str(item.id) not in self.known)
+
+    def add(self, album_id, release_date=""):
+        self.known.add(str(album_id))
+        self.newest = max(self.newest, release_date or "")
+        self._unsaved += 1
+        if self._unsaved >= self.SAVE_EVERY:
+            self.save()
+
+    def save(self):
+        self.state.set(
+            "sources", self.source, {"ids": sorted(self.known), "newest": self.newest}
+        )
+        self._unsaved = 0
+
+
+def _favorites_page(client, kind, offset):
+    fetch = {
+        "albums": client.get_favorite_albums,
+        "tracks": client.get_favorite_tracks,
+        "artists": client.get_favorite_artists,
+    }[kind]
+    return fetch(offset, PAGE_SIZE).get(kind) or {}
+
+
+def new_favorites(client, kind, known, full=False):
+    """Yields the favorites of `kind` whose ID isn't in `known`, newest
+    first.
+
+    :param bool full: walk every page instead of stopping at the first
+        one without new items
+    """
+    offset = 0
+    while True:
+        page = _favorites_page(client, kind, offset)
+        items = page.get("items") or []
+        fresh = [item for item in items if str(item["id"]) not in known]
+        yield from fresh
+        offset += len(items)
+        if not items or offset >= page.get("total", 0) or (not fresh and not full):
+            return
+
+
+def _download(qobuz, kind, item_id, item=None):
+    """Downloads a favorite. Returns True if it was downloaded completely:
+    not when it (or one of the releases of an artist) couldn't be fetched,
+    nor when some of its tracks failed (they wait in `qobuz.retry_queue`)."""
+    queued = len(qobuz.retry_queue)
+    if kind == "artists":
+        if not qobuz.handle_url(f"{WEB_URL}artist/{item_id}"):
+            return False
+    elif kind == "tracks":
+        # favorite tracks are full track dicts
+        if not qobuz.download_from_id(item_id, album=False, meta=item):
+            return False
+    elif not qobuz.download_from_id(item_id):
+        return False
+    return len(qobuz.retry_queue) == queued
+
+
+def sync_favorites(qobuz, kinds=("albums", "tracks"), full=False):
+    """Downloads the favorites added since the last sync.
+
+    Favorites are only recorded once complete. Those that failed, entirely
+    or some of their tracks, are kept apart and tried again first by the
+    next sync, since paging stops before reaching them.
+
+    :param QobuzDL qobuz: logged in downloader
+    :param kinds: favorite types to mirror (see FAVORITE_TYPES); artists
+        download their whole discography
+    :returns: number of favorites downloaded
+    """
+    state = qobuz.sync_state = SyncState(qobuz.directory)
+    seen = state.section("favorites")
+    total = 0
+    for kind in kinds:
+        known = set(seen.get(kind, []))
+        pending = list(state.section("pending_favorites").get(kind, []))
+        new = list(new_favorites(qobuz.client, kind, known | set(pending), full))
+        if not new and not pending:
+            logger.info(f"{OFF}No new favorite {kind}")
+            continue
+        if pending:
+            logger.info(f"{YELLOW}Retrying {len(pending)} incomplete favorite {kind}")
+        if new:
+            logger.info(f"{YELLOW}{len(new)} new favorite {kind}")
+        # oldest first, so an interrupted sync resumes where it stopped
+        jobs = [(item_id, None) for item_id in pending]
+        jobs += [(str(item["id"]), item) for item in reversed(new)]
+        for item_id, item in jobs:
+            if _download(qobuz, kind, item_id, item):
+                known.add(item_id)
+                if item_id in pending:
+                    pending.remove(item_id)
+                state.set("favorites", kind, sorted(known))
+                total += 1
+            elif item_id not in pending:
+                pending.append(item_id)
+            state.set("pending_favorites", kind, pending)
+    return total
+
+
+def user_playlists(client):
+    """Yields every playlist of the user (owned and subscribed)."""
+    offset = 0
+    while True:
+        page = (
+            client.get_user_playlists(PLAYLISTS_PAGE_SIZE, offset).get("playlists")
+            or {}
+        )
+        items = page.get("items") or []
+        yield from items
+        offset += len(items)
+        if not items or offset >= page.get("total", 0):
+            return
+
+
+def _signature(playlist) -> str:
+    return f"{playlist.get('updated_at')}:{playlist.get('tracks_count')}"
+
+
+def sync_playlists(qobuz, workers=PLAYLIST_WORKERS, full=False):
+    """Downloads the user's playlists that changed since the last sync.
+
+    :param QobuzDL qobuz: logged in downloader
+    :param int workers: playlists processed at once, each by its own
+        `QobuzDL.worker`
+    :param bool full: process every playlist
+    :returns: number of playlists synced completely
+    """
+    state = qobuz.sync_state = SyncState(qobuz.directory)
+    signatures = state.section("playlists")
+    # moved and removed tracks are renamed/deleted instead of downloaded again
+    qobuz.mirror_playlists = True
+    playlists = list(user_playlists(qobuz.client))
+
+    # forget the playlists that were deleted or unsubscribed
+    current = {str(p["id"]) for p in playlists}
+    for playlist_id in set(signatures) - current:
+        del signatures[playlist_id]
+
+    changed = [
+        p for p in playlists if full or signatures.get(str(p["id"])) != _signature(p)
+    ]
+    logger.info(
+        f"{YELLOW}{len(changed)} of {len(playlists)} playlists changed since "
+        "the last sync"
+    )
+    if not changed:
+        state.save()
+        return 0
+
+    def process(playlist):
+        """Returns whether the playlist was synced completely, and its failed
+        tracks."""
+        worker = qobuz.worker()
+        try:
+            worker.handle_url(f"{WEB_URL}playlist/{playlist['id']}")
+        except Exception as e:
+            logger.error(f"{RED}Error syncing {playlist.get('name')}: {e}")
+            return False, []
+        finally:
+            worker.mover.flush()
+        # files that couldn't be moved from staging, also those already
+        # reported by the flush of their release
+        complete = not worker.retry_queue and not worker.mover.failures
+        if complete:
+            state.set("playlists", str(playlist["id"]), _signature(playlist))
+        else:
+            logger.info(
+                f"{YELLOW}{playlist.get('name')} is incomplete, it will be synced "
+                "again next time"
+            )
+        return complete, worker.retry_queue
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(process, changed))
+    state.save()
+    for _, failed in results:
+        # retried by `qobuz.retry_failed` with the rest of the run
+        qobuz.retry_queue.extend(failed)
+    return sum(complete for complete, _ in results)
@@ -0,0 +1,122 @@
+"""Registry of the temporary files created while downloading.
+
+Every `.<track id>.tmp` file (and every file of the staging directory) is
+registered while it exists, and the list is mirrored to a small state file
+in the download directory, at most every SAVE_INTERVAL seconds so the
+library (often a NAS) isn't rewritten for every file. Cleaning up after a
+run (or after an interrupted one, using the state file it left) only
+touches those paths instead of walking the whole library. `sweep` is the full tree walk, for the `clean`
+command; it also removes the files listed in the state file, which may be
+outside the tree.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = ".qobuz-dj-tmp.json"
+PATTERN = ".*.tmp"
+# seconds between saves of the state file while downloading
+SAVE_INTERVAL = 5.0
+
+
+def _remove(path) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.debug(f"Couldn't remove {path}: {e}")
+        return False
+
+
+def _leftovers(state_file) -> list[str] | None:
+    """Paths listed in `state_file`, None if there is none."""
+    try:
+        with open(state_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class TempFiles:
+    """:param float interval: seconds between saves of the state file"""
+
+    def __init__(self, interval=SAVE_INTERVAL):
+        self.state_file = None
+        self.interval = interval
+        self._paths: set[str] = set()
+        self._lock = threading.Lock()
+        self._saved_at = None
+
+    def attach(self, directory):
+        """Uses the state file of `directory`, removing the temporary files
+        an interrupted run left behind."""
+        self.state_file = os.path.join(directory, STATE_FILE)
+        leftovers = _leftovers(self.state_file)
+        if leftovers is None:
+            return
+        removed = sum(_remove(path) for path in leftovers)
+        if removed:
+            logger.debug(f"Removed {removed} temporary files of an earlier run")
+        with self._lock:
+            self._save()
+
+    def register(self, path):
+        with self._lock:
+            self._paths.add(os.path.abspath(path))
+            self._save_soon()
+
+    def release(self, path):
+        """Forgets `path`, once it was renamed or removed."""
+        with self._lock:
+            self._paths.discard(os.path.abspath(path))
+            self._save_soon()
+
+    def cleanup(self):
+        """Removes the registered files that still exist."""
+        with self._lock:
+            for path in self._paths:
+                _remove(path)
+            self._paths.clear()
+            self._save()
+
+    def _save_soon(self):
+        now = time.monotonic()
+        if self._saved_at is None or now - self._saved_at >= self.interval:
+            self._save()
+
+    def _save(self):
+        if self.state_file is None:
+            return
+        self._saved_at = time.monotonic()
+        if not self._paths:
+            _remove(self.state_file)
+            return
+        tmp = f"{self.state_file}.part"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(sorted(self._paths), f)
+            os.replace(tmp, self.state_file)
+        except OSError as e:
+            logger.debug(f"Couldn't save {self.state_file}: {e}")
+
+
+registry = TempFiles()
+
+
+def sweep(directory) -> int:
+    """Removes every temporary file under `directory`, returning how many.
+    This walks the whole tree: it's slow on big libraries."""
+    state_file = os.path.join(directory, STATE_FILE)
+    removed = sum(_remove(path) for path in _leftovers(state_file) or [])
+    for path in glob.glob(os.path.join(directory, "**", PATTERN), recursive=True):
+        removed += _remove(path)
+    _remove(state_file)
+    return removed
@@ -0,0 +1,102 @@
+"""Folder and track name templates (`folder_format`/`track_format`).
+
+Templates are parsed and checked against the keys available to them once,
+when they are first used, instead of failing with a KeyError in the middle
+of a download. Compiled templates are cached by pattern, and so are the
+sanitized artist/album fragments, which repeat across a whole discography.
+"""
+
+import functools
+import string
+
+from pathvalidate import sanitize_filename
+
+from qobuz_dj.exceptions import InvalidTemplate
+from qobuz_dj.utils import clean_unicode
+
+FOLDER_KEYS = frozenset(
+    {
+        "artist",
+        "albumartist",
+        "album",
+        "year",
+        "format",
+        "bit_depth",
+        "sampling_rate",
+        # only set for single tracks, empty in album folders
+        "tracktitle",
+        "version",
+    }
+)
+TRACK_KEYS = frozenset(
+    {
+        "artist",
+        "albumartist",
+        "album",
+        "year",
+        "bit_depth",
+        "sampling_rate",
+        "tracktitle",
+        "tracknumber",
+        "version",
+    }
+)
+# keys without a value for lossy (or unknown) formats
+QUALITY_KEYS = frozenset({"bit_depth", "sampling_rate"})
+
+_formatter = string.Formatter()
+
+
+class PathTemplate:
+    """A validated `str.format` pattern.
+
+    :param str pattern: the template, e.g. "{artist} - {album} ({year})"
+    :param keys: the keys it can use
+    :raises InvalidTemplate: if the pattern is malformed or uses other keys
+    """
+
+    def __init__(self, pattern: str, keys: frozenset):
+        # extensions are added by the downloader
+        for extension in (".mp3", ".flac"):
+            if pattern.endswith(extension):
+                pattern = pattern[: -len(extension)]
+        self.pattern = pattern.strip()
+
+        try:
+            fields = [
+                f for _, f, _, _ in _formatter.parse(self.pattern) if f is not None
+            ]
+        except ValueError as e:
+            raise InvalidTemplate(f'"{pattern}": {e}') from e
+        unknown = [f for f in fields if f not in keys]
+        if unknown:
+            raise InvalidTemplate(
+                f'"{pattern}": unknown key(s) {", ".join(f or "{}" for f in unknown)}. '
+                f"Available keys: {', '.join(sorted(keys))}"
+            )
+        self.fields = frozenset(fields)
+        self.uses_quality = bool(self.fields & QUALITY_KEYS)
+
+    def render(self, values: dict) -> str:
+        return self.pattern.format_map(
+            {key: "" if values.get(key) is None else values[key] for key in self.fields}
+        )
+
+    def __repr__(self):
+        return f"PathTemplate({self.pattern!r})"
+
+
+@functools.lru_cache(maxsize=64)
+def folder(pattern: str) -> PathTemplate:
+    return PathTemplate(pattern, FOLDER_KEYS)
+
+
+@functools.lru_cache(maxsize=64)
+def track(pattern: str) -> PathTemplate:
+    return PathTemplate(pattern, TRACK_KEYS)
+
+
+@functools.lru_cache(maxsize=4096)
+def clean_fragment(text: str) -> str:
+    """Sanitized form of a name used in a path (artist, album...)."""
+    return clean_unicode(sanitize_filename(text))
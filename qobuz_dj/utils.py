@@ -1,17 +1,25 @@
+import errno
+import json
 import logging
 import os
 import re
 import string
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
 
 from mutagen.flac import FLAC
 from mutagen.mp3 import EasyMP3
 
 from qobuz_dj.color import GREEN, RED, RESET, YELLOW
+from qobuz_dj.mp3scan import SANITIZE_FRAMES, scan_mp3
+from qobuz_dj.pipeline import QueueItem
 
 logger = logging.getLogger(__name__)
 
 EXTENSIONS = (".mp3", ".flac")
+# temporary names of an `apply_rename_plan` in progress
+RENAME_JOURNAL = ".qobuz-dj-rename.json"
 
 
 class PartialFormatter(string.Formatter):
@@ -43,50 +51,78 @@ def clean_unicode(text):
     return text.replace("æ", "ae").replace("Æ", "AE")
 
 
-def make_m3u(pl_directory):
+def _read_m3u_fields(audio_file):
+    """Returns the (title, artist, length) of a track for an M3U entry.
+
+    MP3s go through the header-only reader; mutagen is only used for FLAC
+    (whose parser already stops at the metadata blocks) and for MP3s the
+    fast reader can't fully describe.
+    """
+    if ".mp3" in audio_file:
+        tags, length = scan_mp3(audio_file, ("TIT2", "TPE1"), length=True)
+        if "TIT2" in tags and "TPE1" in tags and length is not None:
+            return tags["TIT2"], tags["TPE1"], int(length)
+
+    pl_item = EasyMP3(audio_file) if ".mp3" in audio_file else FLAC(audio_file)
+    return pl_item["TITLE"][0], pl_item["ARTIST"][0], int(pl_item.info.length)
+
+
+def make_m3u(pl_directory, audio_files=None):
+    """Writes `<folder name>.m3u` in `pl_directory`.
+
+    :param audio_files: paths of the tracks in playlist order (default:
+        every audio file found, folder by folder)
+    """
+    if audio_files is None:
+        audio_files = []
+        for local, dirs, files in os.walk(pl_directory):
+            dirs.sort()
+            audio_files.extend(
+                os.path.abspath(os.path.join(local, file_))
+                for file_ in files
+                if os.path.splitext(file_)[-1] in EXTENSIONS
+            )
+
     track_list = ["#EXTM3U"]
     rel_folder = os.path.basename(os.path.normpath(pl_directory))
     pl_name = rel_folder + ".m3u"
-    for local, dirs, files in os.walk(pl_directory):
-        dirs.sort()
-        audio_rel_files = [
-            os.path.join(os.path.basename(os.path.normpath(local)), file_)
-            for file_ in files
-            if os.path.splitext(file_)[-1] in EXTENSIONS
-        ]
-        audio_files = [
-            os.path.abspath(os.path.join(local, file_))
-            for file_ in files
-            if os.path.splitext(file_)[-1] in EXTENSIONS
-        ]
-        if not audio_files or len(audio_files) != len(audio_rel_files):
+    for audio_file in audio_files:
+        audio_rel_file = os.path.join(
+            os.path.basename(os.path.dirname(os.path.abspath(audio_file))),
+            os.path.basename(audio_file),
+        )
+        try:
+            title, artist, length = _read_m3u_fields(audio_file)
+            index = "#EXTINF:{}, {} - {}\n{}".format(
+                length, artist, title, audio_rel_file
+            )
+        except:  # noqa
             continue
-
-        for audio_rel_file, audio_file in zip(
-            audio_rel_files, audio_files, strict=True
-        ):
-            try:
-                pl_item = (
-                    EasyMP3(audio_file) if ".mp3" in audio_file else FLAC(audio_file)
-                )
-
-                title = pl_item["TITLE"][0]
-                artist = pl_item["ARTIST"][0]
-                length = int(pl_item.info.length)
-                index = "#EXTINF:{}, {} - {}\n{}".format(
-                    length, artist, title, audio_rel_file
-                )
-            except:  # noqa
-                continue
-            track_list.append(index)
+        track_list.append(index)
 
     if len(track_list) > 1:
         with open(os.path.join(pl_directory, pl_name), "w", encoding="utf-8") as pl:
             pl.write("\n\n".join(track_list))
 
 
+_REMASTER_REGEX = re.compile(r"(?i)(re)?master(ed)?")
+_EXTRA_REGEX = re.compile(r"(?i)(anniversary|deluxe|live|collector|demo|expanded)")
+_ESSENCE_REGEX = re.compile(r"([^\(]+)(?:\s*[\(\[][^\)][\)\]])*")
+
+
+def _essence(title: str) -> str:
+    """Ignore text in parens/brackets, return all lowercase.
+    Used to group two albums that may be named similarly, but not exactly
+    the same.
+    """
+    r = _ESSENCE_REGEX.match(title)
+    if r:
+        return r.group(1).strip().lower()
+    return title.strip().lower()
+
+
 def smart_discography_filter(
-    contents: list, save_space: bool = False, skip_extras: bool = False
+    contents: Iterable[dict], save_space: bool = False, skip_extras: bool = False
 ) -> list:
     """When downloading some artists' discography, many random and spam-like
     albums can get downloaded. This helps filter those out to just get the good stuff.
@@ -96,86 +132,68 @@ def smart_discography_filter(
         * duplicate albums in different qualities
         * (optionally) removes collector's, deluxe, live albums
 
-    :param list contents: contents returned by qobuz API
+    Pages are consumed one at a time (e.g. straight from `Client.get_artist_meta`),
+    and only a running summary of each title group is kept, so every page of the
+    discography is considered without holding all of them in memory.
+
+    :param contents: pages returned by qobuz API
     :param bool save_space: choose highest bit depth, lowest sampling rate
     :param bool remove_extras: remove albums with extra material (i.e. live, deluxe,...)
-    :returns: filtered items list
+    :returns: filtered albums, as `QueueItem`s
     """
+    get_best = min if save_space else max
+    requested_artist = None
+
+    # essence -> [best bit depth, best sampling rate at that bit depth,
+    #             remaster exists, {(bit depth, sampling rate, remaster): item}]
+    title_grouped: dict[str, list] = {}
+    for page in contents:
+        if requested_artist is None:
+            requested_artist = page["name"]
+
+        for album in page["albums"]["items"]:
+            bit_depth = album["maximum_bit_depth"]
+            sampling_rate = album["maximum_sampling_rate"]
+            text = f"{album.get('title', '')} {album.get('version', '')}"
+            is_remaster = _REMASTER_REGEX.search(text) is not None
+
+            title_ = _essence(album["title"])
+            group = title_grouped.get(title_)
+            if group is None:
+                group = [bit_depth, sampling_rate, is_remaster, {}]
+                title_grouped[title_] = group
+            elif bit_depth > group[0]:
+                group[0], group[1] = bit_depth, sampling_rate
+            elif bit_depth == group[0]:
+                group[1] = get_best(group[1], sampling_rate)
+            group[2] = group[2] or is_remaster
+
+            # albums that can never be selected are not kept
+            if album["artist"]["name"] != requested_artist or (
+                skip_extras and _EXTRA_REGEX.search(text)
+            ):
+                continue
 
-    TYPE_REGEXES = {
-        "remaster": r"(?i)(re)?master(ed)?",
-        "extra": r"(?i)(anniversary|deluxe|live|collector|demo|expanded)",
-    }
-
-    def is_type(album_t: str, album: dict) -> bool:
-        """Check if album is of type `album_t`"""
-        version = album.get("version", "")
-        title = album.get("title", "")
-        regex = TYPE_REGEXES[album_t]
-        return re.search(regex, f"{title} {version}") is not None
-
-    def essence(title: str) -> str:
-        """Ignore text in parens/brackets, return all lowercase.
-        Used to group two albums that may be named similarly, but not exactly
-        the same.
-        """
-        r = re.match(r"([^\(]+)(?:\s*[\(\[][^\)][\)\]])*", title)
-        if r:
-            return r.group(1).strip().lower()
-        return title.strip().lower()
-
-    requested_artist = contents[0]["name"]
-    items = [item["albums"]["items"] for item in contents][0]
-
-    # use dicts to group duplicate albums together by title
-    title_grouped: dict[str, list[dict]] = {}
-    for item in items:
-        title_ = essence(item["title"])
-        if title_ not in title_grouped:  # ?
-            #            if (t := essence(item["title"])) not in title_grouped:
-            title_grouped[title_] = []
-        title_grouped[title_].append(item)
+            # keep the newest release for every quality/remaster combination
+            key = (bit_depth, sampling_rate, is_remaster)
+            current = group[3].get(key)
+            if (
+                current is None
+                or (album.get("release_date_original") or "0000-00-00")
+                > current.release_date
+            ):
+                group[3][key] = QueueItem.from_dict(album)
 
     items = []
-    for albums in title_grouped.values():
-        best_bit_depth = max(a["maximum_bit_depth"] for a in albums)
-        get_best = min if save_space else max
-        best_sampling_rate = get_best(
-            a["maximum_sampling_rate"]
-            for a in albums
-            if a["maximum_bit_depth"] == best_bit_depth
-        )
-        remaster_exists = any(is_type("remaster", a) for a in albums)
-
-        def is_valid(
-            album: dict,
-            best_bit_depth=best_bit_depth,
-            best_sampling_rate=best_sampling_rate,
-            remaster_exists=remaster_exists,
-        ) -> bool:
-            """Check if album is of type `album_t`"""
-            return (
-                album["maximum_bit_depth"] == best_bit_depth
-                and album["maximum_sampling_rate"] == best_sampling_rate
-                and album["artist"]["name"] == requested_artist
-                and not (  # states that are not allowed
-                    (remaster_exists and not is_type("remaster", album))
-                    or (skip_extras and is_type("extra", album))
-                )
-            )
-
-        sorted_albums = sorted(
-            filter(is_valid, albums),
-            key=lambda x: x.get("release_date_original", "0000-00-00"),
-            reverse=True,
-        )
-
-        filtered = sorted_albums
-        # most of the time, len is 0 or 1.
-        # if greater, it is a complete duplicate,
-        # so it doesn't matter which is chosen
-        if len(filtered) >= 1:
-            selected = filtered[0]
+    for (
+        best_bit_depth,
+        best_sampling_rate,
+        remaster_exists,
+        candidates,
+    ) in title_grouped.values():
+        # if a remaster exists, only remasters are allowed
+        selected = candidates.get((best_bit_depth, best_sampling_rate, remaster_exists))
+        if selected is not None:
             items.append(selected)
 
     return items
@@ -191,28 +209,36 @@ def create_and_return_dir(directory):
     return fix
 
 
-def sanitize_directory(directory):
+def _read_sanitize_fields(filepath):
+    """Returns the (artist, title, year) triple used to rename an MP3.
+    Missing, unreadable or unparseable tags fall back to the `Unknown`
+    defaults, so the file keeps its place in the numbering.
     """
-    Recursively sanitizes MP3 filenames in a directory.
-    Renames to: {NN} - {Artist} - {Title} ({Year}).mp3
-    Renumbers sequentially across all files found.
-    """
-    from mutagen.id3 import ID3
-    from mutagen.mp3 import MP3
-    from pathvalidate import sanitize_filename
+    try:
+        tags, _ = scan_mp3(filepath, SANITIZE_FRAMES)
+    except OSError:
+        tags = {}
+    except Exception as e:
+        logger.warning(f"{YELLOW}Can't read the tags of {filepath}: {e}{RESET}")
+        tags = {}
 
-    # Strip potential quotes and normalization
-    directory = directory.strip("\"'")
-    directory = os.path.normpath(directory)
+    artist = clean_unicode(tags.get("TPE1", "Unknown Artist"))
+    title = clean_unicode(tags.get("TIT2", "Unknown Title"))
+    year = tags.get("TDRC") or tags.get("TDER") or tags.get("TYER") or "0000"
 
-    logger.info(f"{YELLOW}Sanitizing directory: {directory}{RESET}")
+    return artist, title, year[:4]
 
-    if not os.path.isdir(directory):
-        logger.error(f"{RED}Error: {directory} is not a valid directory.{RESET}")
-        return
+
+def build_sanitize_plan(directory, workers=None):
+    """First phase of `sz`: reads the tags of every MP3 under `directory`
+    in a thread pool and returns the complete rename plan as a list of
+    (old_path, new_path) tuples, in sequential numbering order.
+
+    Nothing is touched on disk.
+    """
+    from pathvalidate import sanitize_filename
 
     mp3_files = []
-    # Collect all mp3 files first to sort them
     for root, _, files in os.walk(directory):
         for file in files:
             if file.lower().endswith(".mp3"):
@@ -221,65 +247,180 @@ def sanitize_directory(directory):
     # Sort files to ensure deterministic order (by path)
     mp3_files.sort()
 
-    count = 0
-    errors = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        fields = list(executor.map(_read_sanitize_fields, mp3_files))
+
+    plan = []
+    for i, (filepath, (artist, title, year)) in enumerate(
+        zip(mp3_files, fields, strict=True), 1
+    ):
+        # NN - Artist - Title (Year).mp3
+        new_filename = sanitize_filename(f"{i:02d} - {artist} - {title} ({year}).mp3")
+        plan.append((filepath, os.path.join(os.path.dirname(filepath), new_filename)))
+    return plan
+
+
+def _rename_no_replace(src, dst):
+    """`os.rename` that raises FileExistsError instead of replacing `dst`
+    (POSIX renames overwrite silently)."""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        # no hard links on this filesystem (FAT, some network shares)
+        if os.path.exists(dst):
+            raise FileExistsError(
+                errno.EEXIST, os.strerror(errno.EEXIST), dst
+            ) from None
+        os.rename(src, dst)
+        return
+    os.unlink(src)
 
-    final_files = []
-    for i, filepath in enumerate(mp3_files, 1):
+
+def recover_renames(journal):
+    """Puts back the files left under temporary names by an interrupted
+    `apply_rename_plan`, using its journal.
+
+    :returns: number of files recovered
+    """
+    try:
+        with open(journal, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        logger.error(f"{RED}Unreadable rename journal {journal}: {e}{RESET}")
+        return 0
+
+    recovered = stranded = 0
+    for tmp, old, new in entries:
+        if not os.path.exists(tmp):
+            continue
+        for target in (old, new):
+            try:
+                _rename_no_replace(tmp, target)
+                recovered += 1
+                break
+            except OSError:
+                continue
+        else:
+            logger.error(f"{RED}Couldn't recover {old}, left as {tmp}{RESET}")
+            stranded += 1
+    if recovered:
+        logger.info(f"{YELLOW}Recovered {recovered} files of an interrupted rename")
+    if not stranded:
+        os.remove(journal)
+    return recovered
+
+
+def apply_rename_plan(plan, journal=None):
+    """Second phase of `sz`: applies a rename plan.
+
+    Every file that changes name is first moved to a unique temporary
+    name next to it, so a target that is also the source of another
+    entry (e.g. swapped numbers) never gets overwritten. Targets that
+    already exist outside the plan are left alone and the source is
+    restored.
+
+    :param str journal: file recording the temporary names while the plan
+        is applied, for `recover_renames` if the run is interrupted
+    :returns: (renamed, errors, final_paths)
+    """
+    renamed = errors = stranded = 0
+    final_paths = [old for old, _ in plan]
+    staged = []
+
+    moves = [
+        (
+            i,
+            old,
+            os.path.join(os.path.dirname(old), f".{i:06d}-{os.getpid()}.sztmp"),
+            new,
+        )
+        for i, (old, new) in enumerate(plan)
+        if old != new
+    ]
+    if journal and moves:
+        with open(journal, "w", encoding="utf-8") as f:
+            json.dump([(tmp, old, new) for _, old, tmp, new in moves], f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    for i, old, tmp, new in moves:
         try:
-            # Load ID3
+            os.rename(old, tmp)
+            staged.append((i, old, tmp, new))
+        except OSError as e:
+            logger.error(f"{RED}Failed to rename {old}: {e}{RESET}")
+            errors += 1
+
+    for i, old, tmp, new in staged:
+        target = tmp
+        for candidate in (new, old):
             try:
-                audio = MP3(filepath, ID3=ID3)
-            except Exception:
-                audio = None
-
-            # Extract Metadata (ID3 Priority)
-            artist = "Unknown Artist"
-            title = "Unknown Title"
-            year = "0000"
-
-            if audio and audio.tags:
-                artist = clean_unicode(str(audio.tags.get("TPE1", [artist])[0]))
-                title = clean_unicode(str(audio.tags.get("TIT2", [title])[0]))
-
-                # Year
-                dr_tag = audio.tags.get("TDRC")
-                if dr_tag:
-                    year = str(dr_tag[0])
-                else:
-                    year_tag = audio.tags.get("TDER") or audio.tags.get("TYER")
-                    if year_tag:
-                        year = str(year_tag[0])
-                year = str(year)[:4]
-
-            # Construct new name
-            # NN - Artist - Title (Year).mp3
-            track_num = f"{i:02d}"
-            new_filename = f"{track_num} - {artist} - {title} ({year}).mp3"
-            new_filename = sanitize_filename(new_filename)
-
-            # Directory needed
-            root = os.path.dirname(filepath)
-            new_filepath = os.path.join(root, new_filename)
-
-            if filepath != new_filepath:
-                try:
-                    os.rename(filepath, new_filepath)
-                    logger.info(
-                        f"Renamed: {os.path.basename(filepath)} -> {new_filename}"
-                    )
-                    count += 1
-                    final_files.append(new_filepath)
-                except OSError as e:
-                    logger.error(f"{RED}Failed to rename {filepath}: {e}{RESET}")
-                    errors += 1
-                    final_files.append(filepath)
-            else:
-                final_files.append(filepath)
-        except Exception as e:
-            logger.error(f"{RED}Error processing {filepath}: {e}{RESET}")
+                _rename_no_replace(tmp, candidate)
+                target = candidate
+                break
+            except FileExistsError:
+                logger.error(
+                    f"{RED}Failed to rename {old}: {candidate} already exists{RESET}"
+                )
+            except OSError as e:
+                logger.error(f"{RED}Failed to rename {old}: {e}{RESET}")
+        if target == new:
+            logger.info(f"Renamed: {os.path.basename(old)} -> {os.path.basename(new)}")
+            renamed += 1
+        else:
             errors += 1
-            final_files.append(filepath)
+            stranded += target == tmp
+        final_paths[i] = target
+
+    if journal and moves and not stranded:
+        # kept otherwise, so the next run can still put those files back
+        os.remove(journal)
+    return renamed, errors, final_paths
+
+
+def sanitize_directory(directory, dry_run=False, workers=None):
+    """
+    Recursively sanitizes MP3 filenames in a directory.
+    Renames to: {NN} - {Artist} - {Title} ({Year}).mp3
+    Renumbers sequentially across all files found.
+
+    The whole rename plan is computed before any file is renamed, so an
+    error while reading tags can't leave the numbering half applied.
+    With `dry_run` the plan is only printed.
+    """
+    # Strip potential quotes and normalization
+    directory = directory.strip("\"'")
+    directory = os.path.normpath(directory)
+
+    logger.info(f"{YELLOW}Sanitizing directory: {directory}{RESET}")
+
+    if not os.path.isdir(directory):
+        logger.error(f"{RED}Error: {directory} is not a valid directory.{RESET}")
+        return
+
+    journal = os.path.join(directory, RENAME_JOURNAL)
+    if not dry_run:
+        recover_renames(journal)
+    plan = build_sanitize_plan(directory, workers)
+
+    if dry_run:
+        for old, new in plan:
+            if old != new:
+                logger.info(
+                    f"{os.path.relpath(old, directory)} -> "
+                    f"{os.path.relpath(new, directory)}"
+                )
+        changes = sum(1 for old, new in plan if old != new)
+        logger.info(
+            f"{YELLOW}Dry run: {changes} of {len(plan)} files would be renamed.{RESET}"
+        )
+        return
+
+    count, errors, final_files = apply_rename_plan(plan, journal)
 
     logger.info(f"{YELLOW}Sanitized {count} files. Errors: {errors}.{RESET}")
 
@@ -0,0 +1,458 @@
+"""Integrity checks fed with the chunks of a download as they arrive.
+
+* MP3: every MPEG frame header is walked; losing frame sync in the middle
+  of the stream means the data is corrupted.
+* FLAC: the metadata blocks are checked, then every frame is walked and
+  checked with its CRC-16; frames have to follow each other, and the last
+  one has to end at the sample count of STREAMINFO, which catches streams
+  cut short. When the reference `flac` tool is installed the stream is also
+  piped into `flac -t`, which decodes it and compares the audio MD5 with the
+  one in STREAMINFO.
+
+Nothing is re-read from disk: verification finishes with the download.
+"""
+
+import functools
+import logging
+import shutil
+import subprocess
+import sys
+from array import array
+
+from qobuz_dj.color import YELLOW
+from qobuz_dj.exceptions import IntegrityError
+from qobuz_dj.mp3scan import _syncsafe, parse_frame_header
+
+logger = logging.getLogger(__name__)
+
+# stray bytes tolerated after the last MPEG frame, besides ID3v1/APE tags
+_MAX_TRAILING_JUNK = 512
+# end of an MP3 stream kept to find its ID3v1 tag and APE tag footer
+_MP3_TAIL = 128 + 32
+# longest FLAC frame header, and the largest frame accepted when STREAMINFO
+# doesn't give the maximum frame size
+_FLAC_HEADER = 16
+_MAX_FLAC_FRAME = 16 * 1024 * 1024
+
+
+def _crc_table(poly, width):
+    top, mask = 1 << (width - 1), (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly if crc & top else crc << 1) & mask
+        table.append(crc)
+    return table
+
+
+_CRC8 = _crc_table(0x07, 8)
+_CRC16 = _crc_table(0x8005, 16)
+
+
+def _crc8(data) -> int:
+    crc = 0
+    for byte in data:
+        crc = _CRC8[crc ^ byte]
+    return crc
+
+
+@functools.cache
+def _crc16_words() -> list[int]:
+    """CRC-16 table indexed by 16 bits at once, twice as fast as bytes."""
+    table = []
+    for hi in range(256):
+        crc = _CRC16[hi]
+        for lo in range(256):
+            table.append(((crc << 8) & 0xFFFF) ^ _CRC16[(crc >> 8) ^ lo])
+    return table
+
+
+def _crc16(data) -> int:
+    table = _crc16_words()
+    even = len(data) & ~1
+    words = array("H", bytes(data[:even]))
+    if sys.byteorder == "little":
+        words.byteswap()
+    crc = 0
+    for word in words:
+        crc = table[crc ^ word]
+    for byte in data[even:]:
+        crc = ((crc << 8) & 0xFFFF) ^ _CRC16[(crc >> 8) ^ byte]
+    return crc
+
+
+def parse_flac_frame_header(buf, pos):
+    """Parses the FLAC frame header at `pos`.
+
+    :returns: (first sample or frame number, variable block size, samples in
+        the frame, header length), or None if there is no valid header there
+    """
+    end = len(buf)
+    if end - pos < 6 or buf[pos] != 0xFF or buf[pos + 1] & 0xFE != 0xF8:
+        return None
+    size_code, rate_code = buf[pos + 2] >> 4, buf[pos + 2] & 0x0F
+    if size_code == 0 or rate_code == 15 or buf[pos + 3] >> 4 > 10:
+        return None
+    if buf[pos + 3] & 0x01:
+        return None
+
+    # frame/sample number, UTF-8 style
+    first = buf[pos + 4]
+    extra = 0
+    while extra < 8 and first & (0x80 >> extra):
+        extra += 1
+    if extra in (1, 8):
+        return None
+    number = first & (0x7F >> extra)
+    i = pos + 5
+    for _ in range(max(extra - 1, 0)):
+        if i >= end or buf[i] & 0xC0 != 0x80:
+            return None
+        number = (number << 6) | (buf[i] & 0x3F)
+        i += 1
+
+    if size_code == 1:
+        samples = 192
+    elif size_code <= 5:
+        samples = 576 << (size_code - 2)
+    elif size_code <= 7:
+        n = 1 if size_code == 6 else 2
+        if i + n > end:
+            return None
+        samples = int.from_bytes(buf[i : i + n], "big") + 1
+        i += n
+    else:
+        samples = 256 << (size_code - 8)
+    i += {12: 1, 13: 2, 14: 2}.get(rate_code, 0)
+
+    if i >= end or _crc8(buf[pos:i]) != buf[i]:
+        return None
+    return number, bool(buf[pos + 1] & 0x01), samples, i + 1 - pos
+
+
+def _tags_size(end) -> int:
+    """Size of the ID3v1 and APE tags at the end of an MP3 stream, given its
+    last _MP3_TAIL bytes."""
+    size = 0
+    if len(end) >= 128 and end[-128:-125] == b"TAG":
+        size = 128
+    footer = end[len(end) - size - 32 : len(end) - size]
+    if footer[:8] == b"APETAGEX":
+        flags = int.from_bytes(footer[20:24], "little")
+        size += int.from_bytes(footer[12:16], "little")
+        size += 32 if flags & 0x80000000 else 0  # header
+    return size
+
+
+class MP3Verifier:
+    """Walks the MPEG frames of a stream fed in arbitrary chunks.
+
+    A stream cut in the middle of a frame, or followed by more than its
+    ID3v1/APE tags (e.g. zero padding), is rejected.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._skip = None  # bytes of ID3v2 tag left to skip
+        self._lost = False
+        self.frames = 0
+        self.desyncs = 0
+        self.junk = 0
+        self.trailing = 0  # junk bytes since the last frame
+        self._end = b""
+
+    def update(self, data: bytes):
+        buf = self._buf
+        buf += data
+        self._end = (self._end + bytes(data[-_MP3_TAIL:]))[-_MP3_TAIL:]
+
+        if self._skip is None:
+            if len(buf) < 10:
+                return
+            self._skip = 0
+            if buf[:3] == b"ID3":
+                footer = 10 if buf[5] & 0x10 else 0
+                self._skip = 10 + _syncsafe(bytes(buf[6:10])) + footer
+
+        pos = min(self._skip, len(buf))
+        self._skip -= pos
+
+        while len(buf) - pos >= 4:
+            frame = parse_frame_header(buf, pos)
+            if frame is not None and frame[0] > 4:
+                if pos + frame[0] > len(buf):
+                    break  # wait for the rest of the frame
+                if self._lost and self.frames:
+                    self.desyncs += 1
+                self._lost = False
+                self.frames += 1
+                self.trailing = 0
+                pos += frame[0]
+                continue
+
+            self._lost = True
+            nxt = buf.find(b"\xff", pos + 1)
+            if nxt == -1:
+                nxt = len(buf)
+            self.junk += nxt - pos
+            self.trailing += nxt - pos
+            pos = nxt
+
+        del buf[:pos]
+
+    def abort(self):
+        pass
+
+    def reset(self):
+        """Starts over, for a transfer restarted from the beginning."""
+        self.__init__()
+
+    def finish(self):
+        buf = self._buf
+        if not self.frames:
+            raise IntegrityError("no MPEG audio frames found")
+        if self.desyncs:
+            raise IntegrityError(f"MPEG frame sync lost {self.desyncs} time(s)")
+
+        trailing = self.trailing + len(buf) - _tags_size(self._end)
+        if trailing <= 0:
+            return
+        # a frame whose header or body was cut stays in the buffer
+        if buf[:1] == b"\xff" and (
+            len(buf) < 4 or parse_frame_header(buf, 0) is not None
+        ):
+            raise IntegrityError("the last MPEG frame is truncated")
+        if trailing > _MAX_TRAILING_JUNK:
+            raise IntegrityError(f"{trailing} bytes of garbage after the last frame")
+
+
+class FLACVerifier:
+    """Walks the FLAC frames of a stream fed in arbitrary chunks, checking
+    their CRC-16 and the sample count and, with the `flac` tool, the audio
+    MD5.
+
+    Frames have no length field: a frame ends where the next frame header
+    (with a valid CRC-8) starts and the bytes before it match the CRC-16.
+
+    :param str flac_bin: path to the `flac` executable, None to skip the
+        decode/MD5 check
+    """
+
+    def __init__(self, flac_bin=None):
+        self._flac_bin = flac_bin
+        self._buf = bytearray()
+        self._header_ok = False
+        # header of the frame at the start of _buf
+        self._frame: tuple[int, bool, int, int] | None = None
+        self._search = 0  # where to look for the next frame header
+        self.frames = 0
+        self.block_size = 0
+        self.max_frame_size = 0  # 0: unknown
+        self.total_samples = 0  # 0: unknown
+        self._proc = None
+        if flac_bin:
+            self._proc = subprocess.Popen(
+                [flac_bin, "--test", "--silent", "-"],
+                bufsize=0,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+            )
+
+    def update(self, data: bytes):
+        self._buf += data
+        if not self._header_ok:
+            self._check_header()
+        if self._header_ok:
+            self._walk()
+
+        stdin = self._proc.stdin if self._proc is not None else None
+        if stdin is not None and not stdin.closed:
+            try:
+                stdin.write(data)
+            except BrokenPipeError:
+                # flac gave up on the stream, finish() reports why
+                stdin.close()
+
+    def _check_header(self):
+        head = self._buf
+        if len(head) < 4:
+            return
+        if head[:4] != b"fLaC":
+            raise IntegrityError("missing fLaC stream marker")
+
+        pos, first = 4, True
+        while True:
+            if len(head) < pos + 4:
+                return
+            block_type = head[pos] & 0x7F
+            last = head[pos] & 0x80
+            length = int.from_bytes(head[pos + 1 : pos + 4], "big")
+            if first:
+                if block_type != 0 or length != 34:
+                    raise IntegrityError("STREAMINFO is not the first block")
+                if len(head) < pos + 4 + 34:
+                    return
+                info = head[pos + 4 : pos + 38]
+                self.block_size = int.from_bytes(info[2:4], "big")
+                self.max_frame_size = int.from_bytes(info[7:10], "big")
+                self.total_samples = int.from_bytes(info[10:18], "big") & (
+                    (1 << 36) - 1
+                )
+                first = False
+            if block_type == 127:
+                raise IntegrityError("invalid metadata block")
+            pos += 4 + length
+            if last:
+                break
+
+        if len(head) < pos + 2:
+            return
+        if head[pos] != 0xFF or head[pos + 1] & 0xFE != 0xF8:
+            raise IntegrityError("no FLAC frame after the metadata blocks")
+
+        self._header_ok = True
+        del head[:pos]
+
+    def _walk(self):
+        buf = self._buf
+        limit = 2 * self.max_frame_size if self.max_frame_size else _MAX_FLAC_FRAME
+        while True:
+            if self._frame is None:
+                if len(buf) < _FLAC_HEADER:
+                    return
+                self._frame = parse_flac_frame_header(buf, 0)
+                if self._frame is None:
+                    raise IntegrityError(
+                        f"invalid FLAC frame header after frame {self.frames}"
+                    )
+                self._search = self._frame[3]
+
+            pos = self._search
+            while True:
+                pos = buf.find(b"\xff", pos)
+                if pos == -1 or len(buf) - pos < _FLAC_HEADER:
+                    # wait for the rest of the frame
+                    self._search = len(buf) - _FLAC_HEADER if pos == -1 else pos
+                    self._search = max(self._search, self._frame[3])
+                    if len(buf) > limit:
+                        raise IntegrityError(
+                            f"FLAC frame {self.frames} is corrupted: no frame "
+                            f"follows it within {limit} bytes"
+                        )
+                    return
+                # frames of a stream share their blocking strategy, sample
+                # rate and sample size, sync patterns in the audio rarely do
+                following = (
+                    parse_flac_frame_header(buf, pos)
+                    if buf[pos + 1] == buf[1]
+                    and buf[pos + 2] & 0x0F == buf[2] & 0x0F
+                    and buf[pos + 3] & 0x0E == buf[3] & 0x0E
+                    else None
+                )
+                if following is not None and self._ends_at(
+                    self._frame, buf, pos, following
+                ):
+                    break
+                pos += 1
+
+            self.frames += 1
+            del buf[:pos]
+            self._frame = None
+
+    def _ends_at(self, frame, buf, end, following) -> bool:
+        """Returns whether `frame`, at the start of `buf`, ends at `end`,
+        where the frame header `following` was found.
+
+        :raises IntegrityError: if `following` is the next frame but the
+            frame doesn't match its CRC-16
+        """
+        number, variable, samples, _ = frame
+        expected = number + samples if variable else number + 1
+        if _crc16(buf[: end - 2]) == int.from_bytes(buf[end - 2 : end], "big"):
+            if following[0] != expected:
+                raise IntegrityError(
+                    f"FLAC frame {self.frames} is followed by the wrong frame"
+                )
+            return True
+        if following[0] == expected:
+            raise IntegrityError(f"FLAC frame {self.frames} is corrupted (CRC-16)")
+        return False  # a frame sync pattern in the audio data
+
+    def finish(self):
+        errors = self._close()
+        if not self._header_ok:
+            raise IntegrityError("truncated FLAC header")
+        if errors is not None:
+            raise IntegrityError(f"flac: {errors or 'decoding failed'}")
+        self._check_end()
+
+    def _check_end(self):
+        """Checks that the last frame is whole and ends the stream at the
+        sample count of STREAMINFO."""
+        buf = self._buf
+        frame = self._frame or parse_flac_frame_header(buf, 0)
+        if frame is None or _crc16(buf[:-2]) != int.from_bytes(buf[-2:], "big"):
+            raise IntegrityError(
+                f"last FLAC frame ({self.frames}) is incomplete or corrupted"
+            )
+        if not self.total_samples:
+            return
+
+        number, variable, samples, _ = frame
+        start = number if variable else number * self.block_size
+        if start + samples != self.total_samples:
+            raise IntegrityError(
+                f"stream ends at sample {start + samples} of {self.total_samples}"
+            )
+
+    def _close(self):
+        """Waits for `flac -t` and returns its error output, or None if the
+        stream passed (or wasn't tested)."""
+        if self._proc is None:
+            return None
+        proc, self._proc = self._proc, None
+        if proc.stdin is not None and not proc.stdin.closed:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        stderr = proc.stderr.read() if proc.stderr is not None else b""
+        if proc.wait() == 0:
+            return None
+        lines = stderr.decode(errors="replace").strip().splitlines()
+        return lines[-1] if lines else ""
+
+    def abort(self):
+        """Stops the check of a download that failed."""
+        if self._proc is not None:
+            self._proc.kill()
+            self._close()
+
+    def reset(self):
+        """Starts over, for a transfer restarted from the beginning."""
+        self.abort()
+        self.__init__(self._flac_bin)
+
+
+_flac_bin = shutil.which("flac")
+
+
+@functools.cache
+def _warn_no_flac():
+    logger.warning(
+        f"{YELLOW}The flac tool isn't installed: FLAC frames are checked, but "
+        "not the audio MD5"
+    )
+
+
+def verifier_for(extension):
+    """Returns a new verifier for a download with the given extension."""
+    if extension == ".mp3":
+        return MP3Verifier()
+    if extension == ".flac":
+        if _flac_bin is None:
+            _warn_no_flac()
+        return FLACVerifier(_flac_bin)
+    return None
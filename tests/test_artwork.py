@@ -0,0 +1,42 @@
+import io
+
+import pytest
+
+from qobuz_dj import artwork
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _jpeg(size, quality=100):
+    img = Image.effect_noise(size, 64).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def test_process_cover_downscales_large_covers():
+    data = _jpeg((2400, 2400))
+    processed = artwork.process_cover(data, 600, 85)
+
+    assert len(processed) < len(data)
+    with Image.open(io.BytesIO(processed)) as img:
+        assert img.format == "JPEG"
+        assert img.size == (600, 600)
+
+
+def test_process_cover_keeps_small_jpegs():
+    data = _jpeg((300, 300))
+    assert artwork.process_cover(data, 600, 85) is data
+    assert artwork.process_cover(data, 0, 85) is data
+
+
+def test_prepare_shares_result_per_file(tmp_path):
+    cover = tmp_path / "cover.jpg"
+    cover.write_bytes(_jpeg((1200, 1200)))
+
+    first = artwork.prepare(str(cover), 500, 80)
+    assert artwork.prepare(str(cover), 500, 80) is first
+    assert artwork.prepare(str(cover), 400, 80) is not first
+
+    with Image.open(io.BytesIO(first.result())) as img:
+        assert img.size == (500, 500)
@@ -0,0 +1,146 @@
+import logging
+import os
+from unittest.mock import MagicMock
+
+from mutagen.id3 import ID3, TALB, TPE2, TRCK, TXXX
+
+from qobuz_dj.audit import audit_library
+from qobuz_dj.core import QobuzDL
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417 bytes per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _mp3(path, data, album_id=None, *frames):
+    path.write_bytes(data)
+    if album_id or frames:
+        tags = ID3()
+        if album_id:
+            tags.add(TXXX(encoding=3, desc="QOBUZ_ALBUM_ID", text=album_id))
+        for frame in frames:
+            tags.add(frame)
+        tags.save(str(path))
+
+
+def test_audit_lists_corrupt_files(tmp_path, monkeypatch, caplog):
+    lib = tmp_path / "lib"
+    lib.mkdir()
+    _mp3(lib / "good.mp3", MP3_FRAME * 10)
+    _mp3(lib / "cut.mp3", MP3_FRAME * 5 + MP3_FRAME[:100] + MP3_FRAME * 3, "xyz")
+    _mp3(lib / "empty.mp3", b"")
+    output = tmp_path / "redownload.txt"
+
+    bad = audit_library(str(lib), str(output), workers=1)
+
+    assert sorted(bad) == [str(lib / "cut.mp3"), str(lib / "empty.mp3")]
+    qobuz = QobuzDL(str(tmp_path / "music"))
+    urls = []
+
+    def download_list_of_urls(found):
+        urls.extend(found)
+
+    monkeypatch.setattr(qobuz, "download_list_of_urls", download_list_of_urls)
+    qobuz.download_from_txt_file(str(output))
+    assert urls == ["https://play.qobuz.com/album/xyz"]
+
+    # unchanged files aren't checked again
+    caplog.set_level(logging.INFO)
+    assert audit_library(str(lib), str(output), workers=1) == bad
+    assert "Auditing 0 files" in caplog.text
+
+
+def test_audit_flags_truncated_and_padded_files(tmp_path):
+    _mp3(tmp_path / "tagged.mp3", MP3_FRAME * 10 + b"TAG" + bytes(125))
+    _mp3(tmp_path / "cut.mp3", MP3_FRAME * 10 + MP3_FRAME[:200])
+    _mp3(tmp_path / "cut-header.mp3", MP3_FRAME * 10 + MP3_FRAME[:2])
+    _mp3(tmp_path / "pad-50k.mp3", MP3_FRAME * 10 + bytes(50 * 1024))
+    _mp3(tmp_path / "pad-200k.mp3", MP3_FRAME * 10 + bytes(200 * 1024))
+
+    bad = audit_library(str(tmp_path), str(tmp_path / "list.txt"), workers=1)
+
+    assert sorted(os.path.basename(path) for path in bad) == [
+        "cut-header.mp3",
+        "cut.mp3",
+        "pad-200k.mp3",
+        "pad-50k.mp3",
+    ]
+
+
+def test_audit_remove(tmp_path):
+    _mp3(tmp_path / "empty.mp3", b"")
+    audit_library(str(tmp_path), str(tmp_path / "list.txt"), workers=1, remove=True)
+    assert not (tmp_path / "empty.mp3").exists()
+
+
+def test_audit_finds_albums_of_files_without_ids(tmp_path):
+    cut = MP3_FRAME * 5 + MP3_FRAME[:100] + MP3_FRAME * 3
+    (tmp_path / "a").mkdir()
+    _mp3(tmp_path / "a" / "01.mp3", MP3_FRAME * 10, "from-folder")
+    _mp3(tmp_path / "a" / "02.mp3", cut)
+    (tmp_path / "b").mkdir()
+    tags = (TPE2(text="Artist"), TALB(text="Album"), TRCK(text="2/9"))
+    _mp3(tmp_path / "b" / "02.mp3", cut, None, *tags)
+    _mp3(tmp_path / "b" / "03.mp3", b"")
+
+    client = MagicMock()
+    client.search_albums.return_value = {
+        "albums": {
+            "items": [
+                {"id": "other", "title": "Album", "artist": {"name": "Other"}},
+                {
+                    "id": "from-search",
+                    "title": "Album",
+                    "artist": {"name": "Artist"},
+                    "tracks_count": 9,
+                },
+            ]
+        }
+    }
+    output = tmp_path / "list.txt"
+    bad = audit_library(
+        str(tmp_path), str(output), workers=1, get_client=lambda: client
+    )
+
+    assert bad[str(tmp_path / "a" / "02.mp3")][2] == "from-folder"
+    assert bad[str(tmp_path / "b" / "02.mp3")][2] == "from-search"
+    # no tags to search with
+    assert bad[str(tmp_path / "b" / "03.mp3")][2] is None
+    client.search_albums.assert_called_once()
+    lines = output.read_text().splitlines()
+    assert "https://play.qobuz.com/album/from-folder" in lines
+    assert "https://play.qobuz.com/album/from-search" in lines
+
+
+def test_interrupted_audit_resumes(tmp_path, monkeypatch, caplog):
+    import pytest
+
+    from qobuz_dj import audit
+
+    for i in range(4):
+        _mp3(tmp_path / f"{i}.mp3", MP3_FRAME * 10)
+
+    class InterruptedPool:
+        """Checks two files, then the user hits Ctrl-C."""
+
+        def __init__(self, max_workers=None):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def map(self, fn, paths, chunksize=1):
+            for path in list(paths)[:2]:
+                yield fn(path)
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(audit, "ProcessPoolExecutor", InterruptedPool)
+    with pytest.raises(KeyboardInterrupt):
+        audit_library(str(tmp_path), str(tmp_path / "list.txt"))
+    monkeypatch.undo()
+
+    caplog.set_level(logging.INFO)
+    audit_library(str(tmp_path), str(tmp_path / "list.txt"), workers=1)
+    assert "Auditing 2 files (2 unchanged" in caplog.text
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from qobuz_dj.concurrency import AIMDLimiter
+
+
+def test_limit_grows_additively_and_halves_on_throttling():
+    limiter = AIMDLimiter("test", initial=1, maximum=8, spike=1e9)
+    for _ in range(20):
+        with limiter.slot():
+            pass
+    grown = limiter.limit
+    assert 5 < grown <= 8
+
+    with limiter.slot() as slot:
+        slot.check_status(429)
+    assert limiter.limit == pytest.approx(grown / 2)
+    assert limiter.decreases == 1
+
+
+def test_network_errors_decrease_the_limit():
+    limiter = AIMDLimiter("test", initial=4)
+    with pytest.raises(ConnectionError):
+        with limiter.slot():
+            raise ConnectionError("reset")
+    assert limiter.limit == 2
+
+
+def test_slots_are_bounded_by_the_limit():
+    limiter = AIMDLimiter("test", initial=2, maximum=2)
+    inside = threading.Semaphore(0)
+    release = threading.Event()
+    peak = []
+
+    def work():
+        with limiter.slot():
+            peak.append(limiter.in_flight)
+            inside.release()
+            release.wait(1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    inside.acquire()
+    inside.acquire()
+    assert limiter.in_flight == 2
+    release.set()
+    for t in threads:
+        t.join()
+    assert max(peak) == 2
+
+
+def test_small_transfers_are_not_latency_spikes():
+    limiter = AIMDLimiter("test", initial=4, min_size=1000)
+    for _ in range(5):
+        with limiter.slot() as slot:
+            slot.size = 10**9  # fast per byte
+    baseline = limiter._baseline
+
+    with limiter.slot() as slot:
+        slot.size = 100  # a cover: slow per byte
+    assert limiter.decreases == 0
+    assert limiter._baseline == baseline
@@ -54,3 +54,121 @@ def test_core_download_smart_discography_filter_empty():
 def test_core_search_by_type_none(mock_search):
     """Test search returning None handling."""
     pass
+
+
+def test_failed_tracks_are_retried_and_resumed(tmp_path, monkeypatch):
+    import requests
+
+    from qobuz_dj import core, downloader
+    from qobuz_dj.db import get_pending_tracks, handle_download_id
+
+    calls = []
+    retries = []
+
+    def retry():
+        retries.append(1)
+        raise requests.exceptions.ConnectionError("still down")
+
+    class FakeDownload:
+        def __init__(self, *args, only_tracks=None, **kwargs):
+            self.only_tracks = only_tracks
+            self.failed = []
+
+        def download_id_by_type(self, track):
+            calls.append(self.only_tracks)
+            if self.only_tracks is None:
+                self.failed.append(downloader.FailedTrack("2", "Two", retry))
+
+    monkeypatch.setattr(core.downloader, "Download", FakeDownload)
+    monkeypatch.setattr(core, "RETRY_BACKOFF", 0)
+    db = str(tmp_path / "downloads.db")
+    qobuz = core.QobuzDL(str(tmp_path / "music"), downloads_db=db)
+    qobuz.client = MagicMock()
+
+    qobuz.download_from_id("album1")
+    qobuz.retry_failed()
+
+    assert len(retries) == core.RETRY_ATTEMPTS
+    assert get_pending_tracks(db, "album1") == {"2"}
+    assert not handle_download_id(db, "album1")
+
+    # the next run only fetches the missing track and completes the album
+    qobuz.download_from_id("album1")
+    assert calls == [None, {"2"}]
+    assert get_pending_tracks(db, "album1") == set()
+    assert handle_download_id(db, "album1")
+
+
+def test_failed_single_track_is_retried_but_not_stored(tmp_path, monkeypatch):
+    import requests
+
+    from qobuz_dj import core
+    from qobuz_dj.db import get_pending_tracks
+
+    attempts = []
+
+    class FakeDownload:
+        def __init__(self, *args, **kwargs):
+            self.failed = []
+
+        def download_id_by_type(self, track):
+            attempts.append(track)
+            if len(attempts) == 1:
+                raise requests.exceptions.ConnectionError("down")
+
+    monkeypatch.setattr(core.downloader, "Download", FakeDownload)
+    monkeypatch.setattr(core, "RETRY_BACKOFF", 0)
+    db = str(tmp_path / "downloads.db")
+    qobuz = core.QobuzDL(str(tmp_path / "music"), downloads_db=db)
+    qobuz.client = MagicMock()
+
+    assert qobuz.download_from_id("track1", album=False)
+    assert get_pending_tracks(db, "track1") == set()
+
+    qobuz.retry_failed()
+    assert attempts == [True, True]
+    assert not qobuz.retry_queue
+
+
+def test_retries_wait_for_the_mover_of_their_worker(tmp_path, monkeypatch):
+    from qobuz_dj import core, downloader
+    from qobuz_dj.db import handle_download_id
+
+    events = []
+
+    class FakeDownload:
+        def __init__(self, *args, **kwargs):
+            self.failed = []
+
+        def download_id_by_type(self, track):
+            retry = lambda: events.append("retry")  # noqa: E731
+            self.failed.append(downloader.FailedTrack("2", "Two", retry))
+
+    monkeypatch.setattr(core.downloader, "Download", FakeDownload)
+    monkeypatch.setattr(core, "RETRY_BACKOFF", 0)
+    db = str(tmp_path / "downloads.db")
+    qobuz = core.QobuzDL(str(tmp_path / "music"), downloads_db=db)
+    qobuz.client = MagicMock()
+
+    mover = MagicMock()
+    mover.flush.side_effect = lambda: events.append("flush") or False
+    monkeypatch.setattr(core.staging, "Mover", lambda: mover)
+    worker = qobuz.worker()
+    worker.download_from_id("album1")
+    qobuz.retry_queue.extend(worker.retry_queue)
+    qobuz.retry_failed()
+
+    # the retried track was staged by the worker, whose move failed
+    assert events == ["flush", "retry", "flush"]
+    assert not handle_download_id(db, "album1")
+
+
+def test_mp3_quality_warns_about_quality_keys_up_front(tmp_path, caplog):
+    from qobuz_dj import core
+    from qobuz_dj.downloader import DEFAULT_FOLDER
+
+    core.QobuzDL(str(tmp_path / "flac"), folder_format=DEFAULT_FOLDER)
+    assert "unknown for MP3" not in caplog.text
+    core.QobuzDL(str(tmp_path / "mp3"), quality=5, folder_format=DEFAULT_FOLDER)
+    assert caplog.text.count("unknown for MP3") == 1
+    assert "[MP3]" in caplog.text
@@ -0,0 +1,98 @@
+from unittest.mock import mock_open, patch
+
+from qobuz_dj.diagnostics import DiagnosticsSink
+
+
+def test_sink_dedupes_item_field_events(tmp_path):
+    log = tmp_path / "errors.log"
+    sink = DiagnosticsSink(str(log))
+
+    for _ in range(3):
+        sink.missing_field("1", "label.name", "n/a")
+    sink.missing_field("2", "label.name", "n/a")
+    sink.missing_field("1", "copyright", "n/a")
+
+    assert sink.summary() == {"label.name": 2, "copyright": 1}
+
+    sink.flush()
+    lines = log.read_text(encoding="utf-8").splitlines()
+    assert sum("Missing field" in line for line in lines) == 3
+    assert any("Summary: 'label.name' missing for 2 item(s)" in line for line in lines)
+
+
+def test_sink_opens_log_once_per_flush(tmp_path):
+    sink = DiagnosticsSink(str(tmp_path / "errors.log"))
+    for i in range(50):
+        sink.missing_field(str(i), "label.name", "n/a")
+
+    with patch("builtins.open", mock_open()) as m:
+        sink.flush()
+        sink.flush()  # nothing pending
+
+    m.assert_called_once()
+
+
+def test_sink_flush_without_events_writes_nothing(tmp_path):
+    log = tmp_path / "errors.log"
+    DiagnosticsSink(str(log)).flush()
+    assert not log.exists()
+
+
+def test_sink_reports_metrics(tmp_path):
+    log = tmp_path / "errors.log"
+    sink = DiagnosticsSink(str(log))
+    sink.metric("transfer stalls")
+    sink.metric("transfer stalls", 2)
+
+    assert sink.metrics() == {"transfer stalls": 3}
+    sink.flush()
+    assert "Metric: transfer stalls = 3" in log.read_text(encoding="utf-8")
+
+
+def test_sink_writes_full_batches_before_exit(tmp_path):
+    log = tmp_path / "errors.log"
+    sink = DiagnosticsSink(str(log), batch_size=10)
+    for i in range(25):
+        sink.missing_field(str(i), "label.name", "n/a")
+
+    # two batches written, the rest stays pending
+    sink._queue.join()
+    assert log.read_text(encoding="utf-8").count("Missing field") == 20
+    assert len(sink._events) == 5
+
+    sink.flush()
+    text = log.read_text(encoding="utf-8")
+    assert text.count("Missing field") == 25
+    assert "Summary: 'label.name' missing for 25 item(s)" in text
+
+
+def test_sink_counts_items_seen_before_a_batch_once(tmp_path):
+    log = tmp_path / "errors.log"
+    sink = DiagnosticsSink(str(log), batch_size=2)
+    for _ in range(3):
+        sink.missing_field("1", "label.name", "n/a")
+        sink.missing_field("2", "label.name", "n/a")
+
+    assert sink.summary() == {"label.name": 2}
+    sink.flush()
+    text = log.read_text(encoding="utf-8")
+    assert text.count("Missing field") == 2
+    assert "Summary: 'label.name' missing for 2 item(s)" in text
+
+
+def test_sink_keeps_everything_when_the_write_fails(tmp_path):
+    log = tmp_path / "missing" / "errors.log"
+    sink = DiagnosticsSink(str(log))
+    sink.missing_field("1", "label.name", "n/a")
+    sink.metric("transfer stalls")
+
+    sink.flush()
+    assert sink.summary() == {"label.name": 1}
+    assert sink.metrics() == {"transfer stalls": 1}
+
+    log.parent.mkdir()
+    sink.flush()
+    text = log.read_text(encoding="utf-8")
+    assert text.count("Missing field") == 1
+    assert "Metric: transfer stalls = 1" in text
+    assert not sink.summary() and not sink.metrics()
@@ -1,3 +1,5 @@
+import os
+
 from qobuz_dj.downloader import _safe_get
 
 
@@ -21,3 +23,176 @@ def test_safe_get_non_dict_intermediate():
     # Case 2: Intermediate is string (has __getitem__ but not get)
     d = {"a": "string_value"}
     assert _safe_get(d, "a", "b", default="default") == "default"
+
+
+def test_corrupted_track_is_downloaded_again(tmp_path):
+    from unittest.mock import MagicMock, patch
+
+    from qobuz_dj.downloader import Download
+    from qobuz_dj.exceptions import IntegrityError
+
+    track = {
+        "id": 1,
+        "title": "Title",
+        "track_number": 1,
+        "maximum_bit_depth": 16,
+        "maximum_sampling_rate": 44.1,
+    }
+    dl = Download(MagicMock(), "1", str(tmp_path), 6)
+    attempts = []
+
+    def fake_download(url, fname, desc, verifier=None):
+        attempts.append(verifier)
+        # temporary files are named after the track
+        assert os.path.basename(fname) == ".1.tmp"
+        open(fname, "wb").close()
+        if len(attempts) == 1:
+            raise IntegrityError("bad frame")
+
+    with (
+        patch("qobuz_dj.downloader.tqdm_download", fake_download),
+        patch("qobuz_dj.metadata.tag_flac") as tag,
+    ):
+        dl._download_and_tag(str(tmp_path), {"url": "u"}, track, track, True, False)
+
+    assert len(attempts) == 2
+    assert attempts[0] is not attempts[1]
+    tag.assert_called_once()
+
+
+def test_stall_detector_uses_sliding_window():
+    import pytest
+
+    from qobuz_dj.downloader import StallDetector, TransferStalled
+
+    detector = StallDetector(window=10, min_rate=100)
+    start = detector._start
+    for t in range(20):
+        detector.update(2000, now=start + t)  # fast enough
+    with pytest.raises(TransferStalled):
+        for t in range(20, 40):
+            detector.update(10, now=start + t)
+
+
+def _response(chunks, status=200, length=None, content_range=None):
+    from unittest.mock import MagicMock
+
+    def iter_content(chunk_size):
+        for chunk in chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    r = MagicMock()
+    r.status_code = status
+    r.headers = {"content-length": str(length or sum(map(len, chunks)))}
+    if content_range:
+        r.headers["content-range"] = content_range
+    r.iter_content = iter_content
+    return r
+
+
+def _dropped():
+    import requests
+
+    return requests.exceptions.ConnectionError("read timed out")
+
+
+def test_stalled_transfer_resumes_with_range(tmp_path):
+    from unittest.mock import patch
+
+    from qobuz_dj.downloader import tqdm_download
+
+    responses = [
+        _response([b"a" * 10, _dropped()], length=25),
+        _response([b"b" * 15], status=206, content_range="bytes 10-24/25"),
+    ]
+    with (
+        patch("qobuz_dj.downloader.requests.get", side_effect=responses) as get,
+        patch("qobuz_dj.downloader.diagnostics.sink") as sink,
+    ):
+        tqdm_download("url", str(tmp_path / "f"), "f")
+
+    sink.metric.assert_called_once_with("transfer stalls")
+    assert get.call_args.kwargs["headers"] == {"Range": "bytes=10-"}
+    assert (tmp_path / "f").read_bytes() == b"a" * 10 + b"b" * 15
+
+
+def test_reissued_transfer_checks_the_response(tmp_path):
+    from unittest.mock import patch
+
+    import pytest
+    import requests
+
+    from qobuz_dj.downloader import tqdm_download
+
+    expired = _response([], status=403)
+    expired.raise_for_status.side_effect = requests.exceptions.HTTPError("403")
+    wrong_range = _response([b"b" * 25], status=206, content_range="bytes 0-24/25")
+    for reissued in (expired, wrong_range):
+        responses = [_response([b"a" * 10, _dropped()], length=25), reissued]
+        with (
+            patch("qobuz_dj.downloader.requests.get", side_effect=responses),
+            patch("qobuz_dj.downloader.diagnostics.sink"),
+            pytest.raises(ConnectionError),
+        ):
+            tqdm_download("url", str(tmp_path / "f"), "f")
+
+
+def test_stalled_transfer_restarts_without_range_support(tmp_path):
+    from unittest.mock import MagicMock, patch
+
+    from qobuz_dj.downloader import tqdm_download
+
+    verifier = MagicMock()
+    responses = [
+        _response([b"a" * 10, _dropped()], length=25),
+        _response([b"c" * 25]),
+    ]
+    with (
+        patch("qobuz_dj.downloader.requests.get", side_effect=responses),
+        patch("qobuz_dj.downloader.diagnostics.sink"),
+    ):
+        tqdm_download("url", str(tmp_path / "f"), "f", verifier)
+
+    assert (tmp_path / "f").read_bytes() == b"c" * 25
+    verifier.reset.assert_called_once()
+    verifier.finish.assert_called_once()
+
+
+def test_embedded_track_dict_skips_track_get():
+    from unittest.mock import MagicMock
+
+    from qobuz_dj.downloader import Download
+
+    track = {
+        "id": 1,
+        "title": "Title",
+        "track_number": 1,
+        "media_number": 1,
+        "maximum_bit_depth": 16,
+        "maximum_sampling_rate": 44.1,
+        "copyright": "(P) 2020 Label",
+        "performer": {"name": "Artist"},
+        "composer": {"name": "Composer"},
+        "album": {
+            "title": "Album",
+            "artist": {"name": "Artist"},
+            "release_date_original": "2020-01-01",
+            "image": {"large": "cover"},
+            "genres_list": ["Pop/Rock"],
+            "tracks_count": 10,
+        },
+    }
+    client = MagicMock()
+    assert Download(client, "1", "", 6, meta=track)._track_meta() is track
+    client.get_track_meta.assert_not_called()
+
+    # needed for the file name, and for the tags
+    for field in ("image", "copyright", "genres_list"):
+        incomplete = {**track, "album": dict(track["album"])}
+        incomplete.pop(field, None)
+        incomplete["album"].pop(field, None)
+        assert Download(client, "1", "", 6, meta=incomplete)._track_meta() is (
+            client.get_track_meta.return_value
+        )
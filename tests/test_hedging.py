@@ -0,0 +1,111 @@
+import threading
+import time
+from unittest.mock import patch
+
+from qobuz_dj.hedging import Hedger, LatencyTracker
+
+
+def _warm(hedger, endpoint="album/get", n=20, latency=0.01):
+    for _ in range(n):
+        hedger.tracker.record(endpoint, latency)
+        hedger.calls += 1
+
+
+def test_tracker_percentile():
+    tracker = LatencyTracker(min_samples=10)
+    assert tracker.percentile("album/get") is None
+    for i in range(1, 101):
+        tracker.record("album/get", i / 100)
+    assert tracker.percentile("album/get") == 0.96
+
+
+@patch("qobuz_dj.hedging.diagnostics.sink")
+def test_stalled_call_falls_back_to_its_hedge(sink):
+    hedger = Hedger(budget=0.5)
+    _warm(hedger)
+    calls = []
+
+    def fn():
+        calls.append(threading.current_thread())
+        if len(calls) == 1:
+            time.sleep(0.2)  # the first attempt stalls, then times out
+            raise TimeoutError
+        return "hedge"
+
+    start = time.monotonic()
+    assert hedger.call("album/get", fn) == "hedge"
+    assert time.monotonic() - start < 0.4
+    assert hedger.hedges == 1
+
+
+@patch("qobuz_dj.hedging.diagnostics.sink")
+def test_hedge_wins_over_a_slow_primary(sink):
+    hedger = Hedger(budget=0.5)
+    _warm(hedger)
+    primary_done = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.5)  # slow, but succeeds
+            primary_done.set()
+            return "primary"
+        return "hedge"
+
+    start = time.monotonic()
+    assert hedger.call("album/get", fn) == "hedge"
+    assert time.monotonic() - start < 0.3
+    assert not primary_done.is_set()
+    sink.metric.assert_any_call("hedges won")
+
+
+@patch("qobuz_dj.hedging.diagnostics.sink")
+def test_primaries_are_not_capped_by_the_pool(sink):
+    hedger = Hedger(budget=0)
+    _warm(hedger, latency=1)
+    barrier = threading.Barrier(8, timeout=2)
+
+    def fn():
+        barrier.wait()  # breaks unless all 8 calls run at once
+        return "ok"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(hedger.call("album/get", fn)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["ok"] * 8
+
+
+@patch("qobuz_dj.hedging.diagnostics.sink")
+def test_hedges_respect_budget(sink):
+    hedger = Hedger(budget=0.05)
+    _warm(hedger)
+
+    def slow():
+        time.sleep(0.05)
+        return "ok"
+
+    for _ in range(20):
+        assert hedger.call("album/get", slow) == "ok"
+    assert hedger.hedges <= 0.05 * hedger.calls
+
+
+@patch("qobuz_dj.hedging.diagnostics.sink")
+def test_hedged_calls_reuse_pool_threads(sink):
+    hedger = Hedger(budget=0, workers=2)
+    _warm(hedger)
+    threads = set()
+
+    def fn():
+        threads.add(threading.current_thread())
+        return "ok"
+
+    for _ in range(50):
+        assert hedger.call("album/get", fn) == "ok"
+    assert len(threads) <= 2
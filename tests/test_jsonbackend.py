@@ -0,0 +1,45 @@
+from unittest.mock import patch
+
+import pytest
+
+from qobuz_dj import jsonbackend
+from qobuz_dj.pipeline import QueueItem
+from qobuz_dj.utils import smart_discography_filter
+
+
+def test_falls_back_to_the_standard_library():
+    def strict(data):
+        raise ValueError("NaN is not allowed")
+
+    with (
+        patch.dict(jsonbackend.BACKENDS, {"orjson": strict}),
+        patch.object(jsonbackend, "backend", "orjson"),
+    ):
+        assert jsonbackend.loads(b'{"x": NaN}')["x"] != 0
+
+    with pytest.raises(ValueError):
+        jsonbackend.use("simdjson")
+
+
+def test_trimmed_pages_keep_what_the_queue_needs():
+    album = {
+        "id": "1",
+        "title": "Album",
+        "version": "Remastered",
+        "maximum_bit_depth": 24,
+        "maximum_sampling_rate": 96.0,
+        "release_date_original": "2020-01-01",
+        "artist": {"name": "Artist", "image": {"large": "x"}},
+        "label": {"name": "Label"},
+        "genre": {"name": "Jazz"},
+    }
+    page = {"name": "Artist", "albums_count": 1, "albums": {"items": [dict(album)]}}
+    jsonbackend.trim_albums(page)
+
+    trimmed = page["albums"]["items"][0]
+    assert "label" not in trimmed and trimmed["artist"] == {"name": "Artist"}
+    full, compact = QueueItem.from_dict(album), QueueItem.from_dict(trimmed)
+    assert all(
+        getattr(full, slot) == getattr(compact, slot) for slot in QueueItem.__slots__
+    )
+    assert [i.id for i in smart_discography_filter([page])] == ["1"]
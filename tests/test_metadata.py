@@ -55,3 +55,110 @@ def test_format_copyright():
     assert _format_copyright("(P) 2023 Label") == "\u2117 2023 Label"
     assert _format_copyright("(C) 2023 Label") == "\u00a9 2023 Label"
     assert _format_copyright(None) is None
+
+
+# --- Tagging tests ---
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417 bytes per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _flac_bytes():
+    """A FLAC stream with only a STREAMINFO block (44.1kHz, stereo, 16 bit)."""
+    info = (44100 << 44) | (1 << 41) | (15 << 36)
+    streaminfo = b"\x10\x00\x10\x00" + b"\x00" * 6 + info.to_bytes(8, "big")
+    return b"fLaC\x80\x00\x00\x22" + streaminfo + b"\x00" * 16
+
+
+ALBUM = {
+    "id": "album",
+    "title": "Ælbum",
+    "artist": {"name": "Album Artist"},
+    "genres_list": ["Pop/Rock", "Pop/Rock→Rock"],
+    "tracks_count": 2,
+    "release_date_original": "2020-05-01",
+    "copyright": "(P) 2020 Label",
+    "label": {"name": "Label"},
+}
+
+
+def _track(n, **kwargs):
+    return {"id": n, "title": f"Track {n}", "track_number": n, **kwargs}
+
+
+def _flac_tags(path):
+    from mutagen.flac import FLAC, VCFLACDict
+
+    tags = FLAC(path).tags
+    assert isinstance(tags, VCFLACDict)
+    return sorted(tags.items())
+
+
+def test_album_tag_template_matches_per_track_tags(tmp_path):
+    from mutagen.id3 import ID3
+
+    from qobuz_dj.metadata import AlbumTagTemplate, tag_flac, tag_mp3
+
+    template = AlbumTagTemplate(ALBUM)
+    track = _track(1, performer={"name": "Performer"})
+    for tag, data, read in (
+        (tag_flac, _flac_bytes(), _flac_tags),
+        (tag_mp3, MP3_FRAME * 4, lambda f: sorted(map(str, ID3(f).values()))),
+    ):
+        results = []
+        for i, tmpl in enumerate((None, template)):
+            src, dst = tmp_path / f"{i}.tmp", tmp_path / f"{i}.out"
+            src.write_bytes(data)
+            tag(str(src), str(tmp_path), str(dst), track, ALBUM, False, False, tmpl)
+            results.append(read(str(dst)))
+        assert results[0] == results[1]
+
+
+def test_tag_flac_without_composer(tmp_path):
+    from mutagen.flac import FLAC
+
+    from qobuz_dj.metadata import tag_flac
+
+    src, dst = tmp_path / "track.tmp", tmp_path / "track.flac"
+    src.write_bytes(_flac_bytes())
+
+    tag_flac(str(src), str(tmp_path), str(dst), _track(2), ALBUM, False)
+
+    audio = FLAC(str(dst))
+    assert "COMPOSER" not in audio
+    assert audio["ALBUM"] == ["AElbum"]
+    assert audio["ARTIST"] == ["Album Artist"]
+    assert audio["GENRE"] == ["Pop, Rock"]
+
+
+def test_staged_multi_disc_flac_keeps_the_disc_number(tmp_path):
+    from unittest.mock import MagicMock
+
+    from mutagen.flac import FLAC
+
+    from qobuz_dj.downloader import Download
+    from qobuz_dj.staging import Mover
+
+    track = _track(1, media_number=2, maximum_bit_depth=16, maximum_sampling_rate=44.1)
+    # staged files have random names, outside of the "Disc 2" folder
+    dl = Download(
+        MagicMock(),
+        "1",
+        str(tmp_path),
+        6,
+        staging_dir=str(tmp_path / "staging"),
+        mover=Mover(),
+    )
+
+    def fake_download(url, fname, desc, verifier=None):
+        with open(fname, "wb") as f:
+            f.write(_flac_bytes())
+
+    with patch("qobuz_dj.downloader.tqdm_download", fake_download):
+        dl._download_and_tag(
+            str(tmp_path / "album"), {"url": "u"}, track, ALBUM, False, False, 2
+        )
+    assert dl.mover.flush()
+
+    (flac,) = (tmp_path / "album" / "Disc 2").iterdir()
+    assert FLAC(str(flac))["DISCNUMBER"] == ["2"]
@@ -0,0 +1,92 @@
+import json
+from unittest.mock import patch
+
+from qobuz_dj import mirror
+from qobuz_dj.pipeline import QueueItem
+
+
+def _name(item, file_format):
+    return f"{item.ordinal:02} - {item.title}"
+
+
+def _playlist(*titles):
+    return [QueueItem(f"id-{t}", "track", i, t) for i, t in enumerate(titles, 1)]
+
+
+def test_inserted_track_renames_instead_of_downloading(tmp_path):
+    old = _playlist("A", "B", "C")
+    for item in old:
+        (tmp_path / f"{_name(item, 'MP3')}.mp3").write_text(item.title)
+    # the ledger only knows A and C; B is found through its tags
+    mirror.save_ledger(
+        tmp_path,
+        [
+            ("id-A", str(tmp_path / "01 - A.mp3")),
+            ("id-C", str(tmp_path / "03 - C.mp3")),
+        ],
+    )
+
+    def read_ids(path):
+        return f"id-{open(path).read()}", None, False
+
+    with patch("qobuz_dj.mirror.retag.read_ids", side_effect=read_ids) as reader:
+        missing = mirror.reconcile(tmp_path, _playlist("D", "A", "B"), _name)
+    opened = sorted(c.args[0].split("/")[-1] for c in reader.mock_calls)
+    assert opened == ["02 - B.mp3"]
+
+    assert [item.title for item in missing] == ["D"]
+    files = sorted(p.name for p in tmp_path.glob("*.mp3"))
+    assert files == ["02 - A.mp3", "03 - B.mp3"]
+    assert (tmp_path / "02 - A.mp3").read_text() == "A"
+
+
+def test_unrecorded_files_are_never_removed(tmp_path):
+    # an artist download sharing the playlist's name, and a file of the user
+    album = tmp_path / "Artist - Album"
+    album.mkdir()
+    (album / "01. Song.flac").write_text("id-X")
+    (tmp_path / "mine.mp3").write_text("id-Y")
+    (tmp_path / "01 - A.mp3").write_text("id-A")
+    mirror.save_ledger(tmp_path, [("id-A", str(tmp_path / "01 - A.mp3"))])
+
+    def read_ids(path):
+        return open(path).read(), None, False
+
+    with patch("qobuz_dj.mirror.retag.read_ids", side_effect=read_ids):
+        missing = mirror.reconcile(tmp_path, _playlist("B"), _name)
+
+    assert [item.title for item in missing] == ["B"]
+    assert not (tmp_path / "01 - A.mp3").exists()
+    assert (album / "01. Song.flac").read_text() == "id-X"
+    assert (tmp_path / "mine.mp3").read_text() == "id-Y"
+
+
+def test_finish_records_playlist_order(tmp_path):
+    items = _playlist("B", "A")
+    for item in items:
+        (tmp_path / f"{_name(item, 'MP3')}.mp3").touch()
+    ids = {"01 - B.mp3": "id-B", "02 - A.mp3": "id-A"}
+
+    def read_ids(path):
+        return ids[path.split("/")[-1]], None, False
+
+    with patch("qobuz_dj.mirror.retag.read_ids", side_effect=read_ids):
+        paths = mirror.finish(tmp_path, items)
+
+    assert [p.split("/")[-1] for p in paths] == ["01 - B.mp3", "02 - A.mp3"]
+    assert list(mirror._load_ledger(tmp_path)) == ["id-B", "id-A"]
+
+
+def test_interrupted_renames_are_put_back_first(tmp_path):
+    items = _playlist("A")
+    path = tmp_path / "01 - A.mp3"
+    mirror.save_ledger(tmp_path, [("id-A", str(path))])
+    # the last run stopped between the two phases of its renames
+    tmp = tmp_path / ".000000-1.sztmp"
+    tmp.write_text("A")
+    journal = tmp_path / ".qobuz-dj-rename.json"
+    journal.write_text(json.dumps([[str(tmp), str(path), str(path)]]))
+
+    assert mirror.reconcile(tmp_path, items, _name) == []
+    assert path.read_text() == "A"
+    assert not journal.exists()
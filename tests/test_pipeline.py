@@ -0,0 +1,108 @@
+import threading
+import time
+
+import pytest
+
+from qobuz_dj.pipeline import Pipeline, QueueItem
+
+
+def test_items_are_prefetched_in_order():
+    pipeline = Pipeline(range(10), prefetch=lambda item: item * 2)
+    assert list(pipeline) == [(i, i * 2) for i in range(10)]
+
+
+def test_downloads_start_before_later_pages_are_fetched():
+    later_page = threading.Event()
+    fetched = []
+
+    def pages():
+        yield [1, 2]
+        fetched.append(2)
+        later_page.wait(2)
+        yield [3]
+
+    stream = iter(Pipeline(x for page in pages() for x in page))
+    assert next(stream) == (1, None)
+    later_page.set()
+    assert [item for item, _ in stream] == [2, 3]
+    assert fetched == [2]
+
+
+def test_queues_are_bounded():
+    produced = []
+
+    def items():
+        for i in range(1000):
+            produced.append(i)
+            yield i
+
+    stream = iter(Pipeline(items(), item_queue=4, prefetch_queue=2))
+    next(stream)
+    threading.Event().wait(0.2)
+    # item queue + ready queue + the items being handed over
+    assert len(produced) < 12
+    stream.close()  # type: ignore
+
+
+def test_failed_prefetch_yields_none():
+    def prefetch(item):
+        if item == 1:
+            raise ConnectionError("timed out")
+        return item
+
+    assert list(Pipeline([0, 1, 2], prefetch)) == [(0, 0), (1, None), (2, 2)]
+
+
+def test_page_errors_reach_the_consumer():
+    def items():
+        yield 1
+        raise ConnectionError("page 2 failed")
+
+    stream = iter(Pipeline(items()))
+    assert next(stream) == (1, None)
+    with pytest.raises(ConnectionError):
+        next(stream)
+
+
+def test_queue_item_keeps_the_needed_fields():
+    album = {
+        "id": "a1",
+        "title": "Album",
+        "maximum_bit_depth": 24,
+        "maximum_sampling_rate": 96.0,
+        "release_date_original": "2020-01-01",
+        "artist": {"name": "Artist", "albums_count": 3},
+        "label": {"name": "Label"},
+    }
+    item = QueueItem.from_dict(album, ordinal=3)
+    assert (item.id, item.kind, item.ordinal, item.artist) == (
+        "a1",
+        "album",
+        3,
+        "Artist",
+    )
+    assert item.release_date == "2020-01-01" and item.meta is None
+    assert not hasattr(item, "__dict__")
+
+    track = {"id": 7, "title": "Song", "album": album}
+    item = QueueItem.from_dict(track, "track", 1)
+    assert item.artist == "Artist" and item.meta is track
+
+
+def test_threads_exit_when_the_consumer_stops():
+    next_page = threading.Event()
+
+    def items():
+        yield 1
+        next_page.wait(2)  # the next page is slow to come
+
+    before = threading.active_count()
+    stream = iter(Pipeline(items()))
+    assert next(stream) == (1, None)
+    stream.close()
+    next_page.set()
+
+    deadline = time.monotonic() + 2
+    while threading.active_count() > before and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert threading.active_count() == before
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from unittest.mock import MagicMock
+
+from qobuz_dj import core, plan
+
+ALBUM = {
+    "id": "abc",
+    "title": "Album",
+    "version": None,
+    "streamable": True,
+    "release_type": "album",
+    "release_date_original": "2020-01-01",
+    "artist": {"name": "Artist"},
+    "image": {"large": "https://example.com/cover.jpg"},
+    "tracks": {
+        "items": [{"id": 1, "duration": 100}, {"id": 2, "duration": 200}],
+    },
+}
+
+
+def test_plan_then_apply(tmp_path, monkeypatch):
+    qobuz = core.QobuzDL(str(tmp_path / "music"), quality=5)
+    qobuz.client = MagicMock()
+    qobuz.client.get_album_meta.return_value = ALBUM
+    output = tmp_path / "plan.json"
+
+    plan.make_plan(qobuz, ["https://play.qobuz.com/album/abc"], str(output))
+
+    saved = json.loads(output.read_text())
+    (entry,) = saved["items"]
+    assert entry["id"] == "abc" and entry["kind"] == "album"
+    assert entry["format"] == "MP3" and entry["tracks"] == 2
+    assert entry["folder"] == "Artist - Album (2020) [MP3]"
+    assert saved["size"] == 300 * 320_000 // 8
+    assert "meta" not in entry
+    assert qobuz.planner is None
+    assert not (tmp_path / "music" / entry["folder"]).exists()
+
+    downloads = []
+
+    class FakeDownload:
+        def __init__(self, client, item_id, path, quality, *args, meta=None, **kw):
+            downloads.append((item_id, quality, args[5:7], meta))
+            self.failed = []
+
+        def download_id_by_type(self, track):
+            pass
+
+    monkeypatch.setattr(core.downloader, "Download", FakeDownload)
+    other = core.QobuzDL(str(tmp_path / "elsewhere"), quality=27)
+    other.client = MagicMock()
+
+    assert plan.apply_plan(other, str(output)) == 1
+    # with the quality and formats of the plan; metadata is fetched again
+    assert downloads == [
+        ("abc", 5, (entry["folder_format"], entry["track_format"]), None)
+    ]
+
+
+def test_apply_downloads_a_shared_folder_one_item_at_a_time(tmp_path, monkeypatch):
+    entry = {
+        "kind": "track",
+        "path": "Playlist",
+        "track_count": 1,
+        "folder_format": ".",
+        "track_format": "{tracktitle}",
+        "folder": "Playlist",
+        "size": 1,
+    }
+    items = [
+        {**entry, "id": "1"},
+        {**entry, "id": "2", "track_count": 2},
+        {**entry, "id": "3", "folder": "Album", "path": None},
+    ]
+    output = tmp_path / "plan.json"
+    plan.save_plan(
+        {"version": plan.PLAN_VERSION, "quality": 6, "size": 3, "items": items},
+        str(output),
+    )
+
+    lock = threading.Lock()
+    running = {}
+    overlaps = []
+
+    class FakeDownload:
+        def __init__(self, client, item_id, path, *args, **kw):
+            self.item_id, self.path = item_id, path
+            self.failed = []
+
+        def download_id_by_type(self, track):
+            with lock:
+                if running.get(self.path):
+                    overlaps.append(self.item_id)
+                running[self.path] = running.get(self.path, 0) + 1
+            time.sleep(0.05)
+            with lock:
+                running[self.path] -= 1
+
+    monkeypatch.setattr(core.downloader, "Download", FakeDownload)
+    qobuz = core.QobuzDL(str(tmp_path / "music"), no_m3u_for_playlists=True)
+    qobuz.client = MagicMock()
+
+    assert plan.apply_plan(qobuz, str(output), workers=3) == 3
+    assert not overlaps
+
+
+def test_apply_keeps_the_state_of_each_folder_apart(tmp_path, monkeypatch):
+    entry = {
+        "kind": "album",
+        "path": None,
+        "track_count": None,
+        "folder_format": "{album}",
+        "track_format": "{tracktitle}",
+        "size": 1,
+    }
+    items = [
+        {**entry, "id": "ok", "folder": "A"},
+        {**entry, "id": "failing", "folder": "B"},
+    ]
+    output = tmp_path / "plan.json"
+    plan.save_plan(
+        {"version": plan.PLAN_VERSION, "quality": 6, "size": 2, "items": items},
+        str(output),
+    )
+
+    movers = {}
+    both = threading.Barrier(2, timeout=2)
+
+    class FakeDownload:
+        def __init__(self, client, item_id, *args, mover=None, **kw):
+            movers[item_id] = mover
+            self.failed = []
+            if item_id == "failing":
+                self.failed = [core.downloader.FailedTrack("1", "Track", lambda: None)]
+
+        def download_id_by_type(self, track):
+            both.wait()  # both folders are in progress
+
+    monkeypatch.setattr(core.downloader, "Download", FakeDownload)
+    qobuz = core.QobuzDL(str(tmp_path / "music"))
+    qobuz.client = MagicMock()
+
+    plan.apply_plan(qobuz, str(output), workers=2)
+    assert movers["ok"] is not movers["failing"]
+    assert qobuz.mover not in movers.values()
+    assert [(item_id, album) for item_id, _, album in qobuz.retry_queue] == [
+        ("failing", True)
+    ]
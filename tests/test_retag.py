@@ -0,0 +1,144 @@
+from unittest.mock import MagicMock
+
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3
+
+from qobuz_dj import metadata
+from qobuz_dj.retag import CACHE_FILE, read_ids, retag_library
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417 bytes per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _flac_bytes():
+    info = (44100 << 44) | (1 << 41) | (15 << 36)
+    streaminfo = b"\x10\x00\x10\x00" + b"\x00" * 6 + info.to_bytes(8, "big")
+    return b"fLaC\x80\x00\x00\x22" + streaminfo + b"\x00" * 4096
+
+
+TRACKS = [
+    {"id": 11, "title": "One", "track_number": 1},
+    {"id": 12, "title": "Two", "track_number": 2},
+]
+ALBUM = {
+    "id": "abc",
+    "title": "Album",
+    "artist": {"name": "Artist"},
+    "genres_list": ["Pop/Rock"],
+    "tracks_count": 2,
+    "release_date_original": "2020-05-01",
+    "copyright": "(P) 2020 Label",
+    "label": {"name": "Label"},
+    "tracks": {"items": TRACKS},
+}
+
+
+def _download(tmp_path):
+    """Tags files the same way `Download` does."""
+    paths = []
+    for track, ext, data, tag in (
+        (TRACKS[0], ".flac", _flac_bytes(), metadata.tag_flac),
+        (TRACKS[1], ".mp3", MP3_FRAME * 8, metadata.tag_mp3),
+    ):
+        tmp, final = tmp_path / f".{track['id']}.tmp", tmp_path / f"{track['id']}{ext}"
+        tmp.write_bytes(data)
+        tag(str(tmp), str(tmp_path), str(final), track, ALBUM, False)
+        paths.append(str(final))
+    return paths
+
+
+def _client():
+    client = MagicMock()
+    client.get_album_meta.return_value = {**ALBUM, "title": "Album (Remaster)"}
+    return client
+
+
+def test_new_downloads_store_ids_and_reserve_padding(tmp_path):
+    flac, mp3 = _download(tmp_path)
+
+    assert read_ids(flac) == ("11", "abc", False)
+    assert read_ids(mp3) == ("12", "abc", False)
+    assert FLAC(flac).metadata_blocks[-1].length >= metadata.TAG_PADDING
+
+
+def test_retag_rewrites_tags_in_place(tmp_path):
+    flac, mp3 = _download(tmp_path)
+    sizes = [(tmp_path / p).stat().st_size for p in (flac, mp3)]
+    client = _client()
+
+    assert retag_library(str(tmp_path), lambda: client) == (2, 0, 0)
+
+    client.get_album_meta.assert_called_once_with("abc")
+    assert FLAC(flac)["ALBUM"] == ["Album (Remaster)"]
+    assert str(ID3(mp3)["TALB"]) == "Album (Remaster)"
+    assert str(ID3(mp3)["TXXX:QOBUZ_TRACK_ID"]) == "12"
+    # the new tags fit in the reserved padding
+    assert [(tmp_path / p).stat().st_size for p in (flac, mp3)] == sizes
+
+
+def test_retag_uses_cached_metadata(tmp_path):
+    _download(tmp_path)
+    (tmp_path / "untagged.mp3").write_bytes(MP3_FRAME * 8)
+    retag_library(str(tmp_path), _client)
+    assert (tmp_path / CACHE_FILE).is_file()
+
+    def no_client():
+        raise AssertionError("the API shouldn't be needed")
+
+    assert retag_library(str(tmp_path), no_client) == (2, 1, 0)
+
+
+def test_retag_keeps_tags_of_other_tools(tmp_path):
+    from mutagen.id3 import GEOB, POPM, PRIV, TBPM, TKEY
+
+    flac, mp3 = _download(tmp_path)
+    audio = FLAC(flac)
+    audio["BPM"] = "124"
+    audio["REPLAYGAIN_TRACK_GAIN"] = "-7.1 dB"
+    audio.save()
+    tags = ID3(mp3)
+    tags.add(TBPM(encoding=3, text="124"))
+    tags.add(TKEY(encoding=3, text="8A"))
+    tags.add(POPM(email="dj", rating=255))
+    tags.add(GEOB(desc="Serato Markers_", data=b"cues"))
+    tags.add(PRIV(owner="rekordbox", data=b"grid"))
+    tags.save(mp3, v2_version=3)
+
+    assert retag_library(str(tmp_path), _client) == (2, 0, 0)
+
+    audio = FLAC(flac)
+    assert audio["BPM"] == ["124"] and audio["REPLAYGAIN_TRACK_GAIN"] == ["-7.1 dB"]
+    assert audio["ALBUM"] == ["Album (Remaster)"]
+    tags = ID3(mp3)
+    assert str(tags["TBPM"]) == "124" and str(tags["TKEY"]) == "8A"
+    assert tags.getall("POPM") and tags.getall("GEOB") and tags.getall("PRIV")
+    assert str(tags["TALB"]) == "Album (Remaster)"
+    assert str(tags["TDRC"]) == "2020"
+
+
+def test_retag_finds_files_without_ids_by_search(tmp_path):
+    track = {k: v for k, v in TRACKS[1].items() if k != "id"}
+    album = {k: v for k, v in ALBUM.items() if k != "id"}
+    tmp, path = tmp_path / ".tmp", tmp_path / "old.mp3"
+    tmp.write_bytes(MP3_FRAME * 8)
+    metadata.tag_mp3(str(tmp), str(tmp_path), str(path), track, album, False)
+    assert read_ids(str(path))[0] is None
+
+    client = _client()
+    client.search_albums.return_value = {
+        "albums": {
+            "items": [
+                {"id": "other", "title": "Album", "artist": {"name": "Someone"}},
+                {
+                    "id": "abc",
+                    "title": "Album",
+                    "artist": {"name": "Artist"},
+                    "tracks_count": 2,
+                },
+            ]
+        }
+    }
+
+    assert retag_library(str(tmp_path), lambda: client) == (1, 0, 0)
+    client.search_albums.assert_called_once()
+    assert read_ids(str(path))[:2] == ("12", "abc")
@@ -0,0 +1,71 @@
+import os
+from unittest.mock import patch
+
+from qobuz_dj import staging
+from qobuz_dj.staging import Mover
+from qobuz_dj.tempfiles import TempFiles
+
+
+def test_same_filesystem_is_a_rename(tmp_path):
+    src = staging.staged_file(str(tmp_path / "staging"))
+    dst = tmp_path / "album" / "01. Song.flac"
+    dst.parent.mkdir()
+
+    Mover().move(src, str(dst))
+    assert dst.exists() and not os.path.exists(src)
+
+
+def test_copies_are_synced_in_batches(tmp_path):
+    (tmp_path / "album").mkdir()
+    mover = Mover(batch=2)
+    synced = []
+    files = []
+    for i in range(3):
+        src = tmp_path / f"staged{i}"
+        src.write_bytes(b"audio")
+        files.append((src, tmp_path / "album" / f"{i}.flac"))
+
+    with (
+        patch("qobuz_dj.staging._same_filesystem", return_value=False),
+        patch("qobuz_dj.staging._fsync", side_effect=lambda p, **_: synced.append(p)),
+    ):
+        for src, dst in files:
+            mover.move(str(src), str(dst))
+        assert mover.flush()
+
+    assert all(dst.read_bytes() == b"audio" for _, dst in files)
+    assert not any(src.exists() for src, _ in files)
+    # 3 files and one directory sync per batch
+    assert len(synced) == 5
+    assert not [f for f in os.listdir(tmp_path / "album") if f.endswith(".tmp")]
+
+
+def test_failed_copy_keeps_the_staged_file(tmp_path):
+    src = tmp_path / "staged"
+    src.write_bytes(b"audio")
+    mover = Mover()
+    with patch("qobuz_dj.staging._same_filesystem", return_value=False):
+        mover.move(str(src), str(tmp_path / "missing" / "song.flac"))
+        assert not mover.flush()
+    assert src.exists()
+
+
+def test_staged_files_are_released_once_moved(tmp_path):
+    registry = TempFiles()
+    (tmp_path / "album").mkdir()
+    staged = []
+    for i in range(2):
+        src = tmp_path / "staging" / f".{i}.flac"
+        src.parent.mkdir(exist_ok=True)
+        src.write_bytes(b"audio")
+        registry.register(str(src))
+        staged.append(str(src))
+
+    mover = Mover()
+    with patch("qobuz_dj.staging.tempfiles.registry", registry):
+        mover.move(staged[0], str(tmp_path / "album" / "0.flac"))
+        with patch("qobuz_dj.staging._same_filesystem", return_value=False):
+            mover.move(staged[1], str(tmp_path / "album" / "1.flac"))
+            assert mover.flush()
+
+    assert not registry._paths
@@ -0,0 +1,318 @@
+import json
+from unittest.mock import MagicMock
+
+from qobuz_dj import sync
+from qobuz_dj.pipeline import QueueItem
+from qobuz_dj.sync import STATE_FILE, sync_favorites, sync_playlists
+from qobuz_dj.utils import smart_discography_filter
+
+
+def _client(album_ids, page_size=2):
+    client = MagicMock()
+    calls = []
+
+    def favorites(offset, limit):
+        calls.append(offset)
+        ids = album_ids[offset : offset + page_size]
+        return {"albums": {"total": len(album_ids), "items": [{"id": i} for i in ids]}}
+
+    client.get_favorite_albums.side_effect = favorites
+    return client, calls
+
+
+def test_only_new_favorites_are_downloaded(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync, "PAGE_SIZE", 2)
+    qobuz = MagicMock(directory=str(tmp_path))
+    qobuz.client, calls = _client(["5", "4", "3", "2", "1"])
+
+    assert sync_favorites(qobuz, ["albums"]) == 5
+    # oldest first
+    assert [c.args[0] for c in qobuz.download_from_id.call_args_list] == [
+        "1",
+        "2",
+        "3",
+        "4",
+        "5",
+    ]
+
+    qobuz.download_from_id.reset_mock()
+    qobuz.client, calls = _client(["7", "6", "5", "4", "3", "2", "1"])
+    assert sync_favorites(qobuz, ["albums"]) == 2
+    assert [c.args[0] for c in qobuz.download_from_id.call_args_list] == ["6", "7"]
+    # stopped at the first page without new items
+    assert calls == [0, 2]
+
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert len(state["favorites"]["albums"]) == 7
+
+
+def test_failed_favorites_are_tried_again(tmp_path):
+    qobuz = MagicMock(directory=str(tmp_path))
+    qobuz.client, _ = _client(["1"])
+    qobuz.download_from_id.return_value = False
+
+    assert sync_favorites(qobuz, ["albums"]) == 0
+    qobuz.download_from_id.return_value = True
+    assert sync_favorites(qobuz, ["albums"]) == 1
+
+
+def test_incomplete_favorites_are_kept_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync, "PAGE_SIZE", 2)
+    qobuz = MagicMock(directory=str(tmp_path), retry_queue=[])
+    qobuz.client, _ = _client(["3", "2", "1"])
+
+    failing = {"2"}
+
+    def download(item_id, **kwargs):
+        if item_id in failing:
+            qobuz.retry_queue.append((item_id, ["failed track"], True))
+        return True
+
+    qobuz.download_from_id.side_effect = download
+    assert sync_favorites(qobuz, ["albums"]) == 2
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["favorites"]["albums"] == ["1", "3"]
+    assert state["pending_favorites"]["albums"] == ["2"]
+
+    # the first page has nothing new, but the incomplete album is retried
+    failing.clear()
+    qobuz.download_from_id.reset_mock()
+    assert sync_favorites(qobuz, ["albums"]) == 1
+    assert [c.args[0] for c in qobuz.download_from_id.call_args_list] == ["2"]
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["favorites"]["albums"] == ["1", "2", "3"]
+    assert state["pending_favorites"]["albums"] == []
+
+
+def test_only_changed_playlists_are_synced(tmp_path):
+    qobuz = MagicMock(directory=str(tmp_path))
+    qobuz.worker.return_value.retry_queue = []
+    qobuz.worker.return_value.mover.failures = 0
+    playlists = [
+        {"id": 1, "name": "a", "updated_at": 10, "tracks_count": 5},
+        {"id": 2, "name": "b", "updated_at": 10, "tracks_count": 5},
+    ]
+    qobuz.client.get_user_playlists.side_effect = lambda limit, offset: {
+        "playlists": {"total": len(playlists), "items": playlists[offset:]}
+    }
+
+    assert sync_playlists(qobuz, workers=2) == 2
+    worker = qobuz.worker.return_value
+    worker.handle_url.reset_mock()
+    assert sync_playlists(qobuz) == 0
+
+    playlists[1] = dict(playlists[1], tracks_count=6)
+    del playlists[0]
+    assert sync_playlists(qobuz) == 1
+    worker.handle_url.assert_called_once_with("https://play.qobuz.com/playlist/2")
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["playlists"] == {"2": "10:6"}
+
+
+def test_playlists_with_failed_tracks_are_synced_again(tmp_path):
+    qobuz = MagicMock(directory=str(tmp_path), retry_queue=[])
+    qobuz.client.get_user_playlists.return_value = {
+        "playlists": {
+            "total": 1,
+            "items": [{"id": 1, "name": "a", "updated_at": 10, "tracks_count": 5}],
+        }
+    }
+    failed = ("track1", ["failed track"], False)
+    qobuz.worker.return_value.retry_queue = [failed]
+    qobuz.worker.return_value.mover.failures = 0
+
+    assert sync_playlists(qobuz) == 0
+    assert qobuz.retry_queue == [failed]
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["playlists"] == {}
+
+    qobuz.worker.return_value.retry_queue = []
+    assert sync_playlists(qobuz) == 1
+
+
+def test_playlists_with_unmoved_files_are_synced_again(tmp_path):
+    from unittest.mock import patch
+
+    from qobuz_dj.staging import Mover
+
+    qobuz = MagicMock(directory=str(tmp_path), retry_queue=[])
+    qobuz.client.get_user_playlists.return_value = {
+        "playlists": {
+            "total": 1,
+            "items": [{"id": 1, "name": "a", "updated_at": 10, "tracks_count": 5}],
+        }
+    }
+    worker = qobuz.worker.return_value
+    worker.retry_queue = []
+    worker.mover = Mover()
+    staged = tmp_path / "staged"
+    staged.write_bytes(b"audio")
+
+    def handle_url(url):
+        # the flush of the release (see `_finish_release`) reports the failure
+        worker.mover.move(str(staged), str(tmp_path / "missing" / "1.flac"))
+        worker.mover.flush()
+
+    worker.handle_url.side_effect = handle_url
+
+    with patch("qobuz_dj.staging._same_filesystem", return_value=False):
+        assert sync_playlists(qobuz) == 0
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["playlists"] == {}
+
+
+def test_workers_keep_their_own_state(tmp_path):
+    from qobuz_dj.core import QobuzDL
+
+    qobuz = QobuzDL(str(tmp_path), folder_format="{album}")
+    qobuz.client = MagicMock()
+    worker = qobuz.worker()
+    worker.folder_format = "."
+    worker.retry_queue.append(("1", [], True))
+
+    assert qobuz.folder_format == "{album}" and not qobuz.retry_queue
+    assert worker.mover is not qobuz.mover
+    assert worker.new_download("1").mover is worker.mover
+
+
+def _discography(dates):
+    """Pages of two albums, newest first, IDs "a<date>"."""
+    pages = []
+    for start in range(0, len(dates), 2):
+        items = [
+            {"id": f"a{d}", "release_date_original": d}
+            for d in dates[start : start + 2]
+        ]
+        pages.append({"name": "Label", "albums": {"items": items}})
+    return pages
+
+
+def _albums(pages):
+    return [QueueItem.from_dict(a) for p in pages for a in p["albums"]["items"]]
+
+
+def test_since_last_stops_at_known_releases(tmp_path):
+    dates = ["2024-05-01", "2024-04-01", "2023-01-01", "2022-01-01", "2021-01-01"]
+    first = sync.Watermark(sync.SyncState(tmp_path), "label/1")
+    pages = list(first.pages(iter(_discography(dates[2:]))))
+    assert len(pages) == 2  # first run walks everything
+    for album in first.unseen(_albums(pages)):
+        first.add(album.id, album.release_date)
+    first.save()
+
+    fetched = []
+
+    def source():
+        for page in _discography(dates):
+            fetched.append(page)
+            yield page
+
+    again = sync.Watermark(sync.SyncState(tmp_path), "label/1")
+    pages = list(again.pages(source()))
+    new = [album.id for album in again.unseen(_albums(pages))]
+    assert new == ["a2024-05-01", "a2024-04-01"]
+    assert len(fetched) == 2  # the last page is never requested
+
+
+def _album(album_id, date, bit_depth=16, title="Album"):
+    return {
+        "id": album_id,
+        "title": title,
+        "version": None,
+        "maximum_bit_depth": bit_depth,
+        "maximum_sampling_rate": 44.1,
+        "release_date_original": date,
+        "artist": {"name": "Artist"},
+    }
+
+
+def test_since_last_with_out_of_order_pages(tmp_path):
+    state = sync.SyncState(tmp_path)
+    state.set("sources", "artist/1", {"ids": ["hires"], "newest": "2020-01-01"})
+    # a new CD-quality reissue listed before the new single, and the 24-bit
+    # version downloaded by the last run on the same page as an old album
+    pages = [
+        {
+            "name": "Artist",
+            "albums": {
+                "items": [
+                    _album("reissue", "2023-01-01"),
+                    _album("single", "2024-01-01", title="Single"),
+                ]
+            },
+        },
+        {
+            "name": "Artist",
+            "albums": {
+                "items": [
+                    _album("old", "2019-01-01", title="Old"),
+                    _album("hires", "2020-01-01", bit_depth=24),
+                ]
+            },
+        },
+        {"name": "Artist", "albums": {"items": [_album("never", "2010-01-01")]}},
+    ]
+    watermark = sync.Watermark(state, "artist/1")
+    fetched = list(watermark.pages(iter(pages)))
+    assert fetched == pages[:2]
+
+    # the filter sees the 24-bit version, so the reissue isn't picked
+    items = smart_discography_filter(fetched, save_space=True, skip_extras=True)
+    new = sorted(item.id for item in watermark.unseen(items))
+    assert new == ["old", "single"]
+
+
+def test_since_last_saves_complete_releases_into_the_sync_state(tmp_path, monkeypatch):
+    from qobuz_dj.core import QobuzDL
+
+    qobuz = QobuzDL(str(tmp_path), since_last=True)
+    qobuz.client = MagicMock()
+    page = {
+        "name": "Label",
+        "albums": {
+            "items": [
+                _album("complete", "2024-01-01"),
+                _album("incomplete", "2023-01-01", title="Other"),
+            ]
+        },
+    }
+    qobuz.client.get_label_meta.return_value = iter([page])
+
+    def download_from_id(item_id, *args, **kwargs):
+        if item_id == "incomplete":
+            qobuz.retry_queue.append((item_id, [], True))
+        return True
+
+    monkeypatch.setattr(qobuz, "download_from_id", download_from_id)
+    # a sync running the URL, which saves its own progress afterwards
+    state = qobuz.sync_state = sync.SyncState(tmp_path)
+    qobuz.handle_url("https://play.qobuz.com/label/1")
+    state.set("favorites", "artists", ["1"])
+
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["sources"]["label/1"]["ids"] == ["complete"]
+    assert state["favorites"] == {"artists": ["1"]}
+
+
+def test_artist_favorites_with_failed_releases_are_kept_apart(tmp_path, monkeypatch):
+    from qobuz_dj.core import QobuzDL
+
+    qobuz = QobuzDL(str(tmp_path))
+    qobuz.client = MagicMock()
+    qobuz.client.get_favorite_artists.return_value = {
+        "artists": {"total": 1, "items": [{"id": 1}]}
+    }
+    page = {
+        "name": "Artist",
+        "albums": {"items": [_album("ok", "2024-01-01"), _album("gone", "2023-01-01")]},
+    }
+    qobuz.client.get_artist_meta.side_effect = lambda *a, **kw: iter([page])
+
+    # "gone" can't be fetched at all: nothing goes to the retry queue
+    monkeypatch.setattr(
+        qobuz, "download_from_id", lambda item_id, *a, **kw: item_id != "gone"
+    )
+    assert not qobuz.handle_url("https://play.qobuz.com/artist/1")
+    assert sync_favorites(qobuz, ["artists"]) == 0
+    state = json.loads((tmp_path / STATE_FILE).read_text())
+    assert state["pending_favorites"]["artists"] == ["1"]
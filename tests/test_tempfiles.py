@@ -0,0 +1,71 @@
+import json
+
+from qobuz_dj import tempfiles
+from qobuz_dj.tempfiles import STATE_FILE, TempFiles
+
+
+def test_cleanup_only_touches_registered_files(tmp_path):
+    registry = TempFiles(interval=0)
+    registry.attach(str(tmp_path))
+    active = tmp_path / ".01.tmp"
+    done = tmp_path / ".02.tmp"
+    other = tmp_path / "album" / ".03.tmp"
+    other.parent.mkdir()
+    for path in (active, done, other):
+        path.write_bytes(b"x")
+        registry.register(str(path))
+    registry.release(str(done))
+    registry.release(str(other))
+
+    assert json.loads((tmp_path / STATE_FILE).read_text()) == [str(active)]
+    registry.cleanup()
+    assert not active.exists()
+    assert done.exists() and other.exists()
+    assert not (tmp_path / STATE_FILE).exists()
+
+
+def test_state_file_is_saved_at_intervals(tmp_path):
+    from unittest.mock import patch
+
+    registry = TempFiles(interval=60)
+    registry.attach(str(tmp_path))
+    with patch.object(registry, "_save", wraps=registry._save) as save:
+        for i in range(20):
+            registry.register(str(tmp_path / f".{i}.tmp"))
+            registry.release(str(tmp_path / f".{i}.tmp"))
+    # the first registration of the run, then nothing for 60 seconds
+    assert save.call_count == 1
+    assert json.loads((tmp_path / STATE_FILE).read_text()) == [str(tmp_path / ".0.tmp")]
+
+
+def test_leftovers_of_an_interrupted_run_are_removed(tmp_path):
+    leftover = tmp_path / ".01.tmp"
+    leftover.write_bytes(b"x")
+    (tmp_path / STATE_FILE).write_text(json.dumps([str(leftover)]))
+
+    TempFiles().attach(str(tmp_path))
+    assert not leftover.exists()
+    assert not (tmp_path / STATE_FILE).exists()
+
+
+def test_sweep_walks_the_whole_tree(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "b" / ".01.tmp").write_bytes(b"x")
+    (tmp_path / ".02.tmp").write_bytes(b"x")
+    (tmp_path / "song.flac").write_bytes(b"x")
+
+    assert tempfiles.sweep(str(tmp_path)) == 2
+    assert (tmp_path / "song.flac").exists()
+
+
+def test_sweep_removes_registered_files_outside_the_tree(tmp_path):
+    staged = tmp_path / "staging" / ".abc.flac"
+    staged.parent.mkdir()
+    staged.write_bytes(b"x")
+    library = tmp_path / "library"
+    library.mkdir()
+    (library / STATE_FILE).write_text(json.dumps([str(staged)]))
+
+    assert tempfiles.sweep(str(library)) == 1
+    assert not staged.exists()
+    assert not (library / STATE_FILE).exists()
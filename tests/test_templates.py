@@ -0,0 +1,49 @@
+import pytest
+
+from qobuz_dj import templates
+from qobuz_dj.downloader import (
+    DEFAULT_FOLDER,
+    DEFAULT_FORMATS,
+    DEFAULT_TRACK,
+    _templates_for,
+)
+from qobuz_dj.exceptions import InvalidTemplate
+
+
+def test_defaults_are_valid():
+    templates.folder(DEFAULT_FOLDER)
+    templates.track(DEFAULT_TRACK)
+    for folder, track in DEFAULT_FORMATS.values():
+        templates.folder(folder)
+        templates.track(track)
+
+
+def test_invalid_templates_fail_up_front():
+    with pytest.raises(InvalidTemplate, match="tracknumber"):
+        templates.folder("{artist} - {tracknumber}")
+    with pytest.raises(InvalidTemplate):
+        templates.track("{tracknumber}. {title")
+    with pytest.raises(InvalidTemplate):
+        templates.track("{0}")
+
+
+def test_render():
+    template = templates.track("{tracknumber}. {tracktitle} {version}.flac")
+    assert template.pattern == "{tracknumber}. {tracktitle} {version}"
+    assert template.render({"tracknumber": "01", "tracktitle": "Song"}) == "01. Song "
+    assert templates.track(DEFAULT_TRACK) is templates.track(DEFAULT_TRACK)
+
+
+def test_quality_keys_fall_back_for_mp3():
+    folder = templates.folder(DEFAULT_FOLDER)
+    track = templates.track("{tracknumber}. {tracktitle}")
+    mp3_folder, mp3_track = _templates_for(folder, track, "MP3")
+    assert mp3_folder.pattern == DEFAULT_FORMATS["MP3"][0]
+    assert mp3_track is track
+    assert _templates_for(folder, track, "FLAC") == (folder, track)
+
+
+def test_single_track_folders_can_use_the_title():
+    template = templates.folder("{artist} - {tracktitle}")
+    assert template.render({"artist": "A", "tracktitle": "Song"}) == "A - Song"
+    assert template.render({"artist": "A"}) == "A - "
@@ -1,3 +1,4 @@
+import os
 from unittest.mock import patch
 
 import pytest
@@ -65,3 +66,189 @@ def test_get_url_info_none_match():
     with patch("re.search", return_value=None):
         with pytest.raises(IndexError):
             get_url_info("https://open.qobuz.com/album/123")
+
+
+# --- sanitize tests ---
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, no padding: 417 bytes per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def _make_mp3(path, artist=None, title=None, year=None, frames=8):
+    from mutagen.id3 import ID3, TDRC, TIT2, TPE1
+
+    path.write_bytes(MP3_FRAME * frames)
+    tags = ID3()
+    if artist:
+        tags.add(TPE1(encoding=3, text=artist))
+    if title:
+        tags.add(TIT2(encoding=3, text=title))
+    if year:
+        tags.add(TDRC(encoding=3, text=year))
+    tags.save(str(path))
+    return path
+
+
+def test_build_sanitize_plan_numbers_sequentially(tmp_path):
+    from qobuz_dj.utils import build_sanitize_plan
+
+    (tmp_path / "sub").mkdir()
+    _make_mp3(tmp_path / "b.mp3", "Artist B", "Song B", "2021")
+    _make_mp3(tmp_path / "a.mp3", "Artist A", "Song A", "1999-05-01")
+    _make_mp3(tmp_path / "sub" / "c.mp3")
+
+    plan = build_sanitize_plan(str(tmp_path), workers=2)
+
+    assert [os.path.basename(new) for _, new in plan] == [
+        "01 - Artist A - Song A (1999).mp3",
+        "02 - Artist B - Song B (2021).mp3",
+        "03 - Unknown Artist - Unknown Title (0000).mp3",
+    ]
+    # nothing is renamed while planning
+    assert (tmp_path / "a.mp3").exists()
+    assert os.path.dirname(plan[2][1]) == str(tmp_path / "sub")
+
+
+def test_apply_rename_plan_swapped_names(tmp_path):
+    from qobuz_dj.utils import apply_rename_plan
+
+    first = tmp_path / "01 - x.mp3"
+    second = tmp_path / "02 - y.mp3"
+    first.write_bytes(b"first")
+    second.write_bytes(b"second")
+
+    renamed, errors, final = apply_rename_plan(
+        [(str(first), str(second)), (str(second), str(first))]
+    )
+
+    assert (renamed, errors) == (2, 0)
+    assert final == [str(second), str(first)]
+    assert second.read_bytes() == b"first"
+    assert first.read_bytes() == b"second"
+    assert not list(tmp_path.glob(".*.sztmp"))
+
+
+def test_apply_rename_plan_keeps_existing_target(tmp_path):
+    from qobuz_dj.utils import apply_rename_plan
+
+    source = tmp_path / "source.mp3"
+    target = tmp_path / "target.mp3"
+    source.write_bytes(b"source")
+    target.write_bytes(b"unrelated")
+
+    renamed, errors, final = apply_rename_plan([(str(source), str(target))])
+
+    assert (renamed, errors) == (0, 1)
+    assert final == [str(source)]
+    assert source.read_bytes() == b"source"
+    assert target.read_bytes() == b"unrelated"
+
+
+def test_sanitize_directory_dry_run(tmp_path):
+    from qobuz_dj.utils import sanitize_directory
+
+    _make_mp3(tmp_path / "a.mp3", "Artist", "Song", "2020")
+
+    sanitize_directory(str(tmp_path), dry_run=True)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.mp3"]
+
+
+# --- smart_discography_filter tests ---
+
+
+def _album(id_, title, bit_depth=16, sampling_rate=44.1, artist="Artist", **kwargs):
+    return {
+        "id": id_,
+        "title": title,
+        "maximum_bit_depth": bit_depth,
+        "maximum_sampling_rate": sampling_rate,
+        "artist": {"name": artist},
+        **kwargs,
+    }
+
+
+def _pages(*pages):
+    return iter({"name": "Artist", "albums": {"items": list(p)}} for p in pages)
+
+
+def test_smart_discography_filter_reads_every_page():
+    from qobuz_dj.utils import smart_discography_filter
+
+    items = smart_discography_filter(
+        _pages([_album(1, "First")], [_album(2, "Second")])
+    )
+
+    assert [i.id for i in items] == [1, 2]
+
+
+def test_smart_discography_filter_groups_across_pages():
+    from qobuz_dj.utils import smart_discography_filter
+
+    items = smart_discography_filter(
+        _pages(
+            [_album(1, "Album"), _album(2, "Album (Live)", 24, 96.0)],
+            [_album(3, "Album", 24, 96.0, version="Remastered"), _album(4, "Other")],
+            [_album(5, "Album", 24, 48.0, version="Remastered")],
+        ),
+        save_space=True,
+        skip_extras=True,
+    )
+
+    assert [i.id for i in items] == [5, 4]
+
+
+def test_smart_discography_filter_other_artists_and_dates():
+    from qobuz_dj.utils import smart_discography_filter
+
+    items = smart_discography_filter(
+        _pages(
+            [
+                _album(1, "Album", release_date_original="2001-01-01"),
+                _album(2, "Album", release_date_original="2011-01-01"),
+                _album(3, "Feature", artist="Someone Else"),
+            ]
+        )
+    )
+
+    assert [i.id for i in items] == [2]
+
+
+def test_build_sanitize_plan_numbers_unparseable_files(tmp_path, monkeypatch):
+    from qobuz_dj import utils
+
+    _make_mp3(tmp_path / "a.mp3", "Artist A", "Song A", "2000")
+    _make_mp3(tmp_path / "b.mp3", "Artist B", "Song B", "2001")
+    scan = utils.scan_mp3
+
+    def broken(path, *args, **kwargs):
+        if path.endswith("a.mp3"):
+            raise ValueError("malformed frame")
+        return scan(path, *args, **kwargs)
+
+    monkeypatch.setattr(utils, "scan_mp3", broken)
+    plan = utils.build_sanitize_plan(str(tmp_path))
+
+    assert [os.path.basename(new) for _, new in plan] == [
+        "01 - Unknown Artist - Unknown Title (0000).mp3",
+        "02 - Artist B - Song B (2001).mp3",
+    ]
+
+
+def test_recover_renames_after_interrupted_plan(tmp_path):
+    import json
+
+    from qobuz_dj.utils import recover_renames
+
+    tmp = tmp_path / ".000000-1.sztmp"
+    tmp.write_bytes(b"audio")
+    taken = tmp_path / "01 - x.mp3"
+    taken.write_bytes(b"other")
+    journal = tmp_path / ".qobuz-dj-rename.json"
+    # files go back to their original name first
+    journal.write_text(json.dumps([[str(tmp), str(tmp_path / "old.mp3"), str(taken)]]))
+
+    assert recover_renames(str(journal)) == 1
+    assert (tmp_path / "old.mp3").read_bytes() == b"audio"
+    assert taken.read_bytes() == b"other"
+    assert not journal.exists()
@@ -0,0 +1,113 @@
+import pytest
+
+from qobuz_dj.exceptions import IntegrityError
+from qobuz_dj.verify import FLACVerifier, MP3Verifier, _crc8, _crc16
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz: 417 bytes per frame
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+ID3_HEADER = b"ID3\x03\x00\x00\x00\x00\x00\x0a" + b"\x00" * 10
+
+
+def _feed(verifier, data, chunk=1000):
+    for i in range(0, len(data), chunk):
+        verifier.update(data[i : i + chunk])
+    verifier.finish()
+
+
+def _flac_bytes(total_samples=0):
+    info = (44100 << 44) | (1 << 41) | (15 << 36) | total_samples
+    streaminfo = b"\x10\x00\x10\x00" + b"\x00" * 6 + info.to_bytes(8, "big")
+    return b"fLaC\x80\x00\x00\x22" + streaminfo + b"\x00" * 16
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 1024])
+def test_mp3_verifier_accepts_clean_stream(chunk):
+    verifier = MP3Verifier()
+    _feed(verifier, ID3_HEADER + MP3_FRAME * 20 + b"TAG" + b"\x00" * 125, chunk)
+    assert verifier.frames == 20
+
+
+def test_mp3_verifier_detects_lost_sync():
+    corrupted = MP3_FRAME * 5 + MP3_FRAME[:200] + MP3_FRAME * 5
+    with pytest.raises(IntegrityError, match="sync lost"):
+        _feed(MP3Verifier(), corrupted)
+
+
+def test_mp3_verifier_rejects_garbage_after_the_last_frame():
+    with pytest.raises(IntegrityError, match="garbage"):
+        _feed(MP3Verifier(), MP3_FRAME * 10 + b"\x00" * (100 * 1024))
+
+
+def test_mp3_verifier_accepts_ape_and_id3v1_tags():
+    items = b"x" * 40
+    footer = b"APETAGEX" + (2000).to_bytes(4, "little")
+    footer += (len(items) + 32).to_bytes(4, "little") + bytes(4)
+    footer += (1 << 31).to_bytes(4, "little") + bytes(8)
+    ape = footer + items + footer  # header, items, footer
+    verifier = MP3Verifier()
+    verifier.update(MP3_FRAME * 10 + ape + b"TAG" + bytes(125))
+    verifier.finish()
+
+
+def test_mp3_verifier_rejects_a_truncated_last_frame():
+    verifier = MP3Verifier()
+    verifier.update(MP3_FRAME * 10 + MP3_FRAME[:300])
+    with pytest.raises(IntegrityError, match="truncated"):
+        verifier.finish()
+
+
+def test_mp3_verifier_rejects_non_mpeg_data():
+    with pytest.raises(IntegrityError):
+        _feed(MP3Verifier(), b"<html>Not found</html>" * 100)
+
+
+def _flac_frame(number, samples=4096, audio=bytes(range(200))):
+    # fixed block size, 44.1 kHz, stereo, 16 bits
+    header = b"\xff\xf8" + bytes([0xC9 if samples == 4096 else 0x79, 0x18, number])
+    if samples != 4096:
+        header += (samples - 1).to_bytes(2, "big")
+    frame = header + bytes([_crc8(header)]) + audio
+    return frame + _crc16(frame).to_bytes(2, "big")
+
+
+def test_flac_verifier_checks_structure():
+    _feed(FLACVerifier(), _flac_bytes() + _flac_frame(0), chunk=5)
+
+    with pytest.raises(IntegrityError, match="marker"):
+        _feed(FLACVerifier(), b"<html>" + b"\x00" * 100)
+    with pytest.raises(IntegrityError, match="no FLAC frame"):
+        _feed(FLACVerifier(), _flac_bytes() + b"\x00" * 100)
+
+
+def test_flac_verifier_detects_truncated_stream():
+    frames = [_flac_frame(0), _flac_frame(1), _flac_frame(2, samples=1000)]
+    stream = _flac_bytes(total_samples=2 * 4096 + 1000) + b"".join(frames)
+    _feed(FLACVerifier(), stream, chunk=7)
+
+    # cut between frames, and inside the last one
+    with pytest.raises(IntegrityError, match="ends at sample 8192 of 9192"):
+        _feed(FLACVerifier(), stream[: -len(frames[2])])
+    with pytest.raises(IntegrityError, match="incomplete"):
+        _feed(FLACVerifier(), stream[:-50])
+
+
+def test_flac_verifier_detects_corrupted_frames():
+    # the second frame holds a frame sync pattern with a valid header
+    fake = _flac_frame(1)[:7]
+    frames = [_flac_frame(0), _flac_frame(1, audio=fake * 30)]
+    frames += [_flac_frame(n) for n in range(2, 6)]
+    stream = _flac_bytes(total_samples=6 * 4096) + b"".join(frames)
+    verifier = FLACVerifier()
+    _feed(verifier, stream, chunk=7)
+    assert verifier.frames == 5  # and the last one, checked by finish()
+
+    middle = len(stream) - len(b"".join(frames[3:])) + 100
+    corrupted = stream[:middle] + b"\x00" + stream[middle + 1 :]
+    with pytest.raises(IntegrityError, match="frame 3 is corrupted"):
+        _feed(FLACVerifier(), corrupted)
+
+    # the header of a frame is corrupted: the frame before it never ends
+    start = len(stream) - len(b"".join(frames[3:]))
+    corrupted = stream[:start] + b"\x00" + stream[start + 1 :]
+    with pytest.raises(IntegrityError, match=r"\(2\) is incomplete or corrupted"):
+        _feed(FLACVerifier(), corrupted)